@@ -4,12 +4,21 @@ import os
 
 import argparse
 
-from bridge.bridge import Tuya2MqttBridge
+from bridge.bridge import Tuya2MqttBridge, MultiDeviceBridge, ENGINE_SELECTOR, ENGINE_ASYNCIO, PUBLISH_MODE_STATE
+from bridge.history import HistoryRecorder
+from bridge.inventory import DeviceInventory, load_device_inventory
+from bridge.state_cache import STATE_CACHES
+from bridge.state_store import StateStore
+from generic import register_on_exit_action
 from generic.config import set_active_config
 from generic.config_logging import init_logging
+from generic.metrics import start_metrics_server
 
 from moes.MoesThermostat import MoesBhtThermostat
+from moes.device_models import DEFAULT_MODEL
+from mqtt.mqtt_broker import EmbeddedMqttBroker
 from mqtt.mqtt_server import MqttClient
+from mqtt.publish_queue import PublishQueue, TopicPolicy
 
 ##########################################################################################################
 
@@ -19,13 +28,33 @@ def run_app(args: argparse.Namespace):
     active_config = set_active_config(args.target_env, args.app_name)
     logging = init_logging(active_config)
 
+    history = start_history(args, active_config)
+
+    if active_config.config.metrics_port:
+        routes = {'/state': STATE_CACHES.handle_http}
+        if history is not None:
+            routes['/history'] = history.handle_http
+        try:
+            start_metrics_server(port=active_config.config.metrics_port, routes=routes)
+        except OSError as e:
+            logging.error(f'Failed to serve metrics on port [{active_config.config.metrics_port}]: [{e}]')
+
+    state_store = start_state_store(active_config)
+    start_embedded_broker(args, logging)
+
+    if getattr(args, 'devices_file', None):
+        return run_multi_device_app(args, logging, active_config, state_store, history)
+
     logging.info(f'\n{log_startup_data(args)}\n')
     logging.info('>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>')
     logging.info('>> START: TUYA SERVICE: Setup >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>')
 
     thermostat = MoesBhtThermostat(name=args.tuya_dev_name,
                                    tuya_id=args.tuya_dev_id, local_ip=args.tuya_dev_ip,
-                                   tuya_local_key=args.tuya_dev_local_key)
+                                   tuya_local_key=args.tuya_dev_local_key,
+                                   model=getattr(args, 'tuya_dev_model', None) or DEFAULT_MODEL,
+                                   full_status_get_min_seconds=active_config.config.full_status_get_min_seconds,
+                                   full_status_get_max_seconds=active_config.config.full_status_get_max_seconds)
 
     logging.info('')
     logging.info('<< END: TUYA SERVICE: Setup <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<')
@@ -35,33 +64,143 @@ def run_app(args: argparse.Namespace):
                              broker_address=args.mqtt_broker_addr, broker_port=args.mqtt_broker_port,
                              username=args.mqtt_user, password=args.mqtt_password,
                              tls_cert_path=args.mqtt_tls_path,
-                             topic_root=args.mqtt_topic_root)
+                             topic_root=args.mqtt_topic_root,
+                             publish_queue=create_publish_queue(active_config))
 
     logging.info('')
     logging.info('<< END: Mqtt SERVICE: Setup <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<')
     logging.info('>> START: BRIDGE >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>')
 
-    bridge = Tuya2MqttBridge(tuya_device=thermostat, mqtt_client=mqtt_client)
+    bridge = Tuya2MqttBridge(tuya_device=thermostat, mqtt_client=mqtt_client,
+                             publish_mode=getattr(args, 'publish_mode', None) or PUBLISH_MODE_STATE,
+                             state_cache_ttl_seconds=active_config.config.state_cache_ttl_seconds,
+                             state_store=state_store, history=history)
+    if getattr(args, 'tuya_engine', None) == ENGINE_ASYNCIO:
+        MultiDeviceBridge(bridges=[bridge], mqtt_client=mqtt_client, engine=ENGINE_ASYNCIO).start()
+    else:
+        bridge.start()
+
+    logging.info('')
+    logging.info('<< END: BRIDGE <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<')
+    logging.info('<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<')
+
+
+def run_multi_device_app(args: argparse.Namespace, logging, active_config, state_store: StateStore | None = None,
+                         history: HistoryRecorder | None = None):
+    inventory = load_device_inventory(args.devices_file)
+
+    logging.info(f'\n{log_multi_device_startup_data(args, inventory)}\n')
+    logging.info('>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>')
+    logging.info('>> START: Mqtt SERVICE: Setup >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>')
+
+    mqtt_client = MqttClient(name=args.mqtt_broker_name,
+                             broker_address=args.mqtt_broker_addr, broker_port=args.mqtt_broker_port,
+                             username=args.mqtt_user, password=args.mqtt_password,
+                             tls_cert_path=args.mqtt_tls_path,
+                             topic_root=inventory.topic_prefix,
+                             publish_queue=create_publish_queue(active_config))
+
+    logging.info('')
+    logging.info('<< END: Mqtt SERVICE: Setup <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<')
+    logging.info('>> START: TUYA SERVICE: Setup >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>')
+
+    bridges = []
+    for device in inventory.devices:
+        thermostat = MoesBhtThermostat(name=device.name,
+                                       tuya_id=device.tuya_id, local_ip=device.local_ip,
+                                       tuya_local_key=device.tuya_local_key, model=device.model, port=device.port,
+                                       full_status_get_min_seconds=active_config.config.full_status_get_min_seconds,
+                                       full_status_get_max_seconds=active_config.config.full_status_get_max_seconds)
+        bridges.append(Tuya2MqttBridge(tuya_device=thermostat, mqtt_client=mqtt_client,
+                                       topic_root=inventory.topic_root_of(device),
+                                       publish_mode=args.publish_mode or PUBLISH_MODE_STATE,
+                                       state_cache_ttl_seconds=active_config.config.state_cache_ttl_seconds,
+                                       state_store=state_store, history=history))
+
+    logging.info('')
+    logging.info('<< END: TUYA SERVICE: Setup <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<')
+    logging.info('>> START: BRIDGE >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>')
+
+    bridge = MultiDeviceBridge(bridges=bridges, mqtt_client=mqtt_client, engine=args.tuya_engine or ENGINE_SELECTOR)
     bridge.start()
 
     logging.info('')
     logging.info('<< END: BRIDGE <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<')
     logging.info('<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<')
 
+def create_publish_queue(active_config) -> PublishQueue:
+    return PublishQueue(max_size=active_config.config.mqtt_publish_queue_size,
+                        overflow_policy=active_config.config.mqtt_publish_overflow_policy,
+                        topic_policies=[(pattern, TopicPolicy(**policy)) for pattern, policy in active_config.config.mqtt_topic_policies])
+
+def start_state_store(active_config) -> StateStore | None:
+    if not active_config.config.state_store_path:
+        return None
+
+    state_store = StateStore(active_config.config.state_store_path.format(app_name=active_config.app_name))
+    state_store.start()
+    register_on_exit_action(state_store.stop)
+    return state_store
+
+def start_history(args: argparse.Namespace, active_config) -> HistoryRecorder | None:
+    history_path = getattr(args, 'history_path', None) or active_config.config.history_path
+    if not history_path:
+        return None
+
+    history = HistoryRecorder(history_path.format(app_name=active_config.app_name),
+                              retention_days=active_config.config.history_retention_days).start()
+    register_on_exit_action(history.stop)
+    return history
+
+def start_embedded_broker(args: argparse.Namespace, logging) -> EmbeddedMqttBroker | None:
+    """The embedded mqtt broker (mqtt_embedded_broker), listening on the broker address / port: the bridge connects
+    to it over the loopback, like any other client."""
+    if not getattr(args, 'mqtt_embedded_broker', False):
+        return None
+
+    listen_addr = args.mqtt_broker_addr or '127.0.0.1'
+    broker = EmbeddedMqttBroker(host=listen_addr, port=args.mqtt_broker_port,
+                                username=args.mqtt_user, password=args.mqtt_password).start()
+    register_on_exit_action(broker.stop)
+
+    if args.mqtt_tls_path:
+        logging.warning(f'The embedded mqtt broker does not support TLS, [{args.mqtt_tls_path}] ignored')
+        args.mqtt_tls_path = None
+    args.mqtt_broker_addr = '127.0.0.1' if listen_addr in ('0.0.0.0', '::') else listen_addr
+    return broker
+
 ##########################################################################################################
 
 def log_startup_data(args: argparse.Namespace):
     return (
         '=================================================================\n'
         f'TUYA: [{args.tuya_dev_name}]:\n'
-        f' * id = [{args.tuya_dev_id}] / ip = [{args.tuya_dev_ip}]\n'
+        f' * id = [{args.tuya_dev_id}] / ip = [{args.tuya_dev_ip}] / model = [{getattr(args, "tuya_dev_model", None) or DEFAULT_MODEL}]\n'
         f' * local key = [{"*" * len(args.tuya_dev_local_key)}]\n'
         f'<<<<<<--------------------------------------->>>>>>\n'
         f'MQTT: [{args.mqtt_broker_name}]:\n'
-        f' * addr = [{args.mqtt_broker_addr}]:[{args.mqtt_broker_port}]\n'
+        f' * addr = [{args.mqtt_broker_addr}]:[{args.mqtt_broker_port}]{" | embedded broker" if getattr(args, "mqtt_embedded_broker", False) else ""}\n'
+        f' * auth = [{args.mqtt_user}]/[{"*" * len(args.mqtt_password)}]\n'
+        f' * tls file = [{args.mqtt_tls_path if args.mqtt_tls_path else "NONE"}]\n'
+        f' * topic root = [{args.mqtt_topic_root}] | publish mode = [{getattr(args, "publish_mode", None) or PUBLISH_MODE_STATE}]\n'
+        '=================================================================\n'
+    )
+
+def log_multi_device_startup_data(args: argparse.Namespace, inventory: DeviceInventory):
+    devices = ''.join(
+        f' * [{device.name}]: id = [{device.tuya_id}] / ip = [{device.local_ip}] / model = [{device.model}] / topic root = [{inventory.topic_root_of(device)}]\n'
+        for device in inventory.devices
+    )
+    return (
+        '=================================================================\n'
+        f'TUYA: [{len(inventory.devices)}] devices from [{args.devices_file}] | engine = [{args.tuya_engine or ENGINE_SELECTOR}]:\n'
+        f'{devices}'
+        f'<<<<<<--------------------------------------->>>>>>\n'
+        f'MQTT: [{args.mqtt_broker_name}]:\n'
+        f' * addr = [{args.mqtt_broker_addr}]:[{args.mqtt_broker_port}]{" | embedded broker" if getattr(args, "mqtt_embedded_broker", False) else ""}\n'
         f' * auth = [{args.mqtt_user}]/[{"*" * len(args.mqtt_password)}]\n'
         f' * tls file = [{args.mqtt_tls_path if args.mqtt_tls_path else "NONE"}]\n'
-        f' * topic root = [{args.mqtt_topic_root}]\n'
+        f' * topic prefix = [{inventory.topic_prefix}] | publish mode = [{args.publish_mode or PUBLISH_MODE_STATE}]\n'
         '=================================================================\n'
     )
 
@@ -0,0 +1,491 @@
+#!/usr/bin/env python
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import logging
+from dataclasses import dataclass, field, asdict
+
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.enums import MQTTErrorCode
+
+from bridge.bridge import Tuya2MqttBridge, MultiDeviceBridge, ENGINE_SELECTOR, ENGINE_ASYNCIO
+from generic import serializers
+from generic.version import VERSION
+from moes.MoesThermostat import MoesBhtThermostat
+from mqtt.mqtt_broker import EmbeddedMqttBroker, topic_matches
+from mqtt.mqtt_server import MqttClient, TOPIC_STATE, TOPIC_RESULT
+from mqtt.publish_queue import PublishQueue
+from simulator.tuya_simulator import TuyaDeviceSimulator, PROFILES, DPS_HOME_TEMPERATURE
+
+_logger = logging.getLogger(__name__)
+
+##########################################################################################################
+
+# End to end throughput / latency of the bridge (MultiDeviceBridge of Tuya2MqttBridge, as run by the app) against
+# simulated thermostats (simulator/tuya_simulator) and an in-process mqtt broker stand-in:
+#
+#   python -m benchmark.bench_bridge [--devices 1 10 100 500] [--rounds 20] [--engine asyncio] --output bench.json
+#   python -m benchmark.bench_bridge --output new.json --baseline bench.json   (exit code 1 on a regression)
+#   python -m benchmark.bench_bridge --broker embedded   (through the embedded mqtt broker, over tcp)
+#
+# Every device count runs in its own python process (a clean RSS / CPU per fleet size). Per round:
+#  * device => mqtt: every device pushes a new home temperature, timed until its STATE publish carries it
+#  * mqtt => device: a COMMAND (new setpoint) is received for every device, timed until the device receives the write
+#    (includes the command_debounce_seconds), and until its RESULT publish (the command is accepted)
+# Reported per device count: the latency percentiles, the mqtt messages (in + out) per second, the CPU per device
+# (the process, the simulator thread excluded where the os has per-thread clocks) and the RSS.
+#
+# By default the stand-in replaces the paho client (no broker, no network): what is measured is the bridge, not the
+# broker. With --broker embedded, the bridge and a probe client talk through the embedded broker (mqtt/mqtt_broker).
+
+DEVICE_COUNTS = [1, 10, 100, 500]
+ROUNDS = 20
+ROUND_TIMEOUT_SECONDS = 30.0
+
+# home temperature dps values of the rounds (two consecutive rounds always differ)
+ROUND_DPS_VALUES = [36, 37, 38, 39, 41, 42, 43, 44]
+ROUND_TARGET_TEMPERATURES = [18.5, 19.0, 19.5, 20.5, 21.0, 21.5, 22.5, 23.0]
+
+TOPIC_PREFIX = 'bench/hvac/thermostat'
+
+# the mqtt side: the in-process stand-in of the paho client (no network), or the embedded broker (paho over tcp)
+BROKER_LOOPBACK = 'loopback'
+BROKER_EMBEDDED = 'embedded'
+
+# dps of the setpoint (in 0.5 degrees)
+DPS_TARGET_TEMPERATURE = '2'
+
+##########################################################################################################
+
+@dataclass
+class _Expectation(object):
+    # message => is it the awaited one
+    predicate: Callable[[Any], bool]
+    sent_time: float = 0.0
+    received_time: Optional[float] = None
+
+
+class ExpectationSet(object):
+    """Thread-safe: the awaited messages (one per key: a topic, a device), timed when they arrive."""
+
+    def __init__(self):
+        self._expectations: Dict[str, _Expectation] = {}
+        self._lock = threading.Lock()
+        self._arrived = threading.Condition(self._lock)
+
+    def expect(self, key: str, predicate: Callable[[Any], bool]) -> _Expectation:
+        """Await the first message of key matching predicate (set its sent_time before sending)."""
+        expectation = _Expectation(predicate)
+        with self._lock:
+            self._expectations[key] = expectation
+        return expectation
+
+    def arrived(self, key: str, message: Any, now: float) -> None:
+        with self._lock:
+            expectation = self._expectations.get(key)
+            if expectation is not None and expectation.predicate(message):
+                expectation.received_time = now
+                del self._expectations[key]
+                self._arrived.notify_all()
+
+    def wait(self, timeout: float) -> bool:
+        """Wait until every awaited message arrived. Returns False on timeout (the missing ones are dropped)."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self._expectations:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._expectations.clear()
+                    return False
+                self._arrived.wait(remaining)
+        return True
+
+
+class LoopbackMqttClient(object):
+    """Stands in for the paho client and the broker: the publishes are counted (and timed when awaited), the
+    messages of the subscribed topics are injected."""
+
+    def __init__(self):
+        self.on_connect = None
+        self.on_message = None
+
+        self.subscriptions: Set[str] = set()
+        self.published = 0
+        self.received = 0
+        # by topic
+        self.expectations = ExpectationSet()
+
+        self._lock = threading.Lock()
+
+    def will_set(self, topic: str, payload: Any = None, qos: int = 0, retain: bool = False) -> None:
+        pass
+
+    def connect(self, host: str, port: int = 1883, *args, **kwargs) -> MQTTErrorCode:
+        if self.on_connect is not None:
+            self.on_connect(self, None, {}, 0)
+        return MQTTErrorCode.MQTT_ERR_SUCCESS
+
+    def loop_start(self) -> MQTTErrorCode:
+        return MQTTErrorCode.MQTT_ERR_SUCCESS
+
+    def loop_stop(self) -> MQTTErrorCode:
+        return MQTTErrorCode.MQTT_ERR_SUCCESS
+
+    def disconnect(self, *args, **kwargs) -> MQTTErrorCode:
+        return MQTTErrorCode.MQTT_ERR_SUCCESS
+
+    def subscribe(self, topic: str | List[Tuple[str, int]], qos: int = 0, *args, **kwargs):
+        # a topic, or a list of (topic, qos)
+        topics = [topic] if isinstance(topic, str) else [topic_filter for topic_filter, _ in topic]
+        with self._lock:
+            self.subscriptions.update(topics)
+        return MQTTErrorCode.MQTT_ERR_SUCCESS, 1
+
+    def publish(self, topic: str, payload: Any = None, qos: int = 0, retain: bool = False, *args, **kwargs):
+        now = time.perf_counter()
+        with self._lock:
+            self.published += 1
+            mid = self.published
+        self.expectations.arrived(topic, payload, now)
+        return mqtt.MQTTMessageInfo(mid)
+
+    @property
+    def messages(self) -> int:
+        """Received + published by the bridge."""
+        return self.published + self.received
+
+    def stop(self) -> None:
+        pass
+
+    def inject(self, topic: str, payload: bytes) -> bool:
+        """A message from the broker, on a subscribed topic."""
+        with self._lock:
+            if not any(topic_matches(topic_filter, topic) for topic_filter in self.subscriptions):
+                return False
+            self.received += 1
+        message = mqtt.MQTTMessage(topic=topic.encode())
+        message.payload = payload
+        self.on_message(self, None, message)
+        return True
+
+
+class EmbeddedBrokerProbe(object):
+    """A client of the embedded broker: times the awaited messages published by the bridge, publishes the commands."""
+
+    def __init__(self, broker: EmbeddedMqttBroker):
+        self.broker = broker
+        self.expectations = ExpectationSet()
+
+        self.client = mqtt.Client(client_id='bench-probe')
+        self.client.on_message = lambda client, userdata, message: self.expectations.arrived(message.topic, message.payload,
+                                                                                             time.perf_counter())
+        self.client.connect('127.0.0.1', broker.port)
+        self.client.subscribe(f'{TOPIC_PREFIX}/+/{TOPIC_STATE}')
+        self.client.subscribe(f'{TOPIC_PREFIX}/+/{TOPIC_RESULT}')
+        self.client.loop_start()
+
+    @property
+    def messages(self) -> int:
+        # the broker receives what the bridge publishes, and the commands for the bridge
+        return self.broker.stats.messages_in
+
+    def stop(self) -> None:
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def inject(self, topic: str, payload: bytes) -> bool:
+        return self.client.publish(topic, payload).rc == MQTTErrorCode.MQTT_ERR_SUCCESS
+
+##########################################################################################################
+
+@dataclass
+class BridgeBenchResult(object):
+    devices: int
+    engine: str
+    broker: str
+    rounds: int
+    sync_seconds: float = 0.0
+    duration_seconds: float = 0.0
+    # milliseconds: device => mqtt (STATE published) / mqtt => device (write received by the device) / mqtt => RESULT
+    device_to_mqtt_ms: Dict[str, float] = field(default_factory=dict)
+    mqtt_to_device_ms: Dict[str, float] = field(default_factory=dict)
+    mqtt_to_result_ms: Dict[str, float] = field(default_factory=dict)
+    # awaited messages not seen before the round timeout
+    lost: int = 0
+    messages: int = 0
+    messages_per_second: float = 0.0
+    cpu_seconds: float = 0.0
+    cpu_percent_per_device: float = 0.0
+    cpu_us_per_message: float = 0.0
+    rss_mb: float = 0.0
+    rss_kb_per_device: float = 0.0
+    max_rss_mb: float = 0.0
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Nearest rank p50 / p95 / p99 / max (and the mean) of samples, in milliseconds (from seconds)."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def rank(percent: float) -> float:
+        return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+    return {'p50': round(rank(50) * 1000, 3), 'p95': round(rank(95) * 1000, 3), 'p99': round(rank(99) * 1000, 3),
+            'max': round(ordered[-1] * 1000, 3), 'mean': round(sum(ordered) / len(ordered) * 1000, 3)}
+
+
+def rss_bytes() -> int:
+    """Current resident set size (Linux /proc), the peak one elsewhere."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return max_rss_bytes()
+
+
+def max_rss_bytes() -> int:
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def bridge_cpu_seconds(simulator: TuyaDeviceSimulator) -> float:
+    return time.process_time() - (simulator.cpu_seconds() or 0.0)
+
+##########################################################################################################
+
+def run_bridge_bench(device_count: int, rounds: int = ROUNDS, engine: str = ENGINE_ASYNCIO, broker: str = BROKER_LOOPBACK,
+                     command_debounce_seconds: float = MoesBhtThermostat.command_debounce_seconds,
+                     round_timeout_seconds: float = ROUND_TIMEOUT_SECONDS) -> BridgeBenchResult:
+    """Bridge device_count simulated devices to the mqtt stand-in, and measure rounds of device / mqtt messages."""
+    result = BridgeBenchResult(devices=device_count, engine=engine, broker=broker, rounds=rounds)
+
+    simulator = TuyaDeviceSimulator.create(device_count, profile=PROFILES['ideal'], base_ip='127.0.0.1',
+                                           port=0, same_ip=True).start()
+    rss_baseline = rss_bytes()
+
+    if broker == BROKER_EMBEDDED:
+        mqtt_broker = EmbeddedMqttBroker(port=0, name='bench').start()
+        mqtt_stand_in = EmbeddedBrokerProbe(mqtt_broker)
+        mqtt_client = MqttClient(name='Bench', broker_address='127.0.0.1', broker_port=mqtt_broker.port, username='',
+                                 password='', tls_cert_path=None, topic_root=TOPIC_PREFIX, publish_queue=PublishQueue())
+    else:
+        mqtt_broker = None
+        mqtt_stand_in = LoopbackMqttClient()
+        mqtt_client = MqttClient(name='Bench', broker_address='localhost', broker_port=1883, username='', password='',
+                                 tls_cert_path=None, topic_root=TOPIC_PREFIX, client=mqtt_stand_in,
+                                 publish_queue=PublishQueue())
+    bridges = []
+    for device in simulator.devices:
+        thermostat = MoesBhtThermostat(name=device.name, tuya_id=device.tuya_id, local_ip=device.host,
+                                       tuya_local_key=device.local_key, port=device.port)
+        thermostat.commands.debounce_seconds = command_debounce_seconds
+        bridges.append(Tuya2MqttBridge(tuya_device=thermostat, mqtt_client=mqtt_client,
+                                       topic_root=f'{TOPIC_PREFIX}/{device.name}'))
+    multi_bridge = MultiDeviceBridge(bridges=bridges, mqtt_client=mqtt_client, engine=engine)
+
+    start_time = time.perf_counter()
+    bridge_thread = threading.Thread(target=multi_bridge.start, name='bench-bridge', daemon=True)
+    bridge_thread.start()
+    try:
+        deadline = time.monotonic() + round_timeout_seconds + device_count * 0.1
+        while not all(bridge.tuya_device.is_synchronized for bridge in bridges) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        if mqtt_broker is not None:
+            # the commands sent before the bridge subscriptions would be lost
+            while not set(mqtt_client.subscriptions) <= set(mqtt_broker.topic_filters) and time.monotonic() < deadline:
+                time.sleep(0.01)
+        result.sync_seconds = round(time.perf_counter() - start_time, 3)
+
+        messages_before = mqtt_stand_in.messages
+        cpu_before = bridge_cpu_seconds(simulator)
+        start_time = time.perf_counter()
+
+        device_to_mqtt = []
+        for round_index in range(rounds):
+            dps_value = ROUND_DPS_VALUES[round_index % len(ROUND_DPS_VALUES)]
+            expectations = []
+            for bridge, device in zip(bridges, simulator.devices):
+                expectation = mqtt_stand_in.expectations.expect(
+                    bridge.topic_status,
+                    lambda payload, value=dps_value / 2: serializers.loads(payload).get('home_temperature') == value)
+                expectation.sent_time = time.perf_counter()
+                simulator.call_soon_threadsafe(device.set_dps, {DPS_HOME_TEMPERATURE: dps_value})
+                expectations.append(expectation)
+            mqtt_stand_in.expectations.wait(round_timeout_seconds)
+            device_to_mqtt.extend(expectations)
+
+        # by device name, the writes received by the simulated devices
+        device_expectations = ExpectationSet()
+        for device in simulator.devices:
+            device.on_command = lambda device, dps: device_expectations.arrived(device.name, dps, time.perf_counter())
+
+        mqtt_to_device, mqtt_to_result = [], []
+        for round_index in range(rounds):
+            target_temperature = ROUND_TARGET_TEMPERATURES[round_index % len(ROUND_TARGET_TEMPERATURES)]
+            payload = serializers.dumps({'target_temperature': target_temperature})
+            for bridge, device in zip(bridges, simulator.devices):
+                applied = device_expectations.expect(
+                    device.name, lambda dps, value=int(target_temperature * 2): dps.get(DPS_TARGET_TEMPERATURE) == value)
+                result_published = mqtt_stand_in.expectations.expect(
+                    bridge.topic_result,
+                    lambda payload, value=target_temperature: serializers.loads(payload)['command'].get('target_temperature') == value)
+                applied.sent_time = result_published.sent_time = time.perf_counter()
+                mqtt_stand_in.inject(bridge.topic_listen, payload)
+                mqtt_to_device.append(applied)
+                mqtt_to_result.append(result_published)
+            device_expectations.wait(round_timeout_seconds)
+            mqtt_stand_in.expectations.wait(round_timeout_seconds)
+
+        elapsed = time.perf_counter() - start_time
+        cpu_seconds = bridge_cpu_seconds(simulator) - cpu_before
+        messages = mqtt_stand_in.messages - messages_before
+        rss_now = rss_bytes()
+    finally:
+        multi_bridge.stop()
+        bridge_thread.join(timeout=10)
+        mqtt_stand_in.stop()
+        if mqtt_broker is not None:
+            mqtt_broker.stop()
+        simulator.stop()
+
+    def latencies(expectations: List[_Expectation]) -> List[float]:
+        return [expectation.received_time - expectation.sent_time for expectation in expectations
+                if expectation.received_time is not None]
+
+    result.duration_seconds = round(elapsed, 3)
+    result.device_to_mqtt_ms = percentiles(latencies(device_to_mqtt))
+    result.mqtt_to_device_ms = percentiles(latencies(mqtt_to_device))
+    result.mqtt_to_result_ms = percentiles(latencies(mqtt_to_result))
+    result.lost = sum(1 for expectation in device_to_mqtt + mqtt_to_device + mqtt_to_result
+                      if expectation.received_time is None)
+    result.messages = messages
+    result.messages_per_second = round(messages / elapsed, 1) if elapsed else 0.0
+    result.cpu_seconds = round(cpu_seconds, 3)
+    result.cpu_percent_per_device = round(cpu_seconds / elapsed / device_count * 100, 4) if elapsed else 0.0
+    result.cpu_us_per_message = round(cpu_seconds / messages * 1_000_000, 1) if messages else 0.0
+    result.rss_mb = round(rss_now / 1024 / 1024, 1)
+    result.rss_kb_per_device = round(max(0, rss_now - rss_baseline) / 1024 / device_count, 1)
+    result.max_rss_mb = round(max_rss_bytes() / 1024 / 1024, 1)
+    return result
+
+##########################################################################################################
+
+# metric => True when higher is better
+COMPARED_METRICS = {
+    'device_to_mqtt_ms.p95': False,
+    'mqtt_to_device_ms.p95': False,
+    'messages_per_second': True,
+    'cpu_percent_per_device': False,
+    'rss_kb_per_device': False,
+}
+
+
+def metric_of(result: Dict[str, Any], metric: str) -> Optional[float]:
+    value = result
+    for key in metric.split('.'):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value if isinstance(value, (int, float)) else None
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.2) -> List[str]:
+    """The regressions (worse than the baseline by more than tolerance) of the same device counts."""
+    regressions = []
+    baseline_results = {result['devices']: result for result in baseline.get('results', [])}
+    for result in results['results']:
+        baseline_result = baseline_results.get(result['devices'])
+        if baseline_result is None:
+            continue
+        for metric, is_higher_better in COMPARED_METRICS.items():
+            value, baseline_value = metric_of(result, metric), metric_of(baseline_result, metric)
+            if value is None or not baseline_value:
+                continue
+            change = (value - baseline_value) / baseline_value
+            if (-change if is_higher_better else change) > tolerance:
+                regressions.append(f'{result["devices"]:>4} devices | {metric}: {baseline_value} => {value} ({change:+.0%})')
+    return regressions
+
+
+def run_in_subprocess(device_count: int, args: argparse.Namespace) -> Dict[str, Any]:
+    command = [sys.executable, '-m', 'benchmark.bench_bridge', '--worker', '--devices', str(device_count),
+               '--rounds', str(args.rounds), '--engine', args.engine, '--broker', args.broker,
+               '--command_debounce', str(args.command_debounce)]
+    completed = subprocess.run(command, capture_output=True, text=True, check=True)
+    # the last line of the worker output is its result
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End to end throughput / latency of the bridge, per device count')
+    parser.add_argument('--devices', type=int, nargs='+', default=DEVICE_COUNTS)
+    parser.add_argument('--rounds', type=int, default=ROUNDS)
+    parser.add_argument('--engine', choices=(ENGINE_SELECTOR, ENGINE_ASYNCIO), default=ENGINE_ASYNCIO)
+    parser.add_argument('--broker', choices=(BROKER_LOOPBACK, BROKER_EMBEDDED), default=BROKER_LOOPBACK,
+                        help='loopback = in-process stand-in of the paho client, embedded = the embedded mqtt broker over tcp')
+    parser.add_argument('--command_debounce', type=float, default=MoesBhtThermostat.command_debounce_seconds)
+    parser.add_argument('--output', help='write the results (json) to this file')
+    parser.add_argument('--baseline', help='results (json) of a previous run: report the regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='regression threshold (0.2 = 20%% worse)')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR, format='%(asctime)s | %(levelname)s | %(name)s | %(message)s')
+
+    if args.worker:
+        result = run_bridge_bench(args.devices[0], rounds=args.rounds, engine=args.engine, broker=args.broker,
+                                  command_debounce_seconds=args.command_debounce)
+        print(json.dumps(asdict(result)))
+        return
+
+    results = {
+        'benchmark': 'bridge',
+        'version': VERSION,
+        'time': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'serializer': serializers.SERIALIZER.name,
+        'engine': args.engine,
+        'broker': args.broker,
+        'rounds': args.rounds,
+        'command_debounce_seconds': args.command_debounce,
+        'results': [],
+    }
+    for device_count in args.devices:
+        result = run_in_subprocess(device_count, args)
+        results['results'].append(result)
+        print(f'{device_count:>4} devices | device=>mqtt p50/p95/p99 '
+              f'{result["device_to_mqtt_ms"].get("p50")}/{result["device_to_mqtt_ms"].get("p95")}/{result["device_to_mqtt_ms"].get("p99")} ms'
+              f' | mqtt=>device p50/p95/p99 '
+              f'{result["mqtt_to_device_ms"].get("p50")}/{result["mqtt_to_device_ms"].get("p95")}/{result["mqtt_to_device_ms"].get("p99")} ms'
+              f' | {result["messages_per_second"]} msg/s | cpu {result["cpu_percent_per_device"]} %/device'
+              f' | rss {result["rss_mb"]} MB ({result["rss_kb_per_device"]} kB/device) | lost {result["lost"]}')
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+        print(f'Results written to [{args.output}]')
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), tolerance=args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+##########################################################################################################
+
+if __name__ == '__main__':
+    main()
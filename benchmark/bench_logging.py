@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+from typing import Any, Callable, Dict
+import logging
+
+import argparse
+import time
+
+import generic.config as config
+from generic.config_logging import set_log_level_for_all
+from moes.MoesThermostat import MoesBhtThermostat
+
+##########################################################################################################
+
+# CPU cost of the logging done per device message, with the PROD log levels (nothing below WARNING is emitted).
+#
+#   python -m benchmark.bench_logging [--messages 100000]
+#
+# * eager:       the hot path logging as it was (f-strings + logging.getLogger(__name__) on every call)
+# * lazy:        the same messages with a cached logger and deferred %-style formatting
+# * handle_data: the whole processing of a status message by MoesBhtThermostat (lazy logging included)
+
+STATUS_MESSAGES = [
+    {'dps': {'1': True, '2': 42, '3': 39, '4': '1', '5': False, '6': False}},
+    {'dps': {'1': True, '2': 44, '3': 40, '4': '1', '5': True, '6': False}},
+]
+
+##########################################################################################################
+
+def eager_logging(name: str, data: Dict[str, Any], state: Any):
+    logging.getLogger('moes.MoesThermostat').debug(f'Get data(all_data={False}) | [is_synchronized={True}]')
+    logging.getLogger('moes.MoesThermostat').debug(f'>>>> data: [{data}]')
+    logging.getLogger('moes.MoesThermostat').debug(f'Processing updates for [{name}] with data=[{data}] | [is_synchronized={True}]')
+    logging.getLogger('moes.MoesThermostat').debug(f'Processing updates for [{name}] with data=[{data["dps"]}] | [is_synchronized={True}]')
+    for metric, value in data['dps'].items():
+        logging.getLogger('moes.MoesThermostat').debug(f'Processing update for [{name}] to metric=[{metric}] value=[{value}]')
+        logging.getLogger('moes.MoesThermostat').info(f'NEW-STATE: {metric} is [{value}]')
+    logging.getLogger('moes.MoesThermostat').info(f'State for [{name}] updated from [{state}] to [{state}]')
+    logging.getLogger('mqtt.mqtt_server').debug(f'Publishing to [{name}] message [{data}] on topic [{name}/STATE].')
+
+
+_logger = logging.getLogger('moes.MoesThermostat')
+_mqtt_logger = logging.getLogger('mqtt.mqtt_server')
+
+def lazy_logging(name: str, data: Dict[str, Any], state: Any):
+    _logger.debug('Get data(all_data=%s) | [is_synchronized=%s]', False, True)
+    _logger.debug('>>>> data: [%s]', data)
+    _logger.debug('Processing updates for [%s] with data=[%s] | [is_synchronized=%s]', name, data, True)
+    _logger.debug('Processing updates for [%s] with data=[%s] | [is_synchronized=%s]', name, data['dps'], True)
+    for metric, value in data['dps'].items():
+        _logger.debug('Processing update for [%s] to metric=[%s] value=[%s]', name, metric, value)
+        _logger.info('NEW-STATE: %s is [%s]', metric, value)
+    _logger.info('State for [%s] updated from [%s] to [%s]', name, state, state)
+    _mqtt_logger.debug('Publishing to [%s] message [%s] on topic [%s/STATE].', name, data, name)
+
+##########################################################################################################
+
+def measure(label: str, messages: int, action: Callable[[int], None]) -> float:
+    start = time.process_time()
+    for i in range(messages):
+        action(i)
+    cpu_seconds = time.process_time() - start
+
+    per_message_us = cpu_seconds / messages * 1_000_000
+    print(f'{label:<12} {per_message_us:8.2f} us/message  ({messages} messages, {cpu_seconds:.3f} s cpu)')
+    return per_message_us
+
+
+def setup_prod_log_levels():
+    prod = config.PROD
+    logging.getLogger().setLevel(prod.log_level_root)
+    logging.getLogger().addHandler(logging.NullHandler())
+    set_log_level_for_all(['bridge', 'bridge.bridge'], prod.log_level_app_bridge)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per message logging cost with the PROD log levels')
+    parser.add_argument('--messages', type=int, default=100_000)
+    args = parser.parse_args()
+
+    setup_prod_log_levels()
+
+    thermostat = MoesBhtThermostat(name='BENCH', tuya_id='1', local_ip='127.0.0.1', tuya_local_key='0123456789abcdef')
+    state = thermostat.state_current
+
+    eager = measure('eager', args.messages, lambda i: eager_logging(thermostat.name, STATUS_MESSAGES[i % 2], state))
+    lazy = measure('lazy', args.messages, lambda i: lazy_logging(thermostat.name, STATUS_MESSAGES[i % 2], state))
+    measure('handle_data', args.messages, lambda i: thermostat.handle_data(STATUS_MESSAGES[i % 2]))
+
+    print(f'lazy logging saves {eager - lazy:.2f} us/message ({(1 - lazy / eager) * 100:.0f}%)')
+
+
+##########################################################################################################
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+from typing import Any, Dict
+
+import argparse
+import json
+
+from benchmark.bench_logging import measure
+from generic.dataclass_util import get_valid_dataclass_fields
+from generic.serializers import available_serializers, get_serializer
+from moes.MoesThermostat import ThermostatState
+
+##########################################################################################################
+
+# CPU cost of the json handling of one mqtt message, per installed serializer (stdlib / orjson / msgspec).
+#
+#   python -m benchmark.bench_serializers [--messages 100000]
+#
+# * encode:   a full state (STATE payload) => bytes
+# * decode:   a COMMAND payload (bytes) => dict
+# * validate: the decoded COMMAND => ThermostatState (ThermostatState.from_json, field / type validation)
+# * batch:    a batch of 10 COMMANDs => ThermostatStates (ThermostatState.from_json_many), per command
+# * baseline: the stdlib json.dumps(...) / json.loads(...) str round trip used before
+
+STATE = {'is_on': True, 'target_temperature': 21.5, 'home_temperature': 19.5,
+         'manual_operating_mode': False, 'eco_mode': False, 'lock_enabled': False}
+
+COMMAND_PAYLOAD = b'{"target_temperature": 22.5, "eco_mode": true}'
+
+##########################################################################################################
+
+def baseline(state: Dict[str, Any], payload: bytes):
+    json.dumps(state).encode()
+    json.loads(payload.decode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per message json encode / decode / validate cost')
+    parser.add_argument('--messages', type=int, default=100_000)
+    args = parser.parse_args()
+
+    measure('baseline', args.messages, lambda i: baseline(STATE, COMMAND_PAYLOAD))
+
+    for name in available_serializers():
+        serializer = get_serializer(name)
+        print(f'--- {name}')
+        measure('encode', args.messages, lambda i: serializer.dumps(STATE))
+        measure('decode', args.messages, lambda i: serializer.loads(COMMAND_PAYLOAD))
+
+    command = json.loads(COMMAND_PAYLOAD)
+    print('---')
+    measure('validate', args.messages, lambda i: ThermostatState.from_json(command))
+    measure('fields', args.messages, lambda i: get_valid_dataclass_fields(ThermostatState, command))
+    commands = [command] * 10
+    batch = measure('batch', args.messages // 10, lambda i: ThermostatState.from_json_many(commands))
+    print(f'batch        {batch / 10:8.2f} us/command')
+
+
+##########################################################################################################
+
+if __name__ == '__main__':
+    main()
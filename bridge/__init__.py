@@ -1,5 +1,5 @@
 #!/usr/bin/env python
-from typing import Any, Callable, Dict, Optional
+from typing import Any, Callable, Dict, Optional, Protocol
 
 ##########################################################################################################
 
@@ -9,4 +9,15 @@ TuyaCallbackOnAction = Callable[["MoesBhtThermostat", Dict[str, Any]], None]
 
 ##########################################################################################################
 
+class DpsTransport(Protocol):
+    """Sends commands to a tuya device (implemented by the non-blocking I/O engines). Must be thread-safe."""
+
+    def send_dps(self, dps: Dict[str, Any]) -> None: ...
+
+    def send_heartbeat(self) -> None: ...
+
+    def request_status(self) -> None: ...
+
+##########################################################################################################
+
 ##########################################################################################################
\ No newline at end of file
@@ -1,11 +1,21 @@
 #!/usr/bin/env python
-from typing import Any, Final, Optional, Dict
+from typing import Any, Final, Optional, Dict, List
 import logging
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
-from generic import register_on_exit_action
+from generic import register_on_exit_action, serializers
+from generic.scheduler import TimerScheduler
+from bridge.history import HistoryRecorder
+from bridge.state_cache import StateCache, STATE_CACHES, STATE_CACHE_TTL_SECONDS
+from bridge.state_publisher import StatePublisher
+from bridge.state_store import StateStore
 from moes.MoesThermostat import MoesBhtThermostat, ThermostatState
-from mqtt.mqtt_server import MqttClient
+from moes.monitor import DeviceMonitor
+from moes.async_engine import AsyncTuyaEngine
+from mqtt.mqtt_server import MqttClient, TOPIC_LWT, TOPIC_STATE, TOPIC_COMMAND, TOPIC_RESULT, TOPIC_GET, TOPIC_GET_RESPONSE, \
+    TOPIC_HISTORY, TOPIC_HISTORY_RESPONSE, LWT_ONLINE, LWT_OFFLINE
+
+_logger = logging.getLogger(__name__)
 
 ##########################################################################################################
 
@@ -15,24 +25,49 @@ from mqtt.mqtt_server import MqttClient
 # tuya_device is updated -> convert to json -> publish mqtt message with mqtt_client to UPDATE topic (and/or UPDATE/parameter - one topic per parameter)
 #
 # tasmota topics:
-# LWT       = Online / Offline
-# STATE     = json with the entire state
+# LWT       = Online / Offline (device: Online only while its tuya connection is healthy)
+#             multi-device: the broker will (Offline if the bridge dies) covers only the bridge LWT (<topic_prefix>/LWT,
+#             Online while the bridge is connected); a device is online when both its LWT and the bridge LWT are Online
+# STATE     = json with the entire state (retained, republished at least every full_status_publish_delay_seconds)
+# RESULT    = json with the outcome of a COMMAND, once applied by the device I/O thread
+# GET       = request of the state, answered on GET/RESPONSE from the StateCache (the device is polled only for the
+#             fields older than state_cache_ttl_seconds)
+# HISTORY   = query of the recorded states of the device, answered on HISTORY/RESPONSE from the HistoryRecorder
 #
 
+ENGINE_SELECTOR = 'selector'
+ENGINE_ASYNCIO = 'asyncio'
+
+# what a state change publishes: the full json state on STATE, or only the changed fields on STATE/<field>
+PUBLISH_MODE_STATE = 'state'
+PUBLISH_MODE_FIELDS = 'fields'
+
 ##########################################################################################################
 
 @dataclass
 class Tuya2MqttBridge(object):
     tuya_device: Final[MoesBhtThermostat]
     mqtt_client: Final[MqttClient]
+    # topic root of this device, when several devices share the same mqtt client (None = the client topic_root)
+    topic_root: Optional[str] = None
+    # PUBLISH_MODE_STATE / PUBLISH_MODE_FIELDS
+    publish_mode: str = PUBLISH_MODE_STATE
+    # a GET polls the device only for the fields older than this
+    state_cache_ttl_seconds: float = STATE_CACHE_TTL_SECONDS
+    # the persisted last known states: seeds the device state on startup, saved on every change (None = not persisted)
+    state_store: Optional[StateStore] = None
+    # the recorder of the state changes, queried on HISTORY (None = not recorded)
+    history: Optional[HistoryRecorder] = None
+
+    state_publisher: Optional[StatePublisher] = field(default=None, init=False, repr=False)
+    state_cache: Optional[StateCache] = field(default=None, init=False, repr=False)
 
     def start(self, max_iterations: int = 0):
-        logging.getLogger(__name__).debug(f'Start Tuya[{self.tuya_device.name}] <=> Mqtt[{self.mqtt_client.name}] bridge')
+        _logger.debug('Start Tuya[%s] <=> Mqtt[%s] bridge', self.tuya_device.name, self.mqtt_client.name)
 
-        self.tuya_device.on_callback = self.from_tuya_callback
-        self.mqtt_client.on_callback = self.from_mqtt_callback
+        self.attach()
 
-        register_on_exit_action(lambda: self.mqtt_client.loop_stop())
+        register_on_exit_action(self.disconnect)
         self.mqtt_client.loop_start()
 
         register_on_exit_action(lambda: self.tuya_device.device.close())
@@ -40,15 +75,210 @@ class Tuya2MqttBridge(object):
         self.tuya_device.start_monitoring(max_iterations=max_iterations)
         # Tuya monitoring uses the main thread
 
+    def attach(self):
+        """Wire the tuya device and the mqtt client callbacks to this bridge."""
+        self.tuya_device.on_callback = self.from_tuya_callback
+        self.tuya_device.connection.on_state_changed = self.from_connection_callback
+
+        is_restored = self.restore_state()
+
+        self.state_publisher = StatePublisher(self.tuya_device, self.mqtt_client, self.topic_status,
+                                              field_topics=(self.publish_mode == PUBLISH_MODE_FIELDS))
+        self.state_publisher.start()
+        if is_restored:
+            # the retained last known state, until the device answers (the LWT stays Offline until then)
+            self.state_publisher.publish(self.tuya_device.state_current.to_dict(), force=True)
+
+        self.state_cache = StateCache(self.tuya_device, ttl_seconds=self.state_cache_ttl_seconds)
+        self.state_cache.attach()
+        STATE_CACHES.register(self.state_cache)
+        self.mqtt_client.add_listener(self.topic_get, self.from_mqtt_get_callback)
+
+        if self.history is not None:
+            self.history.attach(self.tuya_device)
+            self.mqtt_client.add_listener(self.topic_history, self.from_mqtt_history_callback)
+
+        if self.topic_root:
+            self.mqtt_client.add_listener(self.topic_listen, self.from_mqtt_callback)
+        else:
+            self.mqtt_client.on_callback = self.from_mqtt_callback
+
+    def publish_offline(self):
+        """Retained Offline on the device LWT (on shutdown: a device LWT is not covered by the broker will)."""
+        self.mqtt_client.publish(self.topic_lwt, LWT_OFFLINE, retain=True)
+
+    def disconnect(self):
+        self.publish_offline()
+        self.mqtt_client.loop_stop()
+
+    def restore_state(self) -> bool:
+        """Seed the device with its persisted last known state, and persist its next changes."""
+        if self.state_store is None:
+            return False
+        self.tuya_device.data_listeners.append(self.save_state)
+
+        record = self.state_store.get(self.tuya_device.name)
+        if record is None:
+            return False
+        self.tuya_device.restore_state(record.get('state') or {}, record.get('updated'))
+        return True
+
+    def save_state(self, state_data: Dict[str, Any]):
+        # device I/O thread: only hands the state over, the store thread writes it
+        self.state_store.save(self.tuya_device.name, self.tuya_device.state_current.to_dict(),
+                              self.tuya_device.field_update_times, synchronized=bool(self.tuya_device.is_synchronized))
+
+    @property
+    def topic_lwt(self) -> str:
+        return f'{self.topic_root}/{TOPIC_LWT}' if self.topic_root else self.mqtt_client.topic_lwt
+
+    @property
+    def topic_status(self) -> str:
+        return f'{self.topic_root}/{TOPIC_STATE}' if self.topic_root else self.mqtt_client.topic_status
+
+    @property
+    def topic_listen(self) -> str:
+        return f'{self.topic_root}/{TOPIC_COMMAND}' if self.topic_root else self.mqtt_client.topic_listen
+
+    @property
+    def topic_result(self) -> str:
+        return f'{self.topic_root}/{TOPIC_RESULT}' if self.topic_root else self.mqtt_client.topic_result
+
+    @property
+    def topic_get(self) -> str:
+        return f'{self.topic_root}/{TOPIC_GET}' if self.topic_root else self.mqtt_client.topic_get
+
+    @property
+    def topic_get_response(self) -> str:
+        return f'{self.topic_root}/{TOPIC_GET_RESPONSE}' if self.topic_root else self.mqtt_client.topic_get_response
+
+    @property
+    def topic_history(self) -> str:
+        return f'{self.topic_root}/{TOPIC_HISTORY}' if self.topic_root else self.mqtt_client.topic_history
+
+    @property
+    def topic_history_response(self) -> str:
+        return f'{self.topic_root}/{TOPIC_HISTORY_RESPONSE}' if self.topic_root else self.mqtt_client.topic_history_response
+
     def from_tuya_callback(self, user_data: Any, data: Dict[str, Any]):
-        logging.getLogger(__name__).info(f'Received action from Tuya device [{self.tuya_device.name}] data=[{data}]')
+        _logger.info('Received action from Tuya device [%s] data=[%s]', self.tuya_device.name, data)
+
+        self.state_publisher.publish(data)
+
+    def from_connection_callback(self, connection_state: str):
+        is_online = self.tuya_device.connection.is_connected
+        _logger.info('Tuya device [%s] connection is [%s]', self.tuya_device.name, connection_state)
+
+        self.mqtt_client.publish(self.topic_lwt, LWT_ONLINE if is_online else LWT_OFFLINE, retain=True)
+
+    def from_mqtt_callback(self, user_data: Any, data: Dict[str, Any] | List[Dict[str, Any]]):
+        _logger.info('Received action from Mqtt service [%s] data=[%s]', self.mqtt_client.name, data)
+
+        # a json list is a batch of commands, applied in order (and written together, see command_debounce_seconds)
+        commands = data if isinstance(data, list) else [data]
+        for command in commands:
+            if isinstance(command, dict):
+                # remove readonly params
+                for state_field in self.tuya_device.model.read_only_fields:
+                    command.pop(state_field, None)
+
+        # runs on the mqtt network thread: only queue the changes, the device I/O thread applies them
+        for command, new_state in zip(commands, ThermostatState.from_json_many(commands)):
+            self.tuya_device.submit_state(new_state,
+                                          on_done=lambda state, error, command=command: self.publish_result(command, state, error))
+
+    def from_mqtt_get_callback(self, user_data: Any, data: Dict[str, Any]):
+        request = data if isinstance(data, dict) else {}
+        fields = request.get('fields')
+        max_age = request.get('max_age')
+        _logger.debug('Received GET for [%s] fields=[%s] max_age=[%s]', self.tuya_device.name, fields, max_age)
+
+        def publish_response(snapshot: Dict[str, Any]):
+            if 'id' in request:
+                snapshot['id'] = request['id']
+            self.mqtt_client.publish(self.topic_get_response, serializers.dumps(snapshot))
+
+        self.state_cache.get(publish_response,
+                             fields=fields if isinstance(fields, list) else None,
+                             max_age=max_age if isinstance(max_age, (int, float)) and not isinstance(max_age, bool) else None)
+
+    def from_mqtt_history_callback(self, user_data: Any, data: Dict[str, Any]):
+        request = data if isinstance(data, dict) else {}
+        _logger.debug('Received HISTORY for [%s] request=[%s]', self.tuya_device.name, request)
+
+        try:
+            response = self.history.query_request(self.tuya_device.name, request)
+        except ValueError as e:
+            response = {'error': str(e)}
+        if 'id' in request:
+            response['id'] = request['id']
+        self.mqtt_client.publish(self.topic_history_response, serializers.dumps(response))
+
+    def publish_result(self, command: Dict[str, Any], state: ThermostatState | None, error: Exception | None):
+        result = {'command': command, 'result': 'ERROR' if error else 'OK'}
+        if error:
+            result['error'] = str(error)
+        else:
+            result['state'] = state.to_dict()
+
+        self.mqtt_client.publish(self.topic_result, serializers.dumps(result))
+
+##########################################################################################################
+
+@dataclass
+class MultiDeviceBridge(object):
+    """Bridges several tuya devices to one shared mqtt client, all devices being monitored from one thread."""
+    bridges: Final[List[Tuya2MqttBridge]]
+    mqtt_client: Final[MqttClient]
+    # how the device I/O is multiplexed: ENGINE_SELECTOR (blocking tinytuya calls) or ENGINE_ASYNCIO
+    engine: str = ENGINE_SELECTOR
+
+    # the running AsyncTuyaEngine / DeviceMonitor
+    tuya_engine: Optional[AsyncTuyaEngine | DeviceMonitor] = field(default=None, init=False, repr=False)
+
+    def start(self, max_iterations: int = 0):
+        _logger.debug('Start [%s] Tuya devices <=> Mqtt[%s] bridge | engine [%s]', len(self.bridges), self.mqtt_client.name, self.engine)
+
+        # all the devices share one timer scheduler (device timers + state refresh timers)
+        scheduler = TimerScheduler()
+        for bridge in self.bridges:
+            bridge.tuya_device.scheduler = scheduler
+            bridge.attach()
+
+        # the devices have their own LWT: the client one is the liveness of the bridge (Online on every connection)
+        self.mqtt_client.publish_online = all(bridge.topic_lwt != self.mqtt_client.topic_lwt for bridge in self.bridges)
+
+        register_on_exit_action(self.disconnect)
+        self.mqtt_client.loop_start()
+
+        thermostats = [bridge.tuya_device for bridge in self.bridges]
 
-        self.mqtt_client.publish_state(data)
+        if self.engine == ENGINE_ASYNCIO:
+            self.tuya_engine = AsyncTuyaEngine(thermostats, scheduler=scheduler)
+            register_on_exit_action(self.tuya_engine.stop)
+            self.tuya_engine.run()
+        else:
+            for thermostat in thermostats:
+                register_on_exit_action(thermostat.device.close)
+                thermostat.connect()
 
-    def from_mqtt_callback(self, user_data: Any, data: Dict[str, Any]):
-        logging.getLogger(__name__).info(f'Received action from Mqtt service [{self.mqtt_client.name}] data=[{data}]')
+            self.tuya_engine = DeviceMonitor(thermostats, scheduler=scheduler)
+            register_on_exit_action(self.tuya_engine.stop)
+            self.tuya_engine.run(max_iterations=max_iterations)
+        # Tuya monitoring (of all the devices) uses the main thread
 
-        # remove readonly params
-        data.pop('home_temperature', None)
+    def stop(self):
+        """Thread-safe: end start() (when started from another thread), then stop the mqtt client."""
+        if self.tuya_engine is not None:
+            self.tuya_engine.stop()
+        self.disconnect()
 
-        self.tuya_device.set_state(ThermostatState.from_json(data))
+    def disconnect(self):
+        """Offline on the LWT of every device and of the bridge, then stop the mqtt client (a clean disconnection does
+        not trigger the broker will)."""
+        if self.mqtt_client.is_connected:
+            for bridge in self.bridges:
+                bridge.publish_offline()
+            if self.mqtt_client.publish_online:
+                self.mqtt_client.publish(self.mqtt_client.topic_lwt, LWT_OFFLINE, retain=True)
+        self.mqtt_client.loop_stop()
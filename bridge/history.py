@@ -0,0 +1,423 @@
+#!/usr/bin/env python
+from typing import Any, Dict, Final, Iterable, Iterator, List, Optional, Tuple
+import logging
+from collections import deque
+
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import urllib.parse
+
+from generic import serializers
+from generic.metrics import METRICS
+from moes.MoesThermostat import MoesBhtThermostat, ThermostatState, STATE_FIELDS
+
+_logger = logging.getLogger(__name__)
+
+##########################################################################################################
+
+# History of the device states (history_path of the config), for the heating curves without an external TSDB:
+#  * one record per state change of a device, appended to <history_path>/<device>/<YYYY-MM-DD>.hist (UTC day):
+#    a new file every day, the files older than retention_days are deleted
+#  * fixed-width little-endian records (RECORD, 18 bytes) after a file header (HEADER: magic, version, record size):
+#    time (float64 epoch), target / home temperature (float32, NaN = unknown), the boolean fields as 2 bitmasks
+#    (value, known); a truncated last record (ex: crash during a write) is ignored when reading, and cut before the
+#    next records are appended (they stay aligned)
+#  * written by a background thread: the device I/O thread only appends the record to a bounded buffer
+#    (max_pending_records, the oldest records are dropped when the disk does not keep up)
+#  * read through mmap, only the existing files of the range; the first record of a range is found by bisection (the
+#    records of a file are in time order), the records not written yet are read from the buffer
+#  * the answer is aggregated while reading: at most max_points points (or steps) are kept, whatever the range
+#
+# Query (http GET /history/<device>?from=..&to=..&step=..&fields=a,b, mqtt <root>/HISTORY answered on
+# HISTORY/RESPONSE): from / to are epoch seconds (negative = seconds before now, default the last 24 hours)
+#  * without step: the recorded states, {"points": [{"time": .., "<field>": ..}]}
+#  * with step (seconds): one point per step, {"time": <start of the step>, "count": .., "<temperature>":
+#    {"min", "max", "avg"}, "<boolean>": <last value>}
+#  * "truncated": the range has more than max_points points (or steps), the first ones are returned
+#  * always: "stats": {"<temperature>": {"min", "max", "avg"}} over the range
+# The min / max / avg are over the recorded changes (not weighted by their duration).
+
+HISTORY_FILE_SUFFIX = '.hist'
+HISTORY_MAGIC = b'MBTH'
+HISTORY_VERSION = 1
+
+HISTORY_RETENTION_DAYS = 90
+HISTORY_MAX_PENDING_RECORDS = 10000
+HISTORY_MAX_POINTS = 10000
+HISTORY_DEFAULT_RANGE_SECONDS = 24 * 60 * 60
+# 9999-12-31 23:59:59 UTC, the last day a file name can have
+HISTORY_MAX_TIME = 253402300799
+
+# the fields recorded as float32 / as bits of the flag masks
+NUMERIC_FIELDS: Final = ('target_temperature', 'home_temperature')
+FLAG_FIELDS: Final = tuple(state_field for state_field in STATE_FIELDS if state_field not in NUMERIC_FIELDS)
+
+HEADER: Final = struct.Struct('<4sHH')
+RECORD: Final = struct.Struct('<dffBB')
+
+RECORDS_WRITTEN = METRICS.callback('history_records_total', 'State changes recorded in the history, per outcome', 'counter', ('outcome',))
+
+##########################################################################################################
+
+def encode_record(record_time: float, state: ThermostatState) -> bytes:
+    flags = known = 0
+    for bit, state_field in enumerate(FLAG_FIELDS):
+        value = getattr(state, state_field)
+        if value is not None:
+            known |= 1 << bit
+            if value:
+                flags |= 1 << bit
+    target_temperature, home_temperature = (getattr(state, state_field) for state_field in NUMERIC_FIELDS)
+    return RECORD.pack(record_time,
+                       math.nan if target_temperature is None else target_temperature,
+                       math.nan if home_temperature is None else home_temperature,
+                       flags, known)
+
+
+def decode_record(values: Tuple) -> Dict[str, Any]:
+    record_time, target_temperature, home_temperature, flags, known = values
+    point = {'time': round(record_time, 3)}
+    for state_field, value in zip(NUMERIC_FIELDS, (target_temperature, home_temperature)):
+        # float32 => the few decimals of the thermostat
+        point[state_field] = None if math.isnan(value) else round(value, 2)
+    for bit, state_field in enumerate(FLAG_FIELDS):
+        point[state_field] = bool(flags & (1 << bit)) if known & (1 << bit) else None
+    return point
+
+
+def day_of(record_time: float) -> str:
+    return time.strftime('%Y-%m-%d', time.gmtime(record_time))
+
+
+def read_records(file_path: str, start: float, end: float) -> List[Tuple]:
+    """The raw records of a history file with start <= time <= end."""
+    try:
+        history_file = open(file_path, 'rb')
+    except FileNotFoundError:
+        return []
+
+    with history_file:
+        count = (os.fstat(history_file.fileno()).st_size - HEADER.size) // RECORD.size
+        if count <= 0:
+            return []
+
+        with mmap.mmap(history_file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            magic, version, record_size = HEADER.unpack_from(view, 0)
+            if magic != HISTORY_MAGIC or record_size != RECORD.size:
+                _logger.warning('Skipping the history file [%s]: not a version [%s] history file', file_path, HISTORY_VERSION)
+                return []
+
+            def time_at(index: int) -> float:
+                return struct.unpack_from('<d', view, HEADER.size + index * RECORD.size)[0]
+
+            low, high = 0, count
+            while low < high:
+                middle = (low + high) // 2
+                if time_at(middle) < start:
+                    low = middle + 1
+                else:
+                    high = middle
+
+            records = []
+            for index in range(low, count):
+                values = RECORD.unpack_from(view, HEADER.size + index * RECORD.size)
+                if values[0] > end:
+                    break
+                records.append(values)
+            return records
+
+
+def day_bound_of(query_time: float) -> str:
+    """day_of a query bound, any number of seconds (the range is clamped to the days a file name can have)."""
+    return day_of(min(max(query_time, 0), HISTORY_MAX_TIME))
+
+
+def aligned_size(file_size: int) -> int:
+    """The size of a history file without its truncated last record (0 = not even a complete header)."""
+    if file_size < HEADER.size:
+        return 0
+    return file_size - (file_size - HEADER.size) % RECORD.size
+
+
+class _Summary(object):
+    """Running min / max / avg of the numeric fields of the points added, and the last point."""
+    __slots__ = ('fields', 'count', 'numeric', 'last')
+
+    def __init__(self, fields: List[str]):
+        self.fields = fields
+        self.count = 0
+        # field => [min, max, sum, count]
+        self.numeric = {state_field: [math.inf, -math.inf, 0.0, 0] for state_field in fields if state_field in NUMERIC_FIELDS}
+        self.last: Optional[Dict[str, Any]] = None
+
+    def add(self, point: Dict[str, Any]) -> None:
+        self.count += 1
+        self.last = point
+        for state_field, values in self.numeric.items():
+            value = point[state_field]
+            if value is not None:
+                values[0] = min(values[0], value)
+                values[1] = max(values[1], value)
+                values[2] += value
+                values[3] += 1
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """min / max / avg of the numeric fields (the fields without value are left out)."""
+        return {state_field: {'min': minimum, 'max': maximum, 'avg': round(total / count, 2)}
+                for state_field, (minimum, maximum, total, count) in self.numeric.items() if count}
+
+    def bucket(self, bucket_time: float) -> Dict[str, Any]:
+        stats = self.stats()
+        bucket = {'time': bucket_time, 'count': self.count}
+        for state_field in self.fields:
+            bucket[state_field] = stats.get(state_field) if state_field in NUMERIC_FIELDS else self.last[state_field]
+        return bucket
+
+##########################################################################################################
+
+class HistoryRecorder(object):
+    """Records the state changes of the devices in daily binary files, and answers the range queries on them."""
+
+    def __init__(self, directory: str, retention_days: int = HISTORY_RETENTION_DAYS,
+                 max_pending_records: int = HISTORY_MAX_PENDING_RECORDS, max_points: int = HISTORY_MAX_POINTS):
+        self.directory = directory
+        self.retention_days = retention_days
+        self.max_points = max_points
+
+        self.records = 0
+        self.dropped = 0
+        self.failed = 0
+
+        # device => last recorded state
+        self._last_states: Dict[str, Optional[ThermostatState]] = {}
+        self._pending: deque[Tuple[str, float, bytes]] = deque(maxlen=max_pending_records)
+        self._pruned_day: Optional[str] = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+        for outcome in ('records', 'dropped', 'failed'):
+            RECORDS_WRITTEN.set_callback(lambda outcome=outcome: getattr(self, outcome), outcome)
+
+    def attach(self, tuya_device: MoesBhtThermostat) -> None:
+        """Record the state changes of the device."""
+        with self._lock:
+            self._last_states.setdefault(tuya_device.name, None)
+        tuya_device.data_listeners.append(lambda state_data: self.record(tuya_device.name, tuya_device.state_current))
+
+    @property
+    def devices(self) -> List[str]:
+        """The devices recorded by this process, and the ones found in the history directory."""
+        with self._lock:
+            names = set(self._last_states)
+        try:
+            names.update(urllib.parse.unquote(entry.name) for entry in os.scandir(self.directory) if entry.is_dir())
+        except FileNotFoundError:
+            pass
+        return sorted(names)
+
+    def record(self, name: str, state: ThermostatState, record_time: float | None = None) -> bool:
+        """Thread-safe: queue the state of a device for writing. Returns False when it is the last recorded one."""
+        record_time = record_time if record_time is not None else time.time()
+        with self._lock:
+            if self._last_states.get(name) == state:
+                return False
+            self._last_states[name] = state
+
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+            self._pending.append((name, record_time, encode_record(record_time, state)))
+        self._wakeup.set()
+        return True
+
+    def start(self) -> "HistoryRecorder":
+        """Write the recorded states from a background thread."""
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='history', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._running = False
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        # whatever was recorded after the thread exited
+        self.flush()
+
+    def file_path(self, name: str, day: str) -> str:
+        return os.path.join(self.directory, urllib.parse.quote(name, safe=''), f'{day}{HISTORY_FILE_SUFFIX}')
+
+    def days(self, name: str) -> List[str]:
+        """The days with a history file for the device."""
+        try:
+            return sorted(entry.name[:-len(HISTORY_FILE_SUFFIX)]
+                          for entry in os.scandir(os.path.dirname(self.file_path(name, '')))
+                          if entry.name.endswith(HISTORY_FILE_SUFFIX))
+        except FileNotFoundError:
+            return []
+
+    def flush(self) -> int:
+        """Write the pending records now. Returns the number of records written."""
+        with self._write_lock:
+            with self._lock:
+                pending = list(self._pending)
+                self._pending.clear()
+            if not pending:
+                return 0
+
+            files: Dict[str, List[bytes]] = {}
+            for name, record_time, record in pending:
+                files.setdefault(self.file_path(name, day_of(record_time)), []).append(record)
+
+            written = 0
+            for file_path, records in files.items():
+                try:
+                    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                    with open(file_path, 'ab') as history_file:
+                        file_size = history_file.tell()
+                        if aligned_size(file_size) != file_size:
+                            # a record cut by a crash: the next ones would be read shifted
+                            _logger.warning('Truncating the history file [%s] to its last complete record', file_path)
+                            history_file.truncate(aligned_size(file_size))
+                        if history_file.tell() == 0:
+                            history_file.write(HEADER.pack(HISTORY_MAGIC, HISTORY_VERSION, RECORD.size))
+                        history_file.write(b''.join(records))
+                    written += len(records)
+                except OSError as e:
+                    _logger.error('Failed to write the history file [%s]: [%s]', file_path, e)
+                    self.failed += len(records)
+
+            self.records += written
+            self._prune(pending[-1][1])
+            return written
+
+    def _prune(self, now: float) -> None:
+        # the caller holds the write lock; once a day
+        today = day_of(now)
+        if self._pruned_day == today or not self.retention_days:
+            return
+        self._pruned_day = today
+
+        oldest_day = day_of(now - (self.retention_days - 1) * 24 * 60 * 60)
+        for name in self.devices:
+            for day in self.days(name):
+                if day < oldest_day:
+                    try:
+                        os.remove(self.file_path(name, day))
+                        _logger.info('Removed the history of [%s] for [%s]', name, day)
+                    except OSError as e:
+                        _logger.warning('Failed to remove the history of [%s] for [%s]: [%s]', name, day, e)
+
+    def _run(self) -> None:
+        while self._running:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            self.flush()
+
+    # ***************************************************************************************
+    def query(self, name: str, start: float, end: float, step: float | None = None,
+              fields: Iterable[str] | None = None) -> Dict[str, Any]:
+        """The recorded states of the device between start and end (epoch seconds), downsampled to one point per step
+        seconds when step is given."""
+        fields = [state_field for state_field in (fields or STATE_FIELDS) if state_field in STATE_FIELDS]
+
+        summary = _Summary(fields)
+        points: List[Dict[str, Any]] = []
+        buckets: Dict[float, _Summary] = {}
+        is_truncated = False
+        for point in self._points(name, start, end, fields):
+            summary.add(point)
+            if step:
+                bucket_time = point['time'] - point['time'] % step
+                bucket = buckets.get(bucket_time)
+                if bucket is None:
+                    if len(buckets) >= self.max_points:
+                        is_truncated = True
+                        continue
+                    bucket = buckets[bucket_time] = _Summary(fields)
+                bucket.add(point)
+            elif len(points) < self.max_points:
+                points.append(point)
+            else:
+                is_truncated = True
+
+        answer = {'device': name, 'from': start, 'to': end, 'fields': fields}
+        if step:
+            answer['step'] = step
+            points = [bucket.bucket(bucket_time) for bucket_time, bucket in buckets.items()]
+        answer['points'] = points
+        answer['truncated'] = is_truncated
+        answer['stats'] = summary.stats()
+        return answer
+
+    def _points(self, name: str, start: float, end: float, fields: List[str]) -> Iterator[Dict[str, Any]]:
+        """The points of the device in the range, in time order: the written records, then the buffered ones."""
+        first_day, last_day = day_bound_of(start), day_bound_of(end)
+        # no flush while reading (the records taken from the buffer are either in the files or in the buffer)
+        with self._write_lock:
+            for day in self.days(name):
+                if first_day <= day <= last_day:
+                    for values in read_records(self.file_path(name, day), start, end):
+                        point = decode_record(values)
+                        yield {key: point[key] for key in ('time', *fields)}
+
+            with self._lock:
+                pending = [record for pending_name, record_time, record in self._pending
+                           if pending_name == name and start <= record_time <= end]
+            for record in pending:
+                point = decode_record(RECORD.unpack(record))
+                yield {key: point[key] for key in ('time', *fields)}
+
+    def query_request(self, name: str, request: Dict[str, Any], now: float | None = None) -> Dict[str, Any]:
+        """query() with the parameters of a request: {"from": .., "to": .., "step": .., "fields": [..]}.
+        Raises ValueError for invalid parameters."""
+        now = now if now is not None else time.time()
+
+        def seconds_of(key: str, default: float | None) -> float | None:
+            value = request.get(key)
+            if value is None or value == '':
+                return default
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f'{key} must be a number of seconds')
+            if math.isnan(value) or math.isinf(value):
+                raise ValueError(f'{key} must be a number of seconds')
+            # negative = relative to now
+            return now + value if value < 0 and key != 'step' else value
+
+        end = seconds_of('to', now)
+        start = seconds_of('from', end - HISTORY_DEFAULT_RANGE_SECONDS)
+        step = seconds_of('step', None)
+        if step is not None and step <= 0:
+            raise ValueError('step must be a positive number of seconds')
+        if start > end:
+            raise ValueError('from must be before to')
+
+        fields = request.get('fields')
+        if isinstance(fields, str):
+            fields = fields.split(',')
+        return self.query(name, start, end, step=step, fields=fields if isinstance(fields, list) else None)
+
+    def handle_http(self, path: str, query: str) -> Tuple[int, bytes]:
+        """GET /history[/<device>][?from=..&to=..&step=..&fields=a,b] => (http status, json body)."""
+        name = urllib.parse.unquote(path.rstrip('/').partition('/history')[2].lstrip('/'))
+        if not name:
+            return 200, serializers.dumps({'devices': {device: self.days(device) for device in self.devices}})
+        if name not in self.devices:
+            return 404, serializers.dumps({'error': f'Unknown device [{name}]', 'devices': self.devices})
+
+        request = {key: values[0] for key, values in urllib.parse.parse_qs(query).items()}
+        try:
+            return 200, serializers.dumps(self.query_request(name, request))
+        except ValueError as e:
+            return 400, serializers.dumps({'error': str(e)})
+
+##########################################################################################################
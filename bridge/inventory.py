@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+from typing import Any, Dict, List, Optional
+import logging
+from dataclasses import dataclass, field
+
+import json
+import os
+
+from generic.dataclass_util import get_valid_dataclass_fields
+from moes.device_models import MODELS, DEFAULT_MODEL
+from moes.tuya_protocol import TUYA_PORT
+
+_logger = logging.getLogger(__name__)
+
+##########################################################################################################
+
+# Device inventory file (json):
+# {
+#   "topic_prefix": "home/hvac/thermostat",
+#   "model_files": ["models/my_trv.json"],
+#   "devices": [
+#       {"name": "BHT-002-GALW", "tuya_id": "...", "local_ip": "192.168.1.10", "tuya_local_key": "..."},
+#       {"name": "BHT-6000-KITCHEN", "tuya_id": "...", "local_ip": "192.168.1.11", "tuya_local_key": "...",
+#        "topic_root": "home/kitchen/thermostat", "model": "BHT-6000"}
+#   ]
+# }
+# When a device does not define its own topic_root, it gets <topic_prefix>/<name>.
+# When a device does not define its model, it is a BHT-002. The "port" of a device is only needed for the simulated
+# devices (see simulator/tuya_simulator), the real ones listen on 6668. The model_files (relative to the inventory file) are
+# extra model definitions (see moes/device_models), added to the bundled ones.
+
+DEFAULT_TOPIC_PREFIX = 'home/hvac/thermostat'
+
+##########################################################################################################
+
+@dataclass
+class DeviceDefinition(object):
+    name: str
+    tuya_id: str
+    local_ip: str
+    tuya_local_key: str
+    topic_root: Optional[str] = None
+    model: str = DEFAULT_MODEL
+    port: int = TUYA_PORT
+
+##########################################################################################################
+
+@dataclass
+class DeviceInventory(object):
+    devices: List[DeviceDefinition]
+    topic_prefix: str = DEFAULT_TOPIC_PREFIX
+    model_files: List[str] = field(default_factory=list)
+
+    def topic_root_of(self, device: DeviceDefinition) -> str:
+        return device.topic_root if device.topic_root else f'{self.topic_prefix}/{device.name}'
+
+    @staticmethod
+    def from_json(dictionary: Dict[str, Any]) -> "DeviceInventory":
+        topic_prefix = dictionary.get('topic_prefix') or DEFAULT_TOPIC_PREFIX
+
+        devices = []
+        for device_data in dictionary.get('devices', []):
+            sanitised_parameters = get_valid_dataclass_fields(DeviceDefinition, device_data)
+            missing_fields = [f for f in ('name', 'tuya_id', 'local_ip', 'tuya_local_key') if f not in sanitised_parameters]
+            if missing_fields:
+                raise ValueError(f'Device definition [{device_data.get("name")}] is missing fields {missing_fields}')
+            devices.append(DeviceDefinition(**sanitised_parameters))
+
+        names = [device.name for device in devices]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise ValueError(f'Duplicate device names in inventory: {duplicates}')
+
+        return DeviceInventory(devices=devices, topic_prefix=topic_prefix, model_files=list(dictionary.get('model_files', [])))
+
+    def load_models(self, base_directory: str = '.') -> None:
+        """Register the model_files definitions, then check that the model of every device is known."""
+        for file_path in self.model_files:
+            MODELS.load_file(os.path.join(base_directory, file_path))
+
+        unknown_models = sorted({device.model for device in self.devices if device.model not in MODELS})
+        if unknown_models:
+            raise ValueError(f'Unknown thermostat models in inventory: {unknown_models}, known models: {MODELS.names}')
+
+##########################################################################################################
+
+def load_device_inventory(file_path: str) -> DeviceInventory:
+    _logger.info('Loading device inventory from [%s]', file_path)
+
+    with open(file_path, 'r') as inventory_file:
+        inventory = DeviceInventory.from_json(json.load(inventory_file))
+    inventory.load_models(os.path.dirname(os.path.abspath(file_path)))
+
+    _logger.info('Loaded [%s] devices from [%s]', len(inventory.devices), file_path)
+    return inventory
+
+##########################################################################################################
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+from typing import Any, Callable, Dict, Final, Iterable, List, Optional, Tuple
+import logging
+
+import threading
+import time
+import urllib.parse
+
+from generic import serializers
+from moes.MoesThermostat import MoesBhtThermostat, STATE_FIELDS
+
+_logger = logging.getLogger(__name__)
+
+##########################################################################################################
+
+# Read-through cache of the state of one device, for the GET requests (mqtt <root>/GET and http /state):
+#  * the state is served from memory (state_current), with the age of every field (time since the device sent it)
+#  * only when a requested field is older than the TTL (or the request max_age) a full status is requested from
+#    the device; the request is answered once the device sent the fields, or after timeout_seconds with the
+#    cached values (listed as `stale`)
+#  * the GETs arriving while a status request is in flight wait for it, the device is polled once
+#  * a disconnected device is not polled, the cached state is served right away
+#
+# Response: {"state": {...}, "age": {"<field>": <seconds> | null}, "stale": [...], "synchronized": true}
+
+TIMER_GET_TIMEOUT = 'get_timeout'
+
+STATE_CACHE_TTL_SECONDS = 60
+GET_TIMEOUT_SECONDS = 5.0
+
+# snapshot => None
+GetCallback = Callable[[Dict[str, Any]], None]
+
+##########################################################################################################
+
+class _PendingGet(object):
+    __slots__ = ('fields', 'max_age', 'on_done', 'deadline')
+
+    def __init__(self, fields: List[str], max_age: float, on_done: GetCallback, deadline: float):
+        self.fields = fields
+        self.max_age = max_age
+        self.on_done = on_done
+        self.deadline = deadline
+
+##########################################################################################################
+
+class StateCache(object):
+    """Serves the state of one device from memory, polling the device only for the fields staler than the TTL."""
+
+    def __init__(self, tuya_device: MoesBhtThermostat, ttl_seconds: float = STATE_CACHE_TTL_SECONDS,
+                 timeout_seconds: float = GET_TIMEOUT_SECONDS, time_func: Callable[[], float] = time.time):
+        self.tuya_device = tuya_device
+        self.ttl_seconds = ttl_seconds
+        self.timeout_seconds = timeout_seconds
+        self.time_func = time_func
+
+        # the status requests sent to the device (the GETs not served from memory)
+        self.refreshes = 0
+
+        self._pending: List[_PendingGet] = []
+        self._lock = threading.Lock()
+
+    @property
+    def timer_key(self):
+        return self.tuya_device.timer_key(TIMER_GET_TIMEOUT)
+
+    @property
+    def fields(self) -> List[str]:
+        """The state fields of the device model."""
+        return [state_field for state_field in STATE_FIELDS if self.tuya_device.device.codec.dps_of(state_field) is not None]
+
+    def attach(self) -> None:
+        self.tuya_device.data_listeners.append(self._on_data)
+
+    def age_of(self, state_field: str, now: float | None = None) -> Optional[float]:
+        update_time = self.tuya_device.field_update_times.get(state_field)
+        if update_time is None:
+            return None
+        return max(0.0, (now if now is not None else self.time_func()) - update_time)
+
+    def stale_fields(self, fields: Iterable[str] | None = None, max_age: float | None = None) -> List[str]:
+        max_age = max_age if max_age is not None else self.ttl_seconds
+        now = self.time_func()
+        stale = []
+        for state_field in self._requested_fields(fields):
+            age = self.age_of(state_field, now)
+            if age is None or age > max_age:
+                stale.append(state_field)
+        return stale
+
+    def snapshot(self, fields: Iterable[str] | None = None, max_age: float | None = None) -> Dict[str, Any]:
+        fields = self._requested_fields(fields)
+        state = self.tuya_device.state_current.to_dict()
+        now = self.time_func()
+        ages = {state_field: self.age_of(state_field, now) for state_field in fields}
+        return {
+            'state': {state_field: state[state_field] for state_field in fields},
+            'age': {state_field: round(age, 3) if age is not None else None for state_field, age in ages.items()},
+            'stale': self.stale_fields(fields, max_age),
+            'synchronized': bool(self.tuya_device.is_synchronized),
+        }
+
+    def get(self, on_done: GetCallback, fields: Iterable[str] | None = None, max_age: float | None = None) -> None:
+        """Thread-safe: on_done(snapshot) now when the fields are fresh, otherwise once the device sent them (or on
+        timeout), called from the thread doing the device I/O."""
+        fields = self._requested_fields(fields)
+        max_age = max_age if max_age is not None else self.ttl_seconds
+
+        if not self.stale_fields(fields, max_age) or not self.tuya_device.connection.is_connected:
+            on_done(self.snapshot(fields, max_age))
+            return
+
+        deadline = self.time_func() + self.timeout_seconds
+        with self._lock:
+            is_refresh_needed = len(self._pending) == 0
+            self._pending.append(_PendingGet(fields, max_age, on_done, deadline))
+
+        if is_refresh_needed:
+            _logger.debug('Fields %s of [%s] older than [%s] seconds, requesting the status', fields, self.tuya_device.name, max_age)
+            self.refreshes += 1
+            self.tuya_device.request_status()
+            self.tuya_device.scheduler.schedule(self.timer_key, deadline, self._on_timeout)
+
+    def get_blocking(self, fields: Iterable[str] | None = None, max_age: float | None = None,
+                     timeout: float | None = None) -> Dict[str, Any]:
+        """get() for the threads that can wait (http)."""
+        waiter = _Waiter()
+        self.get(waiter.set, fields, max_age)
+        return waiter.wait(timeout if timeout is not None else self.timeout_seconds + 1) or self.snapshot(fields, max_age)
+
+    def _requested_fields(self, fields: Iterable[str] | None) -> List[str]:
+        model_fields = self.fields
+        if fields is None:
+            return model_fields
+        return [state_field for state_field in fields if state_field in model_fields]
+
+    def _on_data(self, state_data: Dict[str, Any]) -> None:
+        # device I/O thread, the fields of state_data were just refreshed
+        self._resolve(lambda pending: not self.stale_fields(pending.fields, pending.max_age))
+
+    def _on_timeout(self) -> None:
+        now = self.time_func()
+        self._resolve(lambda pending: pending.deadline <= now)
+
+        with self._lock:
+            next_deadline = min((pending.deadline for pending in self._pending), default=None)
+        if next_deadline is not None:
+            # a later GET still waits for the status requested before it timed out
+            self.tuya_device.scheduler.schedule(self.timer_key, next_deadline, self._on_timeout)
+
+    def _resolve(self, is_done: Callable[[_PendingGet], bool]) -> None:
+        with self._lock:
+            if not self._pending:
+                return
+            done = [pending for pending in self._pending if is_done(pending)]
+            self._pending = [pending for pending in self._pending if pending not in done]
+            if not self._pending:
+                self.tuya_device.scheduler.cancel(self.timer_key)
+
+        for pending in done:
+            try:
+                pending.on_done(self.snapshot(pending.fields, pending.max_age))
+            except Exception as e:
+                _logger.error('Exception [%s] while answering a GET: [%s]', self.tuya_device.name, e)
+
+##########################################################################################################
+
+class _Waiter(object):
+
+    def __init__(self):
+        self.result: Optional[Dict[str, Any]] = None
+        self._event = threading.Event()
+
+    def set(self, result: Dict[str, Any]) -> None:
+        self.result = result
+        self._event.set()
+
+    def wait(self, timeout: float) -> Optional[Dict[str, Any]]:
+        self._event.wait(timeout)
+        return self.result
+
+##########################################################################################################
+
+class StateCacheRegistry(object):
+    """The state caches of the process, by device name (served over http)."""
+
+    def __init__(self):
+        self._caches: Dict[str, StateCache] = {}
+
+    def register(self, state_cache: StateCache) -> StateCache:
+        self._caches[state_cache.tuya_device.name] = state_cache
+        return state_cache
+
+    def get(self, name: str) -> Optional[StateCache]:
+        return self._caches.get(name)
+
+    @property
+    def names(self) -> List[str]:
+        return sorted(self._caches)
+
+    def get_all(self, fields: Iterable[str] | None = None, max_age: float | None = None) -> Dict[str, Dict[str, Any]]:
+        """get_blocking of all the devices, the stale devices being polled in parallel."""
+        waiters = {}
+        for name, state_cache in list(self._caches.items()):
+            waiters[name] = _Waiter()
+            state_cache.get(waiters[name].set, fields, max_age)
+
+        return {name: waiter.wait(self._caches[name].timeout_seconds + 1) or self._caches[name].snapshot(fields, max_age)
+                for name, waiter in waiters.items()}
+
+    def handle_http(self, path: str, query: str) -> Tuple[int, bytes]:
+        """GET /state[/<device>][?fields=a,b&max_age=<seconds>] => (http status, json body)."""
+        parameters = urllib.parse.parse_qs(query)
+        fields = parameters['fields'][0].split(',') if 'fields' in parameters else None
+        try:
+            max_age = float(parameters['max_age'][0]) if 'max_age' in parameters else None
+        except ValueError:
+            return 400, serializers.dumps({'error': 'max_age must be a number of seconds'})
+
+        name = urllib.parse.unquote(path.rstrip('/').partition('/state')[2].lstrip('/'))
+        if not name:
+            return 200, serializers.dumps(self.get_all(fields, max_age))
+
+        state_cache = self.get(name)
+        if state_cache is None:
+            return 404, serializers.dumps({'error': f'Unknown device [{name}]', 'devices': self.names})
+        return 200, serializers.dumps(state_cache.get_blocking(fields, max_age))
+
+
+# the process wide registry
+STATE_CACHES: Final = StateCacheRegistry()
+
+##########################################################################################################
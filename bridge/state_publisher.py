@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+from typing import Any, Dict, Optional
+import logging
+
+import threading
+
+from generic import serializers
+from generic.scheduler import TimerScheduler
+from moes.MoesThermostat import MoesBhtThermostat
+from mqtt.mqtt_server import MqttClient
+
+_logger = logging.getLogger(__name__)
+
+##########################################################################################################
+
+# Full state (STATE topic) publishing of one device:
+#  * every state change is published right away, as a retained message
+#  * a publish identical to the last one, inside the refresh window, is dropped (no duplicate traffic)
+#  * when no publish happened for a whole refresh window, the current state is republished (bounded staleness)
+# The refresh timer is re-armed by every publish, so a change-driven publish also counts as the refresh.
+#
+# With field_topics, a change only publishes the fields that differ from the last published values, one retained
+# topic per field (<topic>/<field>). The full snapshot is still published (retained) on <topic>, but only with the
+# first publish and with the refreshes.
+
+TIMER_STATE_REFRESH = 'state_refresh'
+
+##########################################################################################################
+
+class StatePublisher(object):
+    """Publishes the retained full state of one device, with a bounded staleness (refresh window)."""
+
+    def __init__(self, tuya_device: MoesBhtThermostat, mqtt_client: MqttClient, topic: str,
+                 scheduler: TimerScheduler | None = None, refresh_seconds: float | None = None,
+                 field_topics: bool = False):
+        self.tuya_device = tuya_device
+        self.mqtt_client = mqtt_client
+        self.topic = topic
+        self.scheduler = scheduler if scheduler is not None else tuya_device.scheduler
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None else tuya_device.full_status_publish_delay_seconds
+        self.field_topics = field_topics
+
+        self.last_published_time: Optional[float] = None
+        self.last_published_payload: Optional[bytes] = None
+        # field => last value published on its own topic (field_topics mode)
+        self.last_published_fields: Dict[str, Any] = {}
+
+        self._lock = threading.Lock()
+
+    @property
+    def timer_key(self):
+        return self.tuya_device.timer_key(TIMER_STATE_REFRESH)
+
+    def start(self) -> None:
+        self._schedule_refresh(self.scheduler.time_func())
+
+    def stop(self) -> None:
+        self.scheduler.cancel(self.timer_key)
+
+    def topic_of(self, field_name: str) -> str:
+        return f'{self.topic}/{field_name}'
+
+    def publish(self, data: Dict[str, Any], force: bool = False) -> bool:
+        """Publish `data` as the full state. Returns False if nothing was published (duplicate)."""
+        payload = serializers.dumps(data)
+
+        with self._lock:
+            now = self.scheduler.time_func()
+
+            if self.field_topics:
+                changed_fields = self._publish_changed_fields(data)
+                if not force and self.last_published_payload is not None:
+                    return changed_fields > 0
+            elif not force and payload == self.last_published_payload and not self._is_refresh_due(now):
+                _logger.debug('State of [%s] already published, skipping', self.tuya_device.name)
+                return False
+
+            self.mqtt_client.publish(self.topic, payload, retain=True)
+            self.last_published_time = now
+            self.last_published_payload = payload
+
+            self._schedule_refresh(now)
+        return True
+
+    def _publish_changed_fields(self, data: Dict[str, Any]) -> int:
+        changed_fields = {field_name: value for field_name, value in data.items()
+                          if field_name not in self.last_published_fields or self.last_published_fields[field_name] != value}
+
+        for field_name, value in changed_fields.items():
+            self.mqtt_client.publish(self.topic_of(field_name), serializers.dumps(value), retain=True)
+            self.last_published_fields[field_name] = value
+
+        _logger.debug('Published [%s] changed fields of [%s]', len(changed_fields), self.tuya_device.name)
+        return len(changed_fields)
+
+    def _is_refresh_due(self, now: float) -> bool:
+        return self.last_published_time is None or now - self.last_published_time >= self.refresh_seconds
+
+    def _schedule_refresh(self, now: float) -> None:
+        self.scheduler.schedule(self.timer_key, now + self.refresh_seconds, self._on_refresh_timer)
+
+    def _on_refresh_timer(self) -> None:
+        if self.tuya_device.is_synchronized:
+            _logger.info('State REFRESH for [%s]', self.tuya_device.name)
+            self.publish(self.tuya_device.state_current.to_dict(), force=True)
+        else:
+            # an unknown state is not republished, check again after a whole window
+            self._schedule_refresh(self.scheduler.time_func())
+
+##########################################################################################################
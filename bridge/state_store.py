@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+from typing import Any, Dict, Optional
+import logging
+
+import os
+import threading
+import time
+
+from generic import serializers
+
+_logger = logging.getLogger(__name__)
+
+##########################################################################################################
+
+# Last known state of the devices, persisted for the warm restarts (state_store_path of the config):
+#  * append-only json lines, one per state change: {"device": <name>, "time": <epoch>, "synchronized": <bool>,
+#    "state": {...}, "updated": {"<field>": <epoch of the value>}}; the last line of a device wins
+#  * written by a background thread: the device I/O thread only hands over the newest state of the device, a state
+#    not written yet is replaced by the newer one (the disk never slows down the device loop)
+#  * compacted (one line per device, in a temp file renamed over the store) once it holds compact_lines lines
+#  * a truncated / corrupted line (ex: crash during a write) is skipped on load
+# At boot the bridge seeds the devices with it and publishes the retained last known state right away; the devices
+# are resynchronized in the background (the LWT stays Offline until then).
+
+STATE_STORE_COMPACT_LINES = 1000
+
+##########################################################################################################
+
+class StateStore(object):
+    """The persisted last known state of every device, by device name."""
+
+    def __init__(self, file_path: str, compact_lines: int = STATE_STORE_COMPACT_LINES):
+        self.file_path = file_path
+        self.compact_lines = compact_lines
+
+        # device => last record (loaded or saved)
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self.lines = 0
+        self.writes = 0
+
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """Read the records of the store file (missing file = no records)."""
+        records = {}
+        lines = 0
+        try:
+            with open(self.file_path, 'rb') as store_file:
+                for line in store_file:
+                    lines += 1
+                    try:
+                        record = serializers.loads(line)
+                        records[record['device']] = record
+                    except (ValueError, KeyError, TypeError):
+                        _logger.warning('Skipping the invalid line [%s] of the state store [%s]', lines, self.file_path)
+        except FileNotFoundError:
+            _logger.info('No state store [%s] yet', self.file_path)
+
+        with self._lock:
+            self.records = records
+            self.lines = lines
+        _logger.info('Loaded the last known state of %s devices from [%s]', len(records), self.file_path)
+        return records
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._pending.get(name) or self.records.get(name)
+
+    def save(self, name: str, state: Dict[str, Any], updated: Dict[str, float] | None = None,
+             synchronized: bool = False) -> bool:
+        """Thread-safe: queue the state of a device for writing. Returns False when it is already the stored one."""
+        with self._lock:
+            last_record = self._pending.get(name) or self.records.get(name)
+            if last_record is not None and last_record['state'] == state and last_record['synchronized'] == synchronized:
+                return False
+
+            self._pending[name] = {'device': name, 'time': time.time(), 'synchronized': synchronized,
+                                   'state': state, 'updated': dict(updated or {})}
+        self._wakeup.set()
+        return True
+
+    def start(self) -> None:
+        """Load the store, then write the saved states from a background thread."""
+        self.load()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='state-store', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._running = False
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        # whatever was saved after the thread exited
+        self.flush()
+
+    def flush(self) -> int:
+        """Write the pending states now. Returns the number of records written."""
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            try:
+                directory = os.path.dirname(self.file_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.file_path, 'ab') as store_file:
+                    for record in pending.values():
+                        store_file.write(serializers.dumps(record) + b'\n')
+            except OSError as e:
+                _logger.error('Failed to write the state store [%s]: [%s]', self.file_path, e)
+                with self._lock:
+                    # retried with the next save, a newer state of a device replaces the failed one
+                    self._pending = {**pending, **self._pending}
+                return 0
+
+            with self._lock:
+                self.records.update(pending)
+                self.lines += len(pending)
+                self.writes += len(pending)
+                is_compaction_due = self.lines > self.compact_lines
+
+            if is_compaction_due:
+                self._compact()
+            return len(pending)
+
+    def _compact(self) -> None:
+        # the caller holds the write lock
+        with self._lock:
+            records = list(self.records.values())
+
+        temp_path = f'{self.file_path}.tmp'
+        try:
+            with open(temp_path, 'wb') as store_file:
+                for record in records:
+                    store_file.write(serializers.dumps(record) + b'\n')
+                store_file.flush()
+                os.fsync(store_file.fileno())
+            os.replace(temp_path, self.file_path)
+        except OSError as e:
+            _logger.error('Failed to compact the state store [%s]: [%s]', self.file_path, e)
+            return
+
+        with self._lock:
+            self.lines = len(records)
+        _logger.debug('Compacted the state store [%s] to [%s] lines', self.file_path, len(records))
+
+    def _run(self) -> None:
+        while self._running:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            self.flush()
+
+##########################################################################################################
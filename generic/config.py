@@ -23,6 +23,41 @@ class Config:
     log_level_app_bridge: int
     log_level_tuya: int
 
+    # port of the http /metrics (and /state) endpoint (0 = disabled)
+    metrics_port: int = 18000
+
+    # a GET of the state (mqtt <root>/GET, http /state) polls the device only for the fields older than this
+    state_cache_ttl_seconds: int = 60
+
+    # bounds of the adaptive interval between two full status requests of a device (short while the device is in
+    # use, stretched up to the max while its state is stable => the max is the eco mode detection latency)
+    full_status_get_min_seconds: int = 15
+    full_status_get_max_seconds: int = 5 * 60
+
+    # the last known state of the devices, restored (and published) on startup ('' = not persisted)
+    state_store_path: str = 'logs/{app_name}_state.jsonl'
+
+    # directory of the recorded state changes, one file per device and day ('' = not recorded), and the days kept
+    history_path: str = ''
+    history_retention_days: int = 90
+
+    # outbound mqtt messages: the size of the publish queue, what a full queue does (drop_oldest / drop_newest /
+    # block), and the QoS / retain / coalescing per topic pattern (fnmatch, `*` also matches `/`, the first match wins;
+    # a qos / retain left out is the one given by the publisher)
+    mqtt_publish_queue_size: int = 1000
+    mqtt_publish_overflow_policy: str = 'drop_oldest'
+    mqtt_topic_policies: tuple = (
+        ('*/STATE', {'coalesce': True}),
+        ('*/STATE/*', {'coalesce': True}),
+    )
+
+    # log records waiting to be written (a full buffer drops the new records, the callers never wait on the disk)
+    log_queue_size: int = 10000
+    # a log file is rotated when it reaches this size or age, only the newest log_file_backup_count are kept
+    log_file_max_bytes: int = 10 * 1024 * 1024
+    log_file_rotation_seconds: int = 24 * 60 * 60
+    log_file_backup_count: int = 7
+
 ##########################################################################################################
 class DEVConfig(Config):
     debug = True
@@ -66,6 +101,7 @@ class ActiveConfig(object):
         self.stderr = None
         self.cli_out = None
         self.progress = Progress()
+        self.log_listener = None
 
     @staticmethod
     def get_active_config(target_env, app_name: str) -> 'ActiveConfig':
@@ -1,15 +1,105 @@
 #!/usr/bin/env python
 from typing import Any, List, Optional, Dict
 import logging
+import logging.handlers
 import sys
 from io import IOBase
 
+import atexit
+import glob
+import os
+import queue
+import time
+
 from .config import ActiveConfig
 
 
+##########################################################################################################
+
+# The log records are written by a QueueListener thread: the application threads (the device I/O loop) only put
+# the record in a bounded queue and never wait on the disk / console. When the queue is full the record is dropped.
+# The log files are rotated by size and by age; each file keeps the logs/{timestamp}_{app_name}.log naming.
+
+LOG_FORMAT = ' %(process)d | %(asctime)s | %(levelname)s | %(name)s | %(message)s'
+
 ##########################################################################################################
 
 
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops the records when the queue is full, instead of blocking / raising."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class TimestampedRotatingFileHandler(logging.handlers.BaseRotatingHandler):
+    """Writes to `{timestamp}` named files (log_file_pattern), starting a new file when the current one reaches
+    max_bytes or rotation_seconds. Only the backup_count newest older files are kept."""
+
+    def __init__(self, file_pattern: str, app_name: str, max_bytes: int = 0, rotation_seconds: int = 0, backup_count: int = 0):
+        self.file_pattern = file_pattern
+        self.app_name = app_name
+        self.max_bytes = max_bytes
+        self.rotation_seconds = rotation_seconds
+        self.backup_count = backup_count
+
+        super().__init__(self._new_file_name(), 'a', encoding='utf-8', delay=False)
+        self.rollover_at = self._next_rollover_time()
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.rotation_seconds > 0 and time.time() >= self.rollover_at:
+            return True
+        if self.max_bytes > 0 and self.stream is not None:
+            return self.stream.tell() + len(self.format(record)) + 1 >= self.max_bytes
+        return False
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        self.baseFilename = os.path.abspath(self._new_file_name())
+        self.stream = self._open()
+        self.rollover_at = self._next_rollover_time()
+        self._delete_old_files()
+
+    def _new_file_name(self) -> str:
+        from datetime import datetime
+
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        file_name = self.file_pattern.format(timestamp=timestamp, app_name=self.app_name)
+        if hasattr(self, 'baseFilename'):
+            # rolled over within the same second, do not append to the previous file
+            counter = 1
+            while os.path.exists(file_name):
+                file_name = self.file_pattern.format(timestamp=f'{timestamp}_{counter}', app_name=self.app_name)
+                counter += 1
+        return file_name
+
+    def _next_rollover_time(self) -> float:
+        return time.time() + self.rotation_seconds if self.rotation_seconds > 0 else float('inf')
+
+    def _delete_old_files(self):
+        if self.backup_count <= 0:
+            return
+
+        file_glob = self.file_pattern.format(timestamp='*', app_name=self.app_name)
+        old_files = sorted((f for f in glob.glob(file_glob) if os.path.abspath(f) != self.baseFilename),
+                           key=lambda f: (os.path.getmtime(f), f))
+        for file_name in old_files[:max(0, len(old_files) - self.backup_count)]:
+            try:
+                os.remove(file_name)
+            except OSError:
+                pass
+
+
 class DefaultStreamHandler(logging.StreamHandler):
     def __init__(self, stream=sys.__stdout__):
         # Use the original sys.__stdout__ to write to stdout
@@ -67,37 +157,60 @@ def __replace_stderr_and_stdout_with_logger(ac: ActiveConfig):
 ##########################################################################################################
 
 def __create_console_handler(ac: ActiveConfig):
-    # create console handler and set level to debug
-    handler = logging.StreamHandler()
+    # create console handler and set level to debug (on the real stderr, sys.stderr is redirected to the logger)
+    handler = logging.StreamHandler(sys.__stderr__)
     handler.setLevel(logging.DEBUG)
-    handler.setFormatter(logging.Formatter(' %(process)d | %(asctime)s | %(levelname)s | %(name)s | %(message)s'))
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
 
     return handler
 
 
 def __create_file_handler(ac: ActiveConfig):
-    from datetime import datetime
-
-    log_filename = ac.config.log_file_pattern.format(
-        timestamp=datetime.now().strftime('%Y%m%d_%H%M%S'),
-        app_name=ac.app_name,
-    )
-
-    handler = logging.FileHandler(log_filename)
+    handler = TimestampedRotatingFileHandler(ac.config.log_file_pattern, ac.app_name,
+                                             max_bytes=ac.config.log_file_max_bytes,
+                                             rotation_seconds=ac.config.log_file_rotation_seconds,
+                                             backup_count=ac.config.log_file_backup_count)
     handler.setLevel(logging.DEBUG)
-    handler.setFormatter(logging.Formatter(' %(process)d | %(asctime)s | %(levelname)s | %(name)s | %(message)s'))
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
 
     return handler
 
 
+def __create_queue_handler(ac: ActiveConfig, handlers: List[logging.Handler]) -> logging.Handler:
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=ac.config.log_queue_size))
+
+    ac.log_listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    ac.log_listener.start()
+    atexit.register(stop_logging, ac, queue_handler)
+
+    return queue_handler
+
+
+def stop_logging(ac: ActiveConfig, queue_handler: logging.Handler | None = None):
+    """Write the queued records and stop the listener thread; the later records are written synchronously."""
+    if ac.log_listener is None:
+        return
+
+    listener, ac.log_listener = ac.log_listener, None
+    listener.stop()
+
+    root_logger = logging.getLogger()
+    if queue_handler is not None and queue_handler in root_logger.handlers:
+        root_logger.removeHandler(queue_handler)
+        for handler in listener.handlers:
+            root_logger.addHandler(handler)
+
+
 def init_logging(ac: ActiveConfig):
     root_logger = logging.getLogger()
     ac.logging = logging.getLogger(ac.app_name)
 
-    # add console_handler to root logger
-    root_logger.addHandler(__create_console_handler(ac))
+    handlers = [__create_console_handler(ac)]
     if ac.config.log_file_pattern is not None:
-        root_logger.addHandler(__create_file_handler(ac))
+        handlers.append(__create_file_handler(ac))
+
+    # the handlers are run by a listener thread, the root logger only queues the records
+    root_logger.addHandler(__create_queue_handler(ac, handlers))
 
     root_logger.setLevel(ac.config.log_level_root)
 
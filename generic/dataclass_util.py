@@ -1,62 +1,114 @@
 #!/usr/bin/env python
-from typing import Any, Dict, List, Tuple, Union, Type, get_origin, get_type_hints
+from typing import Any, Dict, Iterable, List, Tuple, Union, Type, get_args, get_origin, get_type_hints
 import logging
 
-##########################################################################################################
-
-def get_valid_dataclass_fields(dataclass_type: Type, data: Dict[str, Any]) -> Dict[str, Any]:
-    # Get the type hints of the dataclass fields
-    type_hints = get_type_hints(dataclass_type)
+import functools
 
-    # Remove keys that are not fields
-    sanitised_data = {k: v for k, v in data.items() if k in type_hints}
+_logger = logging.getLogger(__name__)
 
-    invalid_type_fields = get_invalid_type_dataclass_fields(dataclass_type=dataclass_type, data=sanitised_data)
-    # Remove keys with values are not same type as fields
-    sanitised_data = {k: v for k, v in sanitised_data.items() if k not in invalid_type_fields}
+##########################################################################################################
 
-    return sanitised_data
+# The type validation of the fields of a dataclass (ex: the received commands => ThermostatState) is compiled once
+# per class into flat (field, isinstance types, optional) checks: no typing reflection on the per message path.
 
-def get_invalid_type_dataclass_fields(dataclass_type: Type, data: Dict[str, Any]) -> List[str]:
-    # Get the type hints of the dataclass fields
-    type_hints = get_type_hints(dataclass_type)
+##########################################################################################################
 
-    invalid_type_fields = []
+class DataclassValidator(object):
+    """The compiled field / type checks of a dataclass (any class with annotated fields)."""
 
-    # Validate types
-    for f, value in data.items():
-        expected_type = type_hints[f]
-        is_valid, expected_type =validate_value_matches_field_type(expected_type, value)
+    def __init__(self, dataclass_type: Type):
+        self.dataclass_type = dataclass_type
+        # field => (isinstance types, None allowed, expected type name)
+        self.checks: Dict[str, Tuple[Tuple[type, ...], bool, str]] = {
+            field_name: _compile_check(expected_type) for field_name, expected_type in get_type_hints(dataclass_type).items()
+        }
 
-        if not is_valid:
-            logging.getLogger(__name__).warning(f"Field [{f}] must be of type [{expected_type}], got [{type(value).__name__}]")
+    def invalid_fields(self, data: Dict[str, Any]) -> List[str]:
+        """The fields of data whose value does not match the field type (the unknown fields are not checked)."""
+        checks = self.checks
+        invalid_type_fields = []
+        for f, value in data.items():
+            check = checks.get(f)
+            if check is None:
+                continue
+            types, is_optional, type_name = check
+            if value is None:
+                if is_optional:
+                    continue
+            elif isinstance(value, types):
+                continue
+            _logger.warning('Field [%s] must be of type [%s], got [%s]', f, type_name, type(value).__name__)
             invalid_type_fields.append(f)
+        return invalid_type_fields
 
-    return invalid_type_fields
+    def valid_fields(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """The fields of data that are fields of the dataclass, with a value of the field type."""
+        checks = self.checks
+        sanitised_data = {}
+        for f, value in data.items():
+            check = checks.get(f)
+            if check is None:
+                continue
+            types, is_optional, type_name = check
+            if (value is None and is_optional) or (value is not None and isinstance(value, types)):
+                sanitised_data[f] = value
+            else:
+                _logger.warning('Field [%s] must be of type [%s], got [%s]', f, type_name, type(value).__name__)
+        return sanitised_data
 
-def validate_value_matches_field_type(expected_type, value) -> Tuple[bool, Any]:
-    is_valid = True
+    def validate_many(self, items: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """valid_fields of every dict of items (a non dict item gives an empty dict)."""
+        valid_fields = self.valid_fields
+        return [valid_fields(item) if isinstance(item, dict) else {} for item in items]
+
+
+def _compile_check(expected_type) -> Tuple[Tuple[type, ...], bool, str]:
     origin = get_origin(expected_type)
 
     if origin is Union:
-        # Handle Optional (Union[T, None])
-        args = expected_type.__args__
-        if len(args) == 2 and type(None) in args:
-            # This is Optional[T], so value can be None or of type T
-            non_none_type = next(arg for arg in args if arg is not type(None))
-            if value is not None and not isinstance(value, non_none_type):
-                expected_type = non_none_type.__name__
-                is_valid = False
-        else:
-            # Regular Union (not Optional)
-            if not isinstance(value, expected_type):
-                is_valid = False
-    else:
-        # Not a Union (not Optional)
-        if not isinstance(value, expected_type):
-            expected_type = expected_type.__name__
-            is_valid = False
-
-    return is_valid, expected_type
-
-##########################################################################################################
\ No newline at end of file
+        args = get_args(expected_type)
+        is_optional = type(None) in args
+        types = tuple(_runtime_type(arg) for arg in args if arg is not type(None))
+        if is_optional and len(types) == 1:
+            # Optional[T]: the expected type is reported as T
+            return types, True, types[0].__name__
+        return types, is_optional, str(expected_type)
+
+    runtime_type = _runtime_type(expected_type)
+    return (runtime_type,), expected_type is type(None), getattr(runtime_type, '__name__', str(runtime_type))
+
+
+def _runtime_type(expected_type) -> type:
+    # List[str] => list, Any => object
+    if expected_type is Any:
+        return object
+    origin = get_origin(expected_type)
+    return origin if isinstance(origin, type) else expected_type
+
+
+@functools.lru_cache(maxsize=None)
+def get_validator(dataclass_type: Type) -> DataclassValidator:
+    """The compiled validator of dataclass_type (compiled once, cached)."""
+    return DataclassValidator(dataclass_type)
+
+##########################################################################################################
+
+def get_valid_dataclass_fields(dataclass_type: Type, data: Dict[str, Any]) -> Dict[str, Any]:
+    # Remove keys that are not fields and keys with values are not same type as fields
+    return get_validator(dataclass_type).valid_fields(data)
+
+def get_invalid_type_dataclass_fields(dataclass_type: Type, data: Dict[str, Any]) -> List[str]:
+    return get_validator(dataclass_type).invalid_fields(data)
+
+def validate_many(dataclass_type: Type, items: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """get_valid_dataclass_fields of every dict of items, in one loop."""
+    return get_validator(dataclass_type).validate_many(items)
+
+def validate_value_matches_field_type(expected_type, value) -> Tuple[bool, Any]:
+    types, is_optional, type_name = _compile_check(expected_type)
+    if value is None:
+        return is_optional, (expected_type if is_optional else type_name)
+    is_valid = isinstance(value, types)
+    return is_valid, (expected_type if is_valid else type_name)
+
+##########################################################################################################
@@ -2,7 +2,7 @@
 import logging
 from typing import Dict, Optional, List, Any
 
-from dataclasses import is_dataclass
+from dataclasses import fields, is_dataclass
 
 from datetime import datetime
 import json
@@ -27,8 +27,10 @@ class DateEncoder(json.JSONEncoder):
 ##########################################################################################################
 class DataClassJsonEncoder(DateEncoder):
     def default(self, obj):
+        if hasattr(obj.__class__, 'to_dict'):
+            return obj.to_dict()
         if is_dataclass(obj.__class__):
-            return obj.__dict__
+            return {f.name: getattr(obj, f.name) for f in fields(obj)}
         # Let the base class default method raise the TypeError
         return DateEncoder.default(self, obj)
 ##########################################################################################################
\ No newline at end of file
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+from typing import Callable, Dict, Final, Iterable, List, Optional, Tuple
+import logging
+
+import bisect
+import http.server
+import threading
+
+_logger = logging.getLogger(__name__)
+
+##########################################################################################################
+
+# Minimal Prometheus-style metrics (text exposition format 0.0.4), no external dependency.
+#
+# Hot path cost: a labelled child is resolved once (`.labels(...)`, cached) and kept by the caller, then an
+# update is a plain attribute increment (+ one bisect for the histograms). No lock is taken on update: the
+# metrics of a device are only updated from the thread doing its I/O, and a scrape reading a value that is
+# being updated only sees the previous or the next value.
+# Values already tracked elsewhere (queue depth, reconnects...) are exported with CallbackMetric, read on scrape.
+
+METRICS_PORT = 18000
+
+# seconds, from 1ms (in memory) to 10s (tuya timeouts)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+JSON_CONTENT_TYPE = 'application/json'
+
+# the extra GET endpoints of the metrics server: (path, query string) => (http status, json body)
+HttpRoute = Callable[[str, str], Tuple[int, bytes]]
+
+##########################################################################################################
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = '') -> str:
+    labels = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+##########################################################################################################
+
+class _CounterChild(object):
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+
+class _HistogramChild(object):
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # one count per bucket (not cumulative) + the +Inf one
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+##########################################################################################################
+
+class _Metric(object):
+    metric_type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._children_lock = threading.Lock()
+
+    def labels(self, *label_values: str):
+        """The child of these label values (cached, resolve it once and keep it on the hot path)."""
+        child = self._children.get(label_values)
+        if child is None:
+            if len(label_values) != len(self.label_names):
+                raise ValueError(f'Metric [{self.name}] expects labels {self.label_names}, got {label_values}')
+            with self._children_lock:
+                child = self._children.setdefault(label_values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def collect(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        for label_values, child in list(self._children.items()):
+            lines.extend(self._samples(label_values, child))
+        return lines
+
+    def _samples(self, label_values: Tuple[str, ...], child) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    metric_type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: int = 1) -> None:
+        self.labels().inc(amount)
+
+    def _samples(self, label_values, child) -> List[str]:
+        return [f'{self.name}{_format_labels(self.label_names, label_values)} {_format_value(child.value)}']
+
+
+class Histogram(_Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _samples(self, label_values, child) -> List[str]:
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), list(child.counts)):
+            cumulative += count
+            labels = _format_labels(self.label_names, label_values, extra=f'le="{_format_value(bound)}"')
+            samples.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.label_names, label_values)
+        samples.append(f'{self.name}_sum{labels} {_format_value(child.sum)}')
+        samples.append(f'{self.name}_count{labels} {child.count}')
+        return samples
+
+
+class CallbackMetric(_Metric):
+    """Gauge / counter read from the application state on every scrape."""
+
+    def __init__(self, name: str, documentation: str, metric_type: str = 'gauge', label_names: Iterable[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self.metric_type = metric_type
+        self._callbacks: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set_callback(self, callback: Callable[[], float], *label_values: str) -> None:
+        self._callbacks[label_values] = callback
+
+    def remove_callback(self, *label_values: str) -> None:
+        self._callbacks.pop(label_values, None)
+
+    def collect(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        for label_values, callback in list(self._callbacks.items()):
+            try:
+                value = callback()
+            except Exception as e:
+                _logger.warning('Failed to collect [%s%s]: [%s]', self.name, label_values, e)
+                continue
+            lines.append(f'{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}')
+        return lines
+
+##########################################################################################################
+
+class MetricsRegistry(object):
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.label_names != metric.label_names:
+                    raise ValueError(f'Metric [{metric.name}] already registered with another definition')
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, label_names: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def callback(self, name: str, documentation: str, metric_type: str = 'gauge', label_names: Iterable[str] = ()) -> CallbackMetric:
+        return self.register(CallbackMetric(name, documentation, metric_type, label_names))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+# the process wide registry
+METRICS: Final = MetricsRegistry()
+
+##########################################################################################################
+
+class _MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    registry: MetricsRegistry = METRICS
+    # path prefix => route
+    routes: Dict[str, HttpRoute] = {}
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        if path == '/metrics':
+            self._send(200, CONTENT_TYPE, self.registry.render().encode('utf-8'))
+            return
+
+        route = next((route for prefix, route in self.routes.items() if path == prefix or path.startswith(prefix + '/')), None)
+        if route is None:
+            self.send_error(404)
+            return
+
+        try:
+            status, body = route(path, query)
+        except Exception as e:
+            _logger.error('Failed to serve [%s]: [%s]', self.path, e)
+            self.send_error(500)
+            return
+        self._send(status, JSON_CONTENT_TYPE, body)
+
+    def _send(self, status: int, content_type: str, body: bytes):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        _logger.debug('Metrics request from [%s]: ' + format, self.client_address[0], *args)
+
+
+def start_metrics_server(port: int = METRICS_PORT, address: str = '', registry: MetricsRegistry = METRICS,
+                         routes: Dict[str, HttpRoute] | None = None) -> http.server.ThreadingHTTPServer:
+    """Serve GET /metrics (and the routes) on a daemon thread."""
+    handler = type('MetricsRequestHandler', (_MetricsRequestHandler,), {'registry': registry, 'routes': dict(routes or {})})
+    server = http.server.ThreadingHTTPServer((address, port), handler)
+    server.daemon_threads = True
+
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    _logger.info('Serving metrics on [%s:%s/metrics]', address or '*', server.server_address[1])
+    return server
+
+##########################################################################################################
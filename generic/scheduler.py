@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+from typing import Any, Callable, Dict, Hashable, List, Optional
+import logging
+
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+_logger = logging.getLogger(__name__)
+
+##########################################################################################################
+
+# Heap based timer scheduler, shared by all the devices of a process.
+# The I/O loop sleeps until next_deadline() (or until there is socket I/O), then calls run_due().
+#  * schedule / cancel are O(log n) / O(1) (cancelled entries are dropped lazily when they reach the top)
+#  * one key = one pending timer; scheduling an existing key replaces its timer
+#  * on_wakeup is called when a timer is added that is earlier than the current earliest one, so a loop
+#    sleeping on a longer timeout (in another thread) can be woken up
+
+##########################################################################################################
+
+class _TimerEntry(object):
+    __slots__ = ('when', 'sequence', 'key', 'callback', 'cancelled')
+
+    def __init__(self, when: float, sequence: int, key: Hashable, callback: Callable[[], Any]):
+        self.when = when
+        self.sequence = sequence
+        self.key = key
+        self.callback = callback
+        self.cancelled = False
+
+    def __lt__(self, other: "_TimerEntry") -> bool:
+        return (self.when, self.sequence) < (other.when, other.sequence)
+
+##########################################################################################################
+
+class TimerScheduler(object):
+
+    def __init__(self, time_func: Callable[[], float] = time.time):
+        self.time_func = time_func
+        self.on_wakeup: Callable[[], None] | None = None
+
+        self._heap: List[_TimerEntry] = []
+        self._entries: Dict[Hashable, _TimerEntry] = {}
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def schedule(self, key: Hashable, when: float, callback: Callable[[], Any]) -> None:
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                previous.cancelled = True
+
+            entry = _TimerEntry(when, next(self._sequence), key, callback)
+            self._entries[key] = entry
+            heapq.heappush(self._heap, entry)
+
+            is_earliest = self._peek() is entry
+
+        if is_earliest and self.on_wakeup is not None:
+            self.on_wakeup()
+
+    def schedule_in(self, key: Hashable, delay_seconds: float, callback: Callable[[], Any]) -> None:
+        self.schedule(key, self.time_func() + delay_seconds, callback)
+
+    def cancel(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return False
+            entry.cancelled = True
+            return True
+
+    def deadline_of(self, key: Hashable) -> Optional[float]:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.when if entry is not None else None
+
+    def next_deadline(self) -> Optional[float]:
+        with self._lock:
+            entry = self._peek()
+            return entry.when if entry is not None else None
+
+    def seconds_until_next(self, default: Optional[float] = None) -> Optional[float]:
+        """Time to sleep until the next timer is due (0 if one is already due, `default` if there is none)."""
+        deadline = self.next_deadline()
+        if deadline is None:
+            return default
+        return max(0.0, deadline - self.time_func())
+
+    def run_due(self, now: Optional[float] = None) -> int:
+        """Run the callbacks of all the timers due at `now`. Returns the number of callbacks run.
+        Timers (re)scheduled by these callbacks are left for the next call, even if they are already due."""
+        if now is None:
+            now = self.time_func()
+
+        with self._lock:
+            due_entries = []
+            while True:
+                entry = self._peek()
+                if entry is None or entry.when > now:
+                    break
+                due_entries.append(heapq.heappop(self._heap))
+
+        executed = 0
+        for entry in due_entries:
+            with self._lock:
+                # cancelled / rescheduled by a callback run before it
+                if entry.cancelled:
+                    continue
+                del self._entries[entry.key]
+
+            # callbacks run outside the lock, so they can reschedule themselves
+            try:
+                entry.callback()
+            except Exception as e:
+                _logger.error('Exception in timer [%s]: [%s]', entry.key, e)
+                if _logger.isEnabledFor(logging.ERROR):
+                    traceback.print_exc()
+            executed += 1
+
+        return executed
+
+    def _peek(self) -> Optional[_TimerEntry]:
+        # drop the cancelled entries from the top of the heap
+        while self._heap and self._heap[0].cancelled:
+            heapq.heappop(self._heap)
+        return self._heap[0] if self._heap else None
+
+##########################################################################################################
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+from typing import Any, Callable, Dict, Final, List
+import logging
+
+import json
+import os
+
+_logger = logging.getLogger(__name__)
+
+##########################################################################################################
+
+# JSON (de)serialisation of the mqtt payloads (STATE / COMMAND / RESULT), produced as bytes (what paho sends):
+#  * msgspec / orjson when installed (optional, not in the requirements), the stdlib json otherwise
+#  * BRIDGE_JSON_SERIALIZER=stdlib|orjson|msgspec forces one (falls back to the stdlib if it is not installed)
+# The payloads are compact (no spaces), whatever the implementation.
+
+SERIALIZER_STDLIB = 'stdlib'
+SERIALIZER_ORJSON = 'orjson'
+SERIALIZER_MSGSPEC = 'msgspec'
+
+# the automatic choice, fastest first
+SERIALIZER_PREFERENCE = (SERIALIZER_MSGSPEC, SERIALIZER_ORJSON, SERIALIZER_STDLIB)
+
+##########################################################################################################
+
+class JsonSerializer(object):
+    """dumps: object => json bytes / loads: json bytes (or str) => object."""
+
+    def __init__(self, name: str, dumps: Callable[[Any], bytes], loads: Callable[[bytes | str], Any]):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def __repr__(self):
+        return f'JsonSerializer({self.name})'
+
+
+def _stdlib_serializer() -> JsonSerializer:
+    encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+    return JsonSerializer(SERIALIZER_STDLIB, lambda obj: encoder.encode(obj).encode('utf-8'), json.loads)
+
+
+def _orjson_serializer() -> JsonSerializer:
+    import orjson
+
+    return JsonSerializer(SERIALIZER_ORJSON, lambda obj: orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS), orjson.loads)
+
+
+def _msgspec_serializer() -> JsonSerializer:
+    import msgspec
+
+    encoder = msgspec.json.Encoder()
+    decoder = msgspec.json.Decoder()
+    return JsonSerializer(SERIALIZER_MSGSPEC, encoder.encode, decoder.decode)
+
+
+_FACTORIES: Dict[str, Callable[[], JsonSerializer]] = {
+    SERIALIZER_STDLIB: _stdlib_serializer,
+    SERIALIZER_ORJSON: _orjson_serializer,
+    SERIALIZER_MSGSPEC: _msgspec_serializer,
+}
+
+##########################################################################################################
+
+def available_serializers() -> List[str]:
+    """The serializers that can be used here (their library is installed)."""
+    names = []
+    for name in SERIALIZER_PREFERENCE:
+        try:
+            _FACTORIES[name]()
+            names.append(name)
+        except ImportError:
+            continue
+    return names
+
+
+def get_serializer(name: str | None = None) -> JsonSerializer:
+    """The `name` serializer, or the fastest installed one (None)."""
+    if name is not None and name not in _FACTORIES:
+        raise ValueError(f'Unknown json serializer [{name}], expected one of {list(_FACTORIES)}')
+
+    for candidate in ([name] if name else []) + list(SERIALIZER_PREFERENCE):
+        try:
+            return _FACTORIES[candidate]()
+        except ImportError:
+            _logger.debug('Json serializer [%s] not installed', candidate)
+    return _stdlib_serializer()
+
+
+# the process wide serializer
+SERIALIZER: Final = get_serializer(os.getenv('BRIDGE_JSON_SERIALIZER') or None)
+
+# object => json bytes
+dumps: Final = SERIALIZER.dumps
+# json bytes / str => object
+loads: Final = SERIALIZER.loads
+
+##########################################################################################################
@@ -1,19 +1,28 @@
 #!/usr/bin/env python
-from typing import Any, Final, Optional, Dict
+from typing import Any, Callable, Final, List, Optional, Dict
 import logging
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
 
-import json
 import time
 import threading
 import traceback
-import copy
+import queue
 
 from tinytuya import Contrib
 
-from generic import try_get_from_structure, dict_map_keys, dict_filter_none
-from generic.dataclass_util import get_valid_dataclass_fields
-from bridge import TuyaCallbackOnAction
+from generic import try_get_from_structure, dict_filter_none, serializers
+from generic.dataclass_util import get_validator
+from generic.metrics import METRICS
+from generic.scheduler import TimerScheduler
+from moes.codec import DpsCodec
+from moes.device_models import MODELS, DEFAULT_MODEL, ThermostatModel
+from moes.command_batcher import CommandBatcher
+from moes.connection_manager import ConnectionManager
+from moes.tuya_protocol import TUYA_PORT
+from moes.status_interval import AdaptiveStatusInterval, STATUS_MIN_SECONDS, STATUS_MAX_SECONDS
+from bridge import TuyaCallbackOnAction, DpsTransport
+
+_logger = logging.getLogger(__name__)
 
 ##########################################################################################################
 
@@ -36,81 +45,143 @@ from bridge import TuyaCallbackOnAction
 
 ITERATION_INDEX_LIMIT = 2000
 
-MOES_TEMPERATURE_SCALE = 2
+TIMER_HEARTBEAT = 'heartbeat'
+TIMER_STATUS_GET = 'status_get'
+TIMER_COMMANDS = 'commands'
+TIMER_STATUS_REFRESH = 'status_refresh'
+
+# the device answers the heartbeats (every 9 seconds), nothing received for this long => half-open socket
+HALF_OPEN_TIMEOUT_SECONDS = 30
+
+DEVICE_REQUEST_SECONDS = METRICS.histogram('tuya_device_request_seconds', 'Duration of the blocking tinytuya calls', ('device', 'operation'))
+ERROR_FRAMES = METRICS.counter('tuya_error_frames_total', 'Error responses received from the device', ('device',))
+STATE_CHANGES = METRICS.counter('tuya_state_changes_total', 'State changes of the device, per field', ('device', 'field'))
+RECONNECTS = METRICS.callback('tuya_reconnects_total', 'Reconnections to the device', 'counter', ('device',))
+STATUS_INTERVAL = METRICS.callback('tuya_status_interval_seconds', 'Current interval between two periodic full status requests', 'gauge', ('device',))
+STATUS_REQUESTS = METRICS.callback('tuya_status_requests_total', 'Periodic full status requests', 'counter', ('device',))
+CHANGE_RATE = METRICS.callback('tuya_state_changes_per_hour', 'State changes of the device over the last hour', 'gauge', ('device',))
+COMMAND_QUEUE_DEPTH = METRICS.callback('tuya_command_queue_depth', 'Commands received, not applied to the device yet', 'gauge', ('device',))
 
 ##########################################################################################################
-@dataclass
-class ThermostatState(object):
-    is_on: Optional[bool] = None
-    target_temperature: Optional[float] = None
-    home_temperature: Optional[float] = None
-    manual_operating_mode: Optional[bool] = None
-    eco_mode: Optional[bool] = None
-    lock_enabled: Optional[bool] = None
+# the state fields, in the order of the ThermostatState slots / serialisation
+STATE_FIELDS: Final = ('is_on', 'target_temperature', 'home_temperature', 'manual_operating_mode', 'eco_mode', 'lock_enabled')
 
-    def clone(self):
-        return copy.deepcopy(self)
 
-    def to_json(self):
-        return json.dumps(asdict(self))
+class ThermostatState(object):
+    """Immutable (frozen, slotted) state of a thermostat.
+
+    A change creates a new state (`replace`), so a snapshot is the state itself: `clone()` costs nothing and the
+    device keeps its previous state without copying. The json serialisation is computed once per state.
+    """
+    __slots__ = STATE_FIELDS + ('_json',)
+
+    is_on: Optional[bool]
+    target_temperature: Optional[float]
+    home_temperature: Optional[float]
+    manual_operating_mode: Optional[bool]
+    eco_mode: Optional[bool]
+    lock_enabled: Optional[bool]
+
+    def __init__(self, is_on: Optional[bool] = None, target_temperature: Optional[float] = None,
+                 home_temperature: Optional[float] = None, manual_operating_mode: Optional[bool] = None,
+                 eco_mode: Optional[bool] = None, lock_enabled: Optional[bool] = None):
+        _set = object.__setattr__
+        _set(self, 'is_on', is_on)
+        _set(self, 'target_temperature', target_temperature)
+        _set(self, 'home_temperature', home_temperature)
+        _set(self, 'manual_operating_mode', manual_operating_mode)
+        _set(self, 'eco_mode', eco_mode)
+        _set(self, 'lock_enabled', lock_enabled)
+        _set(self, '_json', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'ThermostatState is immutable, use replace({name}=...)')
+
+    def __delattr__(self, name):
+        raise AttributeError('ThermostatState is immutable')
+
+    def values(self) -> tuple:
+        return (self.is_on, self.target_temperature, self.home_temperature,
+                self.manual_operating_mode, self.eco_mode, self.lock_enabled)
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self.values() == other.values()
+
+    def __hash__(self):
+        return hash(self.values())
+
+    def __repr__(self):
+        return 'ThermostatState(' + ', '.join(f'{name}={value!r}' for name, value in zip(STATE_FIELDS, self.values())) + ')'
+
+    def __reduce__(self):
+        # copy / pickle (the default one would go through the blocked __setattr__)
+        return self.__class__, self.values()
+
+    def clone(self) -> "ThermostatState":
+        return self
+
+    def replace(self, **changes) -> "ThermostatState":
+        """A new state with these fields changed (self if nothing changes)."""
+        values = self.to_dict()
+        is_changed = False
+        for name, value in changes.items():
+            if name not in values:
+                raise AttributeError(f'ThermostatState has no field [{name}]')
+            if values[name] != value:
+                values[name] = value
+                is_changed = True
+        return ThermostatState(**values) if is_changed else self
+
+    def diff(self, other: "ThermostatState | None") -> Dict[str, Any]:
+        """The fields of this state that differ from `other` (all of them when other is None), with their new value."""
+        if other is None:
+            return self.to_dict()
+        return {name: value for name, value, other_value in zip(STATE_FIELDS, self.values(), other.values()) if value != other_value}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(zip(STATE_FIELDS, self.values()))
+
+    def to_json(self) -> bytes:
+        if self._json is None:
+            object.__setattr__(self, '_json', serializers.dumps(self.to_dict()))
+        return self._json
 
     @staticmethod
     def from_json(dictionary) -> "ThermostatState":
-        sanitised_parameters = get_valid_dataclass_fields(ThermostatState, dictionary)
+        sanitised_parameters = _STATE_VALIDATOR.valid_fields(dictionary)
         return ThermostatState(**sanitised_parameters)
 
+    @staticmethod
+    def from_json_many(dictionaries: List[Dict[str, Any]]) -> List["ThermostatState"]:
+        return [ThermostatState(**sanitised_parameters) for sanitised_parameters in _STATE_VALIDATOR.validate_many(dictionaries)]
+
+
+# the field / type checks of the received states, compiled once
+_STATE_VALIDATOR: Final = get_validator(ThermostatState)
+
 ##########################################################################################################
 
 class MoesBht002Thermostat(Contrib.ThermostatDevice):
-    __POWER_STATUS = 1
-    __TARGET_TEMPERATURE = 2
-    __MEASURED_TEMPERATURE = 3
-    __OPERATING_MODE = 4
-    __ECO_MODE = 5
-    __LOCK_ENABLED = 6
-
-    __IGNORE_METRIC1 = 102
-    __IGNORE_METRIC2 = 104
-
-    moes_metric_map = {
-        __POWER_STATUS:         'is_on',
-        __TARGET_TEMPERATURE:   'target_temperature',
-        __MEASURED_TEMPERATURE: 'home_temperature',
-        __OPERATING_MODE:       'manual_operating_mode',
-        __ECO_MODE:             'eco_mode',
-        __LOCK_ENABLED:         'lock_enabled',
-        __IGNORE_METRIC1:       None,
-        __IGNORE_METRIC2:       None,
-    }
-
-    dps_data = {
-        f'{__TARGET_TEMPERATURE}':  {'name': 'target_temperature', 'alt': 'setpoint_c', 'scale': 2},
-        f'{__MEASURED_TEMPERATURE}':{'name': 'home_temperature', 'alt': 'temperature_c', 'scale': 2},
-        f'{__OPERATING_MODE}':      {'name': 'manual_operating_mode', 'enum': ['0','1']},
-        f'{__ECO_MODE}':            {'name': 'eco_mode', 'decode': bool},
-        f'{__LOCK_ENABLED}':        {'name': 'lock_enabled', 'decode': bool},
-        f'{__IGNORE_METRIC1}':      {'name': 'ignore_1', 'decode': int},
-        f'{__IGNORE_METRIC2}':      {'name': 'ignore_2', 'decode': bool}
-    }
-
-    def __init__(self, *args, **kwargs):
+    """tinytuya client of a thermostat; the dps layout is the one of its model (the BHT-002 by default)."""
+
+    def __init__(self, *args, model: ThermostatModel | None = None, **kwargs):
+        self.model = model if model is not None else MODELS.get(DEFAULT_MODEL)
+        # per instance: a mixed fleet shares the tinytuya client class
+        self.dps_data = self.model.tinytuya_dps_data()
+        self.moes_metric_map = self.model.metric_map
+        # dps <=> state conversions, compiled once per model
+        self.codec: DpsCodec = self.model.codec
+
         super(MoesBht002Thermostat, self).__init__(*args, **kwargs)
 
     def map_dps_metric_to_state(self, dps_metric_id: str) -> str | None:
-        try:
-            return self.moes_metric_map.get(int(dps_metric_id), None)
-        except Exception as e:
-            logging.getLogger(__name__).error(f'Exception while _map_dps_metric_to_state [{dps_metric_id}]: [%s]', e)
-            if logging.getLogger(__name__).isEnabledFor(logging.ERROR):
-                traceback.print_exc()
-
-        return None
+        return self.codec.field_of(dps_metric_id)
 
     def map_state_to_dps_metric(self, state_field: str) -> int | None:
-        for key, value in self.moes_metric_map.items():
-            if value == state_field:
-                return key
-        return None
+        dps_id = self.codec.dps_of(state_field)
+        return int(dps_id) if dps_id is not None else None
 
 ##########################################################################################################
 
@@ -122,37 +193,52 @@ class MoesBhtThermostat(object):
     tuya_local_key: str
 
     device: Final[MoesBht002Thermostat]
+    model: ThermostatModel
 
     state_current: ThermostatState
     state_previous: ThermostatState
 
-    # delay between when a new full status should be retrieved, even if in sync
+    # delay between when a new full status should be retrieved, even if in sync: the initial value, then adapted to
+    # the activity of the device (see AdaptiveStatusInterval) within [full_status_get_min_seconds, full_status_get_max_seconds]
     full_status_get_delay_seconds: int = 1 * 60
-    # delay between when a new full status should be published
+    full_status_get_min_seconds: float = STATUS_MIN_SECONDS
+    full_status_get_max_seconds: float = STATUS_MAX_SECONDS
+    # max delay between two publishes of the full status (the republish is done by the bridge StatePublisher)
     full_status_publish_delay_seconds: int = 10 * 60
+    # the dps writes of the queued commands (submit_state) made within this window are merged and sent as one frame
+    # (0 = sent right away); the direct API (set_state, turn_on, ...) always writes right away
+    command_debounce_seconds: float = 0.5
+    # queued commands applied per turn of the I/O thread, the rest after the commands of the other devices (a device
+    # flooded with commands does not delay the others)
+    commands_per_turn: int = 4
 
     is_synchronized: Optional[bool] = False
 
     ping_time: Optional[float] = None
 
-    # when should next full status be sent
+    # when should next full status be retrieved
     full_status_get_time: Optional[float] = None
-    full_status_publish_time: Optional[float] = None
 
     is_connection_lost: bool = False
 
     def __init__(self, name: str, tuya_id: str, local_ip: str, tuya_local_key: str,
-                 device: MoesBht002Thermostat | None = None):
+                 device: MoesBht002Thermostat | None = None, model: str | ThermostatModel | None = None, port: int = TUYA_PORT,
+                 full_status_get_min_seconds: float | None = None, full_status_get_max_seconds: float | None = None):
         self.name = name
         self.tuya_id = tuya_id
         self.local_ip = local_ip
         self.tuya_local_key = tuya_local_key
 
+        if isinstance(model, str):
+            model = MODELS.get(model)
         if device is None:
-            device = MoesBht002Thermostat(tuya_id, local_ip, tuya_local_key, version=3.3)
+            # the reconnect backoff is done by the ConnectionManager, not by tinytuya (it would block the I/O thread)
+            device = MoesBht002Thermostat(tuya_id, local_ip, tuya_local_key, version=3.3, connection_retry_limit=1, model=model,
+                                          port=port)
         self.device = device
+        self.model = device.model
 
-        self.state_current = ThermostatState(
+        initial_state = dict(
             is_on=False,
             target_temperature=0.0,
             home_temperature=0.0,
@@ -160,6 +246,9 @@ class MoesBhtThermostat(object):
             eco_mode=False,
             lock_enabled=False
         )
+        # the fields without a dps on this model stay unknown
+        self.state_current = ThermostatState(**{state_field: value for state_field, value in initial_state.items()
+                                                if self.device.codec.dps_of(state_field) is not None})
         self.state_previous = self.state_current
 
         self.is_synchronized = False
@@ -170,68 +259,178 @@ class MoesBhtThermostat(object):
         self._in_callback_mutex = threading.Lock()
         self._on_callback: TuyaCallbackOnAction | None = None
 
+        self.connection = ConnectionManager(name)
+        self.last_receive_time: Optional[float] = None
+
+        self._status_seconds = DEVICE_REQUEST_SECONDS.labels(name, 'status')
+        self._receive_seconds = DEVICE_REQUEST_SECONDS.labels(name, 'receive')
+        self._set_value_seconds = DEVICE_REQUEST_SECONDS.labels(name, 'set_value')
+        self._error_frames = ERROR_FRAMES.labels(name)
+        RECONNECTS.set_callback(lambda: self.connection.reconnects, name)
+
+        # when set, the dps writes are handed to it (the asyncio engine) instead of the blocking tinytuya client
+        self.transport: DpsTransport | None = None
+
+        # owner of the periodic jobs of the device; replaced by the shared one when monitored with other devices
+        self.scheduler = TimerScheduler()
+
+        self.status_interval = AdaptiveStatusInterval(
+            name, initial_seconds=self.full_status_get_delay_seconds,
+            min_seconds=full_status_get_min_seconds if full_status_get_min_seconds is not None else self.full_status_get_min_seconds,
+            max_seconds=full_status_get_max_seconds if full_status_get_max_seconds is not None else self.full_status_get_max_seconds)
+        STATUS_INTERVAL.set_callback(lambda: self.status_interval.seconds, name)
+        STATUS_REQUESTS.set_callback(lambda: self.status_interval.status_requests, name)
+        CHANGE_RATE.set_callback(lambda: self.status_interval.changes_per_hour(), name)
+
+        # state field => time of the last value received from the device (the freshness of state_current)
+        self.field_update_times: Dict[str, float] = {}
+        # called by the device I/O thread with every state delta received from the device (changed or not)
+        self.data_listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+        # state changes submitted from other threads (mqtt), applied by the thread doing the device I/O
+        self._command_queue: queue.SimpleQueue = queue.SimpleQueue()
+        COMMAND_QUEUE_DEPTH.set_callback(lambda: self._command_queue.qsize(), name)
+
+        self.commands = CommandBatcher(name, lambda: self.scheduler, self._write_dps_now,
+                                       debounce_seconds=self.command_debounce_seconds)
+
     def connect(self):
-        logging.getLogger(__name__).debug(f'Connecting to [{self.tuya_id}] IP [{self.local_ip}] Local Key [{self.tuya_local_key}]')
+        _logger.debug('Connecting to [%s] IP [%s] Local Key [%s]', self.tuya_id, self.local_ip, self.tuya_local_key)
 
         data = self._get_data(all_data=True)
-        logging.getLogger(__name__).debug(f'Device status: [{data}]\n')
+        _logger.debug('Device status: [%s]\n', data)
 
         if data is not None and 'Error' not in data:
+            self.connection.record_success()
             had_state_updates = self._process_raw_data_updates(data)
             if had_state_updates:
                 self.is_synchronized = True
-            logging.getLogger(__name__).info(f'Connected to [{self.tuya_id}] IP [{self.local_ip}] | [is_synchronized={self.is_synchronized}]')
+            _logger.info('Connected to [%s] IP [%s] | [is_synchronized=%s]', self.tuya_id, self.local_ip, self.is_synchronized)
 
         elif data is not None and 'Error' in data:
             self.is_synchronized = False
-            logging.getLogger(__name__).error(f'Failed to connect to device [{self.tuya_id}] IP [{self.local_ip}] | [{data}]')
+            self.connection.record_failure()
+            _logger.error('Failed to connect to device [%s] IP [%s] | [%s]', self.tuya_id, self.local_ip, data)
 
         else:
-            logging.getLogger(__name__).warning(f'Maybe connected to device [{self.tuya_id}] IP [{self.local_ip}] | [is_synchronized={self.is_synchronized}]')
+            _logger.warning('Maybe connected to device [%s] IP [%s] | [is_synchronized=%s]', self.tuya_id, self.local_ip, self.is_synchronized)
 
     def start_monitoring(self, max_iterations: int = 0):
-        logging.getLogger(__name__).info(f'Start monitoring [{self.name}] for [x{max_iterations}]')
-
-        self.ping_time = self._next_ping_time()
-        self.full_status_get_time = time.time() + self.full_status_get_delay_seconds
-        self.full_status_publish_time = time.time() + self.full_status_publish_delay_seconds
-
-        iteration = 1
+        _logger.info('Start monitoring [%s] for [x%s]', self.name, max_iterations)
 
-        if max_iterations > 0:
-            loop_condition = lambda i: i <= max_iterations
-        else:
-            loop_condition = lambda i: True
+        # the single device mode is the monitor of a one device fleet (same timers / socket waiting)
+        from moes.monitor import DeviceMonitor
+        DeviceMonitor([self], scheduler=self.scheduler).run(max_iterations=max_iterations)
 
-        while loop_condition(iteration):
-            logging.getLogger(__name__).info(f'# [ {iteration:4d} / {max_iterations:4d} ]')
+    def init_monitoring(self, scheduler: TimerScheduler | None = None) -> None:
+        """Register the periodic jobs of this device (heartbeat / full status get) on the scheduler."""
+        if scheduler is not None:
+            self.scheduler = scheduler
 
-            if self.ping_time > time.time():
-                self.device.sendPing()
-                self.ping_time = self._next_ping_time()
+        self.ping_time = self._next_ping_time()
+        self.full_status_get_time = time.time() + self.status_interval.seconds
+
+        self.scheduler.schedule(self.timer_key(TIMER_HEARTBEAT), self.ping_time, self._on_heartbeat_timer)
+        self.scheduler.schedule(self.timer_key(TIMER_STATUS_GET), self.full_status_get_time, self._on_status_get_timer)
+
+    def stop_monitoring(self) -> None:
+        for timer in (TIMER_HEARTBEAT, TIMER_STATUS_GET, TIMER_STATUS_REFRESH):
+            self.scheduler.cancel(self.timer_key(timer))
+
+    def timer_key(self, timer: str) -> tuple[str, str]:
+        """Scheduler key of a periodic job of this device."""
+        return self.name, timer
+
+    def _on_heartbeat_timer(self) -> None:
+        if self.transport is not None:
+            self.transport.send_heartbeat()
+        elif self._is_half_open():
+            # the asyncio engine detects it with a read timeout
+            _logger.warning('Nothing received from [%s] for [%s] seconds, reopening the connection', self.name, HALF_OPEN_TIMEOUT_SECONDS)
+            self.device.close()
+            self.connection.record_failure()
+            self.set_connection_lost()
+        elif self.device.socket is not None:
+            # only keep an open connection alive, (re)connecting is done by polling
+            self.device.sendPing()
 
-            data = self._get_data()
-            if data:
-                if 'Error' not in data:
-                    had_state_updates = self._process_raw_data_updates(data)
-                    self.__set_connection_restored()
+        self.ping_time = self._next_ping_time()
+        self.scheduler.schedule(self.timer_key(TIMER_HEARTBEAT), self.ping_time, self._on_heartbeat_timer)
+
+    def _on_status_get_timer(self) -> None:
+        if self.full_status_get_time is not None and self.full_status_get_time > time.time() + 1:
+            # a full status was received since this timer was set (ex: on reconnect), no need for another one yet
+            self.scheduler.schedule(self.timer_key(TIMER_STATUS_GET), self.full_status_get_time, self._on_status_get_timer)
+            return
+
+        # the BHT-002 does not push all the changes (eco mode), so a full status is requested periodically
+        if self.transport is not None:
+            self.transport.request_status()
+        elif self.device.socket is not None:
+            # a disconnected device is reconnected by the monitor, with a backoff
+            self.handle_data(self._get_data(all_data=True))
+
+        # shorter while the device is in use, stretched while its state is stable
+        self.full_status_get_time = time.time() + self.status_interval.on_status_request()
+        self.scheduler.schedule(self.timer_key(TIMER_STATUS_GET), self.full_status_get_time, self._on_status_get_timer)
+
+    def _advance_status_get(self, delay_seconds: float) -> None:
+        # the interval got shorter (command / state change): the next full status is not left at the old, longer one
+        if self.full_status_get_time is None:
+            # not monitored
+            return
+        status_get_time = time.time() + delay_seconds
+        if status_get_time < self.full_status_get_time:
+            self.full_status_get_time = status_get_time
+            self.scheduler.schedule(self.timer_key(TIMER_STATUS_GET), status_get_time, self._on_status_get_timer)
+
+    def request_status(self) -> None:
+        """Thread-safe: ask a full status now (done by the thread doing the device I/O)."""
+        self.scheduler.schedule(self.timer_key(TIMER_STATUS_REFRESH), 0, self._on_status_refresh_timer)
+
+    def _on_status_refresh_timer(self) -> None:
+        if self.transport is not None:
+            self.transport.request_status()
+        elif self.device.socket is not None:
+            self.handle_data(self._get_data(all_data=True))
+        # a disconnected device gets a full status when the monitor reconnects it
+
+    def _is_half_open(self) -> bool:
+        return (self.device.socket is not None and self.last_receive_time is not None
+                and time.time() - self.last_receive_time > HALF_OPEN_TIMEOUT_SECONDS)
+
+    def poll(self) -> Dict | None:
+        """Read the pending device data (or a full status when due) and process it."""
+        was_connected = self.device.socket is not None
+        data = self._get_data()
+        if was_connected and self.device.socket is not None:
+            # the monitor polls a connected device only when its socket has data (ex: heartbeat answers)
+            self.last_receive_time = time.time()
+        self.handle_data(data)
+        return data
 
-                    if had_state_updates and not self.is_synchronized:
-                        self.is_synchronized = True
+    def handle_data(self, data: Dict | None) -> None:
+        """Process a response / update received from the device (by any I/O engine)."""
+        if data:
+            if 'Error' not in data:
+                self.last_receive_time = time.time()
+                self.connection.record_success()
 
-                else:
-                    self.__set_connection_lost()
+                had_state_updates = self._process_raw_data_updates(data)
+                self.__set_connection_restored()
 
-            iteration = self._increment_iteration(iteration, data)
+                if had_state_updates and not self.is_synchronized:
+                    self.is_synchronized = True
 
-    @staticmethod
-    def _increment_iteration(iteration: int, data: Dict | None) -> int:
-        if data is None or 'Error' not in data:
-            iteration += 1
-        if iteration > ITERATION_INDEX_LIMIT:
-            iteration = 1
+            else:
+                self._error_frames.inc()
+                self.is_synchronized = False
+                self.connection.record_failure()
+                self.__set_connection_lost()
 
-        return iteration
+    def set_connection_lost(self) -> None:
+        self.is_synchronized = False
+        self.__set_connection_lost()
 
     @staticmethod
     def _next_ping_time() -> float:
@@ -241,117 +440,91 @@ class MoesBhtThermostat(object):
         return time.time() + 9
 
     def _get_data(self, all_data: bool = False) -> Dict:
-        logging.getLogger(__name__).debug(f'Get data(all_data={all_data}) | [is_synchronized={self.is_synchronized}]')
+        _logger.debug('Get data(all_data=%s) | [is_synchronized=%s]', all_data, self.is_synchronized)
 
+        start_time = time.perf_counter()
         if self.is_synchronized and not all_data and self.full_status_get_time > time.time():
             data = self.device.receive()
+            self._receive_seconds.observe(time.perf_counter() - start_time)
         else:
             data = self.device.status()
-            self.full_status_get_time = time.time() + self.full_status_get_delay_seconds
+            self._status_seconds.observe(time.perf_counter() - start_time)
+            self.full_status_get_time = time.time() + self.status_interval.seconds
 
         if data is not None and 'Error' in data:
             self.is_synchronized = False
 
-        logging.getLogger(__name__).debug(f'>>>> data: [{data}]')
+        _logger.debug('>>>> data: [%s]', data)
         return data
 
     def _process_raw_data_updates(self, data: Dict) -> bool:
-        logging.getLogger(__name__).debug(f'Processing updates for [{self.name}] with data=[{data}] | [is_synchronized={self.is_synchronized}]')
+        _logger.debug('Processing updates for [%s] with data=[%s] | [is_synchronized=%s]', self.name, data, self.is_synchronized)
 
         had_state_updates = False
 
         dps_data = try_get_from_structure(data, ['dps'])
 
         if dps_data is not None:
-            state_data = dict_map_keys(dps_data, self.device.map_dps_metric_to_state)
+            state_data = self.device.codec.decode(dps_data)
+            now = time.time()
+            for state_field in state_data:
+                self.field_update_times[state_field] = now
+
             had_state_updates = self._process_data_updates(state_data)
+
+            for data_listener in self.data_listeners:
+                data_listener(state_data)
         else:
-            logging.getLogger(__name__).debug('No DPS data available')
+            _logger.debug('No DPS data available')
 
-        logging.getLogger(__name__).debug(f'Processed updates for [{self.name}] => had_state_updates=[{had_state_updates}]')
+        _logger.debug('Processed updates for [%s] => had_state_updates=[%s]', self.name, had_state_updates)
         return had_state_updates
 
     def _process_data_updates(self, state_data: Dict[str, Any]) -> bool:
-        logging.getLogger(__name__).debug(f'Processing updates for [{self.name}] with data=[{state_data}] | [is_synchronized={self.is_synchronized}]')
-        had_state_updates = False
-
-        state_data = dict_filter_none(state_data)
+        """Apply a state delta ({field: value}, in the state units, ex: decoded by the codec)."""
+        _logger.debug('Processing updates for [%s] with data=[%s] | [is_synchronized=%s]', self.name, state_data, self.is_synchronized)
 
-        if len(state_data) > 0:
+        changes = {state_field: v for state_field, v in dict_filter_none(state_data).items() if state_field in STATE_FIELDS}
+        if len(changes) < len(state_data):
+            unknown_fields = [state_field for state_field in state_data if state_field not in STATE_FIELDS]
+            if unknown_fields:
+                _logger.warning('NEW-STATE: Unknown metrics for [%s]: %s', self.name, unknown_fields)
 
+        if len(changes) > 0:
             with self._in_synchronize_mutex:
-                current_state_backup = self.state_current.clone()
-
-                for state_field, v in state_data.items():
-                    update_result = self.__process_data_update(state_field, v)
-                    had_state_updates = had_state_updates or update_result
-
-                if had_state_updates and not self.state_current.__eq__(current_state_backup):
-                    logging.getLogger(__name__).info(f'State for [{self.name}] updated from [{self.state_previous}] to [{self.state_current}]')
-                    self.state_previous = current_state_backup
+                current_state = self.state_current
+                new_state = current_state.replace(**changes)
+
+                if new_state is not current_state:
+                    _logger.info('State for [%s] updated from [%s] to [%s]', self.name, current_state, new_state)
+                    changed_fields = new_state.diff(current_state)
+                    for state_field in changed_fields:
+                        STATE_CHANGES.labels(self.name, state_field).inc()
+                    self.state_previous = current_state
+                    self.state_current = new_state
+                    if self.is_synchronized:
+                        # not the first status after a (re)connection: a settable field changed = the device is in use
+                        # (the measured ones, ex: home_temperature, change on their own)
+                        is_interaction = any(state_field not in self.model.read_only_fields for state_field in changed_fields)
+                        self._advance_status_get(self.status_interval.on_state_change(is_interaction=is_interaction))
                     self._handle_on_state_changed()
 
-                elif self.full_status_publish_delay_seconds > time.time():
-                    logging.getLogger(__name__).info(f'State REFRESH for [{self.name}] with state [{self.state_current}]')
-                    self.full_status_publish_time = time.time() + self.full_status_publish_delay_seconds
-                    self._handle_on_state_changed()
-
-        return had_state_updates
-
-    def __process_data_update(self, state_field: str, metric_value: str) -> bool:
-        logging.getLogger(__name__).debug(f'Processing update for [{self.name}] to metric=[{state_field}] value=[{metric_value}]')
-
-        if metric_value is None:
-            logging.getLogger(__name__).warning(f'Failed to process update for [{self.name}] to metric=[{state_field}] value=[{metric_value}]. Null value.')
-            return False
-
-        if state_field == 'is_on':
-            logging.getLogger(__name__).debug(f'POWER_STATUS = [{metric_value}]')
-            self.state_current.is_on = bool(metric_value)
-            logging.getLogger(__name__).info(f'NEW-STATE: is_on is [{self.state_current.is_on}]')
-
-        elif state_field == 'target_temperature':
-            logging.getLogger(__name__).debug(f'TARGET_TEMPERATURE = [{metric_value}]')
-            self.state_current.target_temperature = round(int(metric_value) / MOES_TEMPERATURE_SCALE, 1)
-            logging.getLogger(__name__).info(f'NEW-STATE: target_temperature is [{self.state_current.target_temperature}]')
-
-        elif state_field == 'home_temperature':
-            logging.getLogger(__name__).debug(f'MEASURED_TEMPERATURE = [{metric_value}]')
-            self.state_current.home_temperature = round(int(metric_value) / MOES_TEMPERATURE_SCALE, 1)
-            logging.getLogger(__name__).info(f'NEW-STATE: home_temperature is [{self.state_current.home_temperature}]')
-
-        elif state_field == 'manual_operating_mode':
-            logging.getLogger(__name__).debug(f'OPERATING_MODE = [{metric_value}]')
-            self.state_current.manual_operating_mode = (metric_value == '1')
-            logging.getLogger(__name__).info(f'NEW-STATE: manual_operating_mode is [{self.state_current.manual_operating_mode}]')
-
-        elif state_field == 'eco_mode':
-            logging.getLogger(__name__).debug(f'ECO_MODE_ENABLED = [{metric_value}]')
-            self.state_current.eco_mode = bool(metric_value)
-            logging.getLogger(__name__).info(f'NEW-STATE: eco_mode is [{self.state_current.eco_mode}]')
-
-        elif state_field == 'lock_enabled':
-            logging.getLogger(__name__).debug(f'LOCK_ENABLED = [{metric_value}]')
-            self.state_current.lock_enabled = bool(metric_value)
-            logging.getLogger(__name__).info(f'NEW-STATE: lock_enabled is [{self.state_current.lock_enabled}]')
-
-        else:
-            logging.getLogger(__name__).warning(f'NEW-STATE: Unknown metric for [{self.name}]: metric=[{state_field}] value=[{metric_value}].')
-            return False
-
-        return True
+        return len(changes) > 0
 
     def _apply_state_change(self) -> None:
-        if self.state_previous.is_on != self.state_current.is_on:
-            self.set_is_on(self.state_current.is_on)
-        if self.state_previous.target_temperature != self.state_current.target_temperature:
-            self.set_target_temperature(self.state_current.target_temperature)
-        if self.state_previous.manual_operating_mode != self.state_current.manual_operating_mode:
-            self.set_manual_operating_mode(self.state_current.manual_operating_mode)
-        if self.state_previous.eco_mode != self.state_current.eco_mode:
-            self.set_eco_mode(self.state_current.eco_mode)
-        if self.state_previous.lock_enabled != self.state_current.lock_enabled:
-            self.set_lock_enabled(self.state_current.lock_enabled)
+        # the setters move state_previous, so the changes are taken from the (immutable) states before the writes
+        previous, current = self.state_previous, self.state_current
+
+        if previous.is_on != current.is_on:
+            self.set_is_on(current.is_on)
+        if previous.target_temperature != current.target_temperature:
+            self.set_target_temperature(current.target_temperature)
+        if previous.manual_operating_mode != current.manual_operating_mode:
+            self.set_manual_operating_mode(current.manual_operating_mode)
+        if previous.eco_mode != current.eco_mode:
+            self.set_eco_mode(current.eco_mode)
+        if previous.lock_enabled != current.lock_enabled:
+            self.set_lock_enabled(current.lock_enabled)
 
     def _handle_on_state_changed(self) -> None:
         with self._callback_mutex:
@@ -360,10 +533,10 @@ class MoesBhtThermostat(object):
         if on_callback:
             with self._in_callback_mutex:
                 try:
-                    on_callback(self, self.state_current.__dict__)
+                    on_callback(self, self.state_current.to_dict())
                 except Exception as e:
-                    logging.getLogger(__name__).error(f'Exception [{self.name}] while _handle_on_state_changed: [%s]', e)
-                    if logging.getLogger(__name__).isEnabledFor(logging.ERROR):
+                    _logger.error('Exception [%s] while _handle_on_state_changed: [%s]', self.name, e)
+                    if _logger.isEnabledFor(logging.ERROR):
                         traceback.print_exc()
 
     @property
@@ -378,13 +551,75 @@ class MoesBhtThermostat(object):
             self._on_callback = func
 
     def set_state(self, new_state: ThermostatState) -> ThermostatState:
-        logging.getLogger(__name__).info(f"Set [{self.name}] [state] to [{new_state}]")
+        _logger.info("Set [%s] [state] to [%s]", self.name, new_state)
+        self._advance_status_get(self.status_interval.on_interaction())
+
+        state_data = new_state.to_dict()
+        for state_field in self.unwritable_fields(state_data):
+            _logger.warning('The [%s] model of [%s] can not set [%s], ignored', self.model.name, self.name, state_field)
+            del state_data[state_field]
+
+        if self._process_data_updates(state_data):
+            # all the changed fields go to the device in one frame
+            with self.commands.batch():
+                self._apply_state_change()
 
-        if self._process_data_updates(new_state.__dict__):
-            self._apply_state_change()
+        return self.state_current
+
+    def restore_state(self, state_data: Dict[str, Any], field_update_times: Dict[str, float] | None = None) -> ThermostatState:
+        """Seed the state with the last known one (persisted before a restart), until the device sends its own.
+        Nothing is written to the device, and the device stays not synchronized."""
+        state_data = {state_field: value for state_field, value in _STATE_VALIDATOR.valid_fields(state_data).items()
+                      if value is not None and self.device.codec.dps_of(state_field) is not None}
 
+        with self._in_synchronize_mutex:
+            self.state_current = self.state_current.replace(**state_data)
+            self.state_previous = self.state_current
+        # the fields keep their age: a GET of the state still polls the device for the old ones
+        self.field_update_times.update({state_field: update_time for state_field, update_time in (field_update_times or {}).items()
+                                        if state_field in state_data and isinstance(update_time, (int, float))})
+
+        _logger.info('Restored the last known state of [%s]: [%s]', self.name, self.state_current)
         return self.state_current
 
+    def unwritable_fields(self, state_data: Dict[str, Any]) -> list[str]:
+        """The fields of state_data (set) that the model of this device can not write (read only / no dps)."""
+        return [state_field for state_field, value in state_data.items() if value is not None
+                and (state_field in self.model.read_only_fields or self.device.codec.dps_of(state_field) is None)]
+
+    def submit_state(self, new_state: ThermostatState,
+                     on_done: Callable[[ThermostatState | None, Exception | None], None] | None = None) -> None:
+        """Thread-safe set_state: the change is queued and applied by the thread doing the device I/O (the scheduler
+        owner), so the caller never waits on the device. on_done(state, error) is called from that thread."""
+        self._command_queue.put((new_state, on_done))
+        # due right away, wakes up the I/O loop
+        self.scheduler.schedule(self.timer_key(TIMER_COMMANDS), 0, self._on_commands_timer)
+
+    def _on_commands_timer(self) -> None:
+        for _ in range(self.commands_per_turn):
+            try:
+                new_state, on_done = self._command_queue.get_nowait()
+            except queue.Empty:
+                return
+
+            state, error = None, None
+            try:
+                # this thread runs the scheduler, so the flush timer of the debounced writes runs too
+                with self.commands.debounced():
+                    state = self.set_state(new_state)
+            except Exception as e:
+                _logger.error('Exception [%s] while applying [%s]: [%s]', self.name, new_state, e)
+                if _logger.isEnabledFor(logging.ERROR):
+                    traceback.print_exc()
+                error = e
+
+            if on_done is not None:
+                on_done(state, error)
+
+        if not self._command_queue.empty():
+            # the rest on the next turn, behind the timers already due (the other devices)
+            self.scheduler.schedule(self.timer_key(TIMER_COMMANDS), 0, self._on_commands_timer)
+
     def turn_on(self):
         self.set_is_on(True)
 
@@ -392,68 +627,75 @@ class MoesBhtThermostat(object):
         self.set_is_on(False)
 
     def set_is_on(self, is_on: bool):
-        logging.getLogger(__name__).info(f"Set [{self.name}] [is_on] to [{is_on}]")
+        _logger.info("Set [%s] [is_on] to [%s]", self.name, is_on)
 
-        if is_on:
-            self.device.turn_on()
-        else:
-            self.device.turn_off()
+        self._write_dps(*self.device.codec.encode('is_on', is_on))
 
-        self.state_previous = self.state_current.clone()
-        self.state_current.is_on = is_on
-        logging.getLogger(__name__).info(f"Set [{self.name}] [is_on] to [{self.state_current.is_on}]")
+        self.state_previous = self.state_current
+        self.state_current = self.state_current.replace(is_on=is_on)
+        _logger.info("Set [%s] [is_on] to [%s]", self.name, self.state_current.is_on)
 
     def set_target_temperature(self, temperature: float):
-        logging.getLogger(__name__).debug(f'setTemperature({temperature})')
+        _logger.debug('setTemperature(%s)', temperature)
 
-        if temperature < 5.0:
-            temperature = 5.0
-        if temperature > 35.0:
-            temperature = 35.0
+        temperature = self.model.clamp_temperature(temperature)
 
-        logging.getLogger(__name__).info(f"Setting [{self.name}] temperature to [{str(temperature) + '°C'}]")
-        moes_temp = int(temperature * MOES_TEMPERATURE_SCALE)
+        _logger.info("Setting [%s] temperature to [%s°C]", self.name, temperature)
+        dps_id, moes_temp = self.device.codec.encode('target_temperature', temperature)
 
-        logging.getLogger(__name__).debug(f"setMoesTemperature({moes_temp})")
-        self.device.set_value(index=self.device.map_state_to_dps_metric('target_temperature'), value=moes_temp)
+        _logger.debug("setMoesTemperature(%s)", moes_temp)
+        self._write_dps(dps_id, moes_temp)
 
-        self.state_previous = self.state_current.clone()
-        self.state_current.target_temperature = temperature
-        logging.getLogger(__name__).info(f"Set [{self.name}] [temperature] to [{self.state_current.target_temperature}]")
+        self.state_previous = self.state_current
+        self.state_current = self.state_current.replace(target_temperature=temperature)
+        _logger.info("Set [%s] [temperature] to [%s]", self.name, self.state_current.target_temperature)
 
     def set_manual_operating_mode(self, enabled: bool):
-        logging.getLogger(__name__).info(f"Setting [{self.name}] operating mode [{'MANUAL' if enabled else 'AUTO'}]")
+        _logger.info("Setting [%s] operating mode [%s]", self.name, 'MANUAL' if enabled else 'AUTO')
 
-        moes_op_mode_value = '1' if enabled else '0'
-        self.device.set_value(index=self.device.map_state_to_dps_metric('manual_operating_mode'), value=moes_op_mode_value, nowait=True)
+        self._write_dps(*self.device.codec.encode('manual_operating_mode', enabled), nowait=True)
 
-        self.state_previous = self.state_current.clone()
-        self.state_current.manual_operating_mode = enabled
-        logging.getLogger(__name__).info(f"Set [{self.name}] [manual_operating_mode] to [{self.state_current.manual_operating_mode}]")
+        self.state_previous = self.state_current
+        self.state_current = self.state_current.replace(manual_operating_mode=enabled)
+        _logger.info("Set [%s] [manual_operating_mode] to [%s]", self.name, self.state_current.manual_operating_mode)
 
     def set_eco_mode(self, eco_mode: bool):
-        logging.getLogger(__name__).info(f"Setting [{self.name}] eco mode [{'ON' if eco_mode else 'OFF'}]")
-        self.device.set_value(index=self.device.map_state_to_dps_metric('eco_mode'), value=eco_mode)
+        _logger.info("Setting [%s] eco mode [%s]", self.name, 'ON' if eco_mode else 'OFF')
+        self._write_dps(*self.device.codec.encode('eco_mode', eco_mode))
 
-        self.state_previous = self.state_current.clone()
-        self.state_current.eco_mode = eco_mode
-        logging.getLogger(__name__).info(f"Set [{self.name}] [eco_mode] to [{self.state_current.eco_mode}]")
+        self.state_previous = self.state_current
+        self.state_current = self.state_current.replace(eco_mode=eco_mode)
+        _logger.info("Set [%s] [eco_mode] to [%s]", self.name, self.state_current.eco_mode)
 
     def set_lock_enabled(self, lock_enabled: bool):
-        logging.getLogger(__name__).info(f"Setting [{self.name}] lock mode [{'ON' if lock_enabled else 'OFF'}]")
-        self.device.set_value(index=self.device.map_state_to_dps_metric('lock_enabled'), value=lock_enabled)
+        _logger.info("Setting [%s] lock mode [%s]", self.name, 'ON' if lock_enabled else 'OFF')
+        self._write_dps(*self.device.codec.encode('lock_enabled', lock_enabled))
+
+        self.state_previous = self.state_current
+        self.state_current = self.state_current.replace(lock_enabled=lock_enabled)
+        _logger.info("Set [%s] [lock_enabled] to [%s]", self.name, self.state_current.lock_enabled)
 
-        self.state_previous = self.state_current.clone()
-        self.state_current.lock_enabled = lock_enabled
-        logging.getLogger(__name__).info(f"Set [{self.name}] [lock_enabled] to [{self.state_current.lock_enabled}]")
+    def _write_dps(self, index: int | str, value: Any, nowait: bool = False):
+        self.commands.submit({str(index): value}, nowait=nowait)
 
+    def _write_dps_now(self, dps: Dict[str, Any], nowait: bool = False):
+        if self.transport is not None:
+            self.transport.send_dps(dps)
+        else:
+            start_time = time.perf_counter()
+            data = self.device.set_multiple_values(dps, nowait=nowait)
+            self._set_value_seconds.observe(time.perf_counter() - start_time)
+            # the device answers a write with the dps it changed: a status read while the write was pending (debounce)
+            # must not be the last word
+            if data and 'dps' in data:
+                self.handle_data(data)
 
     def __set_connection_lost(self):
         if not self.is_connection_lost:
             self.is_connection_lost = True
-            logging.getLogger(__name__).warning(f'Connection: Lost')
+            _logger.warning('Connection: Lost')
 
     def __set_connection_restored(self):
         if self.is_connection_lost:
             self.is_connection_lost = False
-            logging.getLogger(__name__).warning(f'Connection: Restored')
+            _logger.warning('Connection: Restored')
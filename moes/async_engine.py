@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+from typing import Any, Dict, List, Optional
+import logging
+
+import asyncio
+import threading
+import time
+import traceback
+
+from generic.scheduler import TimerScheduler
+from moes.MoesThermostat import MoesBhtThermostat, HALF_OPEN_TIMEOUT_SECONDS, ERROR_FRAMES
+from moes.monitor import LOOP_ITERATION_SECONDS
+from moes.tuya_protocol import TuyaFrameReader, encode_request, decode_message, HEART_BEAT, DP_QUERY, CONTROL
+
+_logger = logging.getLogger(__name__)
+
+##########################################################################################################
+
+# Concurrency model (asyncio engine):
+#  * one event loop (one thread) owns the tcp connections of ALL the thermostats
+#  * each device = 1 non-blocking connection + 1 reader task
+#  * heartbeats / status requests / status publishes of all the devices are timers of ONE shared TimerScheduler,
+#    served by a single scheduler task that sleeps until the next timer is due
+#  * received frames are decoded on the loop and fed to MoesBhtThermostat.handle_data (=> on_callback => mqtt)
+#  * a slow / dead device only delays its own reader task, never the other devices
+#  * the reconnects follow the backoff / circuit breaker of the device ConnectionManager; a connection with
+#    nothing received for HALF_OPEN_TIMEOUT_SECONDS (the heartbeats are answered) is considered half-open and reopened
+#  * dps writes from other threads (mqtt callbacks) are handed to the loop with call_soon_threadsafe
+
+CONNECT_TIMEOUT_SECONDS = 5
+READ_BUFFER_SIZE = 4096
+
+# limit of simultaneous tcp connects, so a (re)start of hundreds of devices does not turn into a connect storm
+MAX_CONCURRENT_CONNECTS = 20
+
+##########################################################################################################
+
+class AsyncTuyaConnection(object):
+    """Non-blocking tuya 3.3 connection to one thermostat, driven by the AsyncTuyaEngine event loop."""
+
+    def __init__(self, thermostat: MoesBhtThermostat, engine: "AsyncTuyaEngine"):
+        self.thermostat = thermostat
+        self.engine = engine
+
+        self._frame_reader = TuyaFrameReader()
+        self._writer: asyncio.StreamWriter | None = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def run(self):
+        while not self.engine.is_stopping:
+            try:
+                await self._run_session()
+            except (OSError, asyncio.TimeoutError, ConnectionError) as e:
+                _logger.warning('Connection to [%s] failed: [%s]', self.thermostat.name, e)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                _logger.error('Exception [%s] in connection: [%s]', self.thermostat.name, e)
+                if _logger.isEnabledFor(logging.ERROR):
+                    traceback.print_exc()
+            finally:
+                self._close()
+
+            if not self.engine.is_stopping:
+                self.thermostat.connection.record_failure()
+                self.thermostat.set_connection_lost()
+                await asyncio.sleep(self.thermostat.connection.seconds_until_retry())
+
+    async def _run_session(self):
+        device = self.thermostat.device
+
+        async with self.engine.connect_semaphore:
+            _logger.debug('Connecting to [%s] on [%s:%s]', self.thermostat.name, device.address, device.port)
+            reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(device.address, device.port), timeout=self.engine.connect_timeout_seconds)
+
+        _logger.info('Connected to [%s] on [%s:%s]', self.thermostat.name, device.address, device.port)
+        self.thermostat.connection.record_success()
+        self._frame_reader.reset()
+
+        self._request_status()
+
+        # on python < 3.12, wait_for may swallow the cancellation of a read completing at the same time
+        while not self.engine.is_stopping:
+            data = await asyncio.wait_for(reader.read(READ_BUFFER_SIZE), timeout=HALF_OPEN_TIMEOUT_SECONDS)
+            if not data:
+                raise ConnectionError('connection closed by the device')
+
+            for message in self._frame_reader.feed(data):
+                self._on_message(message)
+
+    def _on_message(self, message):
+        try:
+            data = decode_message(self.thermostat.device, message)
+        except Exception as e:
+            _logger.warning('Failed to decode message from [%s]: [%s]', self.thermostat.name, e)
+            ERROR_FRAMES.labels(self.thermostat.name).inc()
+            return
+
+        if data:
+            self.thermostat.handle_data(data)
+
+    def send(self, command: int, data: Dict[str, Any] | None = None) -> bool:
+        """Queue a frame on the connection. Must be called from the engine loop."""
+        if not self.is_connected:
+            _logger.warning('Not connected to [%s], dropping command [%s]', self.thermostat.name, command)
+            return False
+
+        self._writer.write(encode_request(self.thermostat.device, command, data))
+        return True
+
+    # DpsTransport (thread-safe) ##########################################################
+
+    def send_dps(self, dps: Dict[str, Any]) -> None:
+        self.engine.call_soon_threadsafe(self.send, CONTROL, dps)
+
+    def send_heartbeat(self) -> None:
+        self.engine.call_soon_threadsafe(self._send_heartbeat)
+
+    def request_status(self) -> None:
+        self.engine.call_soon_threadsafe(self._request_status)
+
+    #######################################################################################
+
+    def _send_heartbeat(self):
+        # a disconnected device gets no heartbeat, the reconnection is done by run()
+        if self.is_connected:
+            self.send(HEART_BEAT)
+
+    def _request_status(self):
+        if self.is_connected:
+            self.send(DP_QUERY)
+
+    def _close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+##########################################################################################################
+
+class AsyncTuyaEngine(object):
+    """Multiplexes the connections of many thermostats on one asyncio event loop."""
+
+    def __init__(self, thermostats: List[MoesBhtThermostat], scheduler: TimerScheduler | None = None,
+                 connect_timeout_seconds: float = CONNECT_TIMEOUT_SECONDS,
+                 max_concurrent_connects: int = MAX_CONCURRENT_CONNECTS):
+        self.scheduler = scheduler if scheduler is not None else TimerScheduler()
+        self.connect_timeout_seconds = connect_timeout_seconds
+        self.max_concurrent_connects = max_concurrent_connects
+
+        self.connections = [AsyncTuyaConnection(thermostat, self) for thermostat in thermostats]
+
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.connect_semaphore: asyncio.Semaphore | None = None
+        self.is_stopping = False
+
+        self._stopped: asyncio.Event | None = None
+        self._timers_changed: asyncio.Event | None = None
+        self._thread: threading.Thread | None = None
+
+    def run(self, duration_seconds: float | None = None):
+        """Run the engine on the calling thread, until stop() (or for `duration_seconds`)."""
+        asyncio.run(self._run(duration_seconds))
+
+    def start(self) -> threading.Thread:
+        """Run the engine on a dedicated (daemon) thread."""
+        # reset before the thread starts: a stop() called before the thread reaches _run is not lost
+        self.is_stopping = False
+        self._thread = threading.Thread(target=self.run, name='tuya-asyncio-engine', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self.is_stopping = True
+        if self.loop is not None and self._stopped is not None and not self.loop.is_closed():
+            try:
+                self.loop.call_soon_threadsafe(self._stopped.set)
+            except RuntimeError:
+                pass
+
+    def call_soon_threadsafe(self, callback, *args):
+        if self.loop is None or self.loop.is_closed():
+            _logger.warning('Tuya engine is not running, dropping call')
+            return
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    async def _run(self, duration_seconds: float | None):
+        _logger.info('Start asyncio engine for [%s] devices', len(self.connections))
+
+        self.loop = asyncio.get_running_loop()
+        self.connect_semaphore = asyncio.Semaphore(self.max_concurrent_connects)
+        self._stopped = asyncio.Event()
+        self._timers_changed = asyncio.Event()
+        if self.is_stopping:
+            # stop() was called before the loop was running
+            self._stopped.set()
+
+        self.scheduler.on_wakeup = lambda: self.call_soon_threadsafe(self._timers_changed.set)
+        for connection in self.connections:
+            connection.thermostat.transport = connection
+            connection.thermostat.init_monitoring(self.scheduler)
+
+        tasks = [asyncio.create_task(connection.run(), name=f'tuya-{connection.thermostat.name}')
+                 for connection in self.connections]
+        tasks.append(asyncio.create_task(self._run_scheduler(), name='tuya-scheduler'))
+        try:
+            if duration_seconds is not None:
+                try:
+                    await asyncio.wait_for(self._stopped.wait(), timeout=duration_seconds)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await self._stopped.wait()
+        finally:
+            self.is_stopping = True
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+            self.scheduler.on_wakeup = None
+            for connection in self.connections:
+                connection.thermostat.stop_monitoring()
+                connection.thermostat.transport = None
+
+        _logger.info('Stopped asyncio engine')
+
+    async def _run_scheduler(self):
+        iteration_seconds = LOOP_ITERATION_SECONDS.labels('asyncio')
+        while True:
+            start_time = time.perf_counter()
+            self.scheduler.run_due()
+            iteration_seconds.observe(time.perf_counter() - start_time)
+
+            self._timers_changed.clear()
+            try:
+                await asyncio.wait_for(self._timers_changed.wait(), timeout=self.scheduler.seconds_until_next())
+            except asyncio.TimeoutError:
+                pass
+
+##########################################################################################################
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import logging
+from dataclasses import dataclass
+
+_logger = logging.getLogger(__name__)
+
+##########################################################################################################
+
+# Conversion between the dps of a device model and the ThermostatState fields, compiled once per model from the
+# dps definitions of the model (see moes/device_models):
+#  * scale: the device value is an int in 1/scale units => round(value / scale, 1), written as int(value * scale)
+#  * enum: a two values dps is a flag of the state => True for its second value (ex: '0' auto / '1' manual)
+#  * decode: a python type applied to the device value (bool / int), written as is; `type` is its name in the
+#    json model definitions
+# Lookups are done on dicts in both directions; a whole `dps` dict is decoded into a state delta in one pass.
+
+# `type` of a dps in the model definitions
+DECODERS = {
+    'bool': bool,
+    'int': int,
+    'float': float,
+    'str': str,
+}
+
+##########################################################################################################
+
+def _identity(value: Any) -> Any:
+    return value
+
+
+@dataclass(frozen=True)
+class DpsField(object):
+    dps_id: str
+    # None = known dps, not part of the state (ignored)
+    name: Optional[str]
+    decode: Callable[[Any], Any] = _identity
+    encode: Callable[[Any], Any] = _identity
+
+    @staticmethod
+    def scaled(dps_id: str, name: str, scale: int) -> "DpsField":
+        return DpsField(dps_id, name,
+                        decode=lambda value: round(int(value) / scale, 1),
+                        encode=lambda value: int(round(value * scale)))
+
+    @staticmethod
+    def flag(dps_id: str, name: str, enum: List[str]) -> "DpsField":
+        if len(enum) != 2:
+            raise ValueError(f'The enum of dps [{dps_id}] must have 2 values (off / on), got {enum}')
+        off_value, on_value = enum
+
+        def decode(value):
+            if value not in enum:
+                raise ValueError(f'[{value}] not in {enum}')
+            return value == on_value
+
+        return DpsField(dps_id, name, decode=decode, encode=lambda value: on_value if value else off_value)
+
+    @staticmethod
+    def of(dps_id: str, name: Optional[str], dps_definition: Dict[str, Any] | None = None) -> "DpsField":
+        """The field of a dps definition ({'scale': 2} / {'enum': [...]} / {'decode': bool} / {'type': 'bool'})."""
+        dps_definition = dps_definition or {}
+        if name is None:
+            return DpsField(dps_id, None)
+        if 'scale' in dps_definition:
+            return DpsField.scaled(dps_id, name, dps_definition['scale'])
+        if 'enum' in dps_definition:
+            return DpsField.flag(dps_id, name, dps_definition['enum'])
+        if 'type' in dps_definition:
+            if dps_definition['type'] not in DECODERS:
+                raise ValueError(f'Unknown type [{dps_definition["type"]}] of dps [{dps_id}], expected one of {list(DECODERS)}')
+            return DpsField(dps_id, name, decode=DECODERS[dps_definition['type']])
+        return DpsField(dps_id, name, decode=dps_definition.get('decode', _identity))
+
+##########################################################################################################
+
+class DpsCodec(object):
+    """Compiled dps <=> state field table of a device model."""
+
+    def __init__(self, fields: Iterable[DpsField]):
+        self.fields: Tuple[DpsField, ...] = tuple(fields)
+
+        self._by_dps_id: Dict[str, DpsField] = {f.dps_id: f for f in self.fields}
+        self._by_name: Dict[str, DpsField] = {f.name: f for f in self.fields if f.name is not None}
+
+    def field_of(self, dps_id: str | int) -> Optional[str]:
+        field = self._by_dps_id.get(dps_id if dps_id.__class__ is str else str(dps_id))
+        return field.name if field is not None else None
+
+    def dps_of(self, name: str) -> Optional[str]:
+        field = self._by_name.get(name)
+        return field.dps_id if field is not None else None
+
+    def decode(self, dps: Dict[str, Any]) -> Dict[str, Any]:
+        """The state delta ({field: value}) of a device `dps` dict; unknown / ignored dps and None values are skipped."""
+        delta = {}
+        by_dps_id = self._by_dps_id
+        for dps_id, value in dps.items():
+            field = by_dps_id.get(dps_id if dps_id.__class__ is str else str(dps_id))
+            if field is None or field.name is None or value is None:
+                continue
+            try:
+                delta[field.name] = field.decode(value)
+            except (TypeError, ValueError) as e:
+                _logger.warning('Invalid value [%s] of dps [%s] (%s): [%s]', value, dps_id, field.name, e)
+        return delta
+
+    def encode(self, name: str, value: Any) -> Tuple[str, Any]:
+        """(dps id, device value) of a state field value."""
+        field = self._by_name.get(name)
+        if field is None:
+            raise KeyError(f'No dps for the state field [{name}]')
+        return field.dps_id, field.encode(value)
+
+    def encode_state(self, state_data: Dict[str, Any]) -> Dict[str, Any]:
+        """The dps ({dps id: device value}) of the state fields, None values skipped."""
+        return dict(self.encode(name, value) for name, value in state_data.items() if value is not None)
+
+##########################################################################################################
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+from typing import Any, Callable, Dict
+import logging
+
+import contextlib
+import threading
+
+from generic.scheduler import TimerScheduler
+
+_logger = logging.getLogger(__name__)
+
+##########################################################################################################
+
+# Dps writes toward a thermostat are not sent one by one:
+#  * every write is merged in the pending dps (a newer value of a dps replaces the older one)
+#  * the writes made inside `with debounced():` (the commands applied by the device I/O thread) are sent as ONE
+#    control frame (set_multiple_values), debounce_seconds after the first pending write => a burst of commands
+#    (ex: a slider sending 20 setpoints) ends up as one write of the last value
+#  * the flush is a timer of the device scheduler, so it runs on the thread doing the device I/O: only the thread
+#    running that scheduler may debounce, the other writes (the direct API) are sent right away
+#  * writes made inside `with batch():` are sent together, at the end of the block when there is no debounce
+
+TIMER_COMMAND_FLUSH = 'command_flush'
+
+# dps => sent
+DpsWriter = Callable[[Dict[str, Any], bool], None]
+
+##########################################################################################################
+
+class CommandBatcher(object):
+    """Coalesces the dps writes of one device into multi-dps frames."""
+
+    def __init__(self, name: str, scheduler_provider: Callable[[], TimerScheduler], writer: DpsWriter,
+                 debounce_seconds: float = 0.0):
+        self.name = name
+        self.scheduler_provider = scheduler_provider
+        self.writer = writer
+        self.debounce_seconds = debounce_seconds
+
+        self._pending: Dict[str, Any] = {}
+        self._pending_nowait = True
+        self._batch_depth = 0
+        self._debounce_depth = 0
+        self._lock = threading.RLock()
+
+    @property
+    def timer_key(self):
+        return self.name, TIMER_COMMAND_FLUSH
+
+    @property
+    def pending(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._pending)
+
+    def submit(self, dps: Dict[str, Any], nowait: bool = False) -> None:
+        with self._lock:
+            was_empty = len(self._pending) == 0
+            self._pending.update({str(index): value for index, value in dps.items()})
+            # the frame waits for the device response unless none of the merged writes does
+            self._pending_nowait = self._pending_nowait and nowait
+
+            if self._batch_depth > 0:
+                return
+
+            if not self._is_debounced():
+                self.flush()
+            elif was_empty:
+                # the window starts with the first pending write, the later ones do not postpone the flush
+                self.scheduler_provider().schedule_in(self.timer_key, self.debounce_seconds, self.flush)
+
+    @contextlib.contextmanager
+    def batch(self):
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if self._batch_depth == 0 and self._pending:
+                    if not self._is_debounced():
+                        self.flush()
+                    elif self.scheduler_provider().deadline_of(self.timer_key) is None:
+                        self.scheduler_provider().schedule_in(self.timer_key, self.debounce_seconds, self.flush)
+
+    @contextlib.contextmanager
+    def debounced(self):
+        """The writes made inside the block wait for debounce_seconds, to be merged with the next ones. To be used only
+        by the thread running the scheduler (nothing else would run the flush timer)."""
+        with self._lock:
+            self._debounce_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._debounce_depth -= 1
+
+    def _is_debounced(self) -> bool:
+        return self.debounce_seconds > 0 and self._debounce_depth > 0
+
+    def flush(self) -> None:
+        with self._lock:
+            self.scheduler_provider().cancel(self.timer_key)
+            if not self._pending:
+                return
+            dps, nowait = self._pending, self._pending_nowait
+            self._pending = {}
+            self._pending_nowait = True
+
+            _logger.info('Writing [%s] dps [%s]', self.name, dps)
+            self.writer(dps, nowait)
+
+##########################################################################################################
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+from typing import Callable, Optional
+import logging
+
+import random
+import time
+
+_logger = logging.getLogger(__name__)
+
+##########################################################################################################
+
+# Health of the tcp session to one thermostat:
+#
+#   CONNECTED --failure--> DEGRADED --(failure_threshold consecutive failures)--> OPEN_CIRCUIT
+#       ^                      |                                                      |
+#       +-------success--------+-----------------------success (probe)---------------+
+#
+#  * DEGRADED: reconnects are retried with an exponential backoff (base_delay_seconds * 2^n) and jitter
+#  * OPEN_CIRCUIT: the device keeps refusing, only one probe every max_delay_seconds (+ jitter)
+# The jitter spreads the reconnects of many devices (ex: after a wifi outage), so they do not all reconnect
+# (and request their full status) at the same time.
+
+STATE_CONNECTED = 'connected'
+STATE_DEGRADED = 'degraded'
+STATE_OPEN_CIRCUIT = 'open_circuit'
+
+BASE_DELAY_SECONDS = 1.0
+MAX_DELAY_SECONDS = 5 * 60.0
+FAILURE_THRESHOLD = 6
+# +/- 20% of the delay
+JITTER_RATIO = 0.2
+
+##########################################################################################################
+
+class ConnectionManager(object):
+    """Reconnect backoff / circuit breaker of the tcp session to one device."""
+
+    def __init__(self, name: str,
+                 base_delay_seconds: float = BASE_DELAY_SECONDS, max_delay_seconds: float = MAX_DELAY_SECONDS,
+                 failure_threshold: int = FAILURE_THRESHOLD, jitter_ratio: float = JITTER_RATIO,
+                 time_func: Callable[[], float] = time.time, random_func: Callable[[], float] = random.random):
+        self.name = name
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.failure_threshold = failure_threshold
+        self.jitter_ratio = jitter_ratio
+        self.time_func = time_func
+        self.random_func = random_func
+
+        # None until the first connection attempt
+        self.state: Optional[str] = None
+        self.consecutive_failures = 0
+        self.retry_time: Optional[float] = None
+        self.reconnects = 0
+
+        # called with the new state, on every state change
+        self.on_state_changed: Callable[[str], None] | None = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self.state == STATE_CONNECTED
+
+    def can_attempt(self, now: float | None = None) -> bool:
+        """True if a (re)connection can be tried now."""
+        if self.retry_time is None:
+            return True
+        return (now if now is not None else self.time_func()) >= self.retry_time
+
+    def seconds_until_retry(self) -> float:
+        if self.retry_time is None:
+            return 0.0
+        return max(0.0, self.retry_time - self.time_func())
+
+    def record_success(self) -> None:
+        if self.state != STATE_CONNECTED and self.state is not None:
+            self.reconnects += 1
+        self.consecutive_failures = 0
+        self.retry_time = None
+        self._set_state(STATE_CONNECTED)
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        delay = self.next_delay_seconds()
+        self.retry_time = self.time_func() + delay
+
+        state = STATE_OPEN_CIRCUIT if self.consecutive_failures >= self.failure_threshold else STATE_DEGRADED
+        _logger.warning('Connection to [%s] failed [x%s], next attempt in [%.1f] seconds', self.name, self.consecutive_failures, delay)
+        self._set_state(state)
+
+    def next_delay_seconds(self) -> float:
+        if self.consecutive_failures >= self.failure_threshold:
+            delay = self.max_delay_seconds
+        else:
+            delay = min(self.max_delay_seconds, self.base_delay_seconds * (2 ** (self.consecutive_failures - 1)))
+        return delay * (1 + self.jitter_ratio * (2 * self.random_func() - 1))
+
+    def _set_state(self, state: str) -> None:
+        if state == self.state:
+            return
+
+        _logger.info('Connection to [%s] is [%s] (was [%s])', self.name, state, self.state)
+        self.state = state
+        if self.on_state_changed is not None:
+            self.on_state_changed(state)
+
+##########################################################################################################
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+from typing import Any, Dict, FrozenSet, Final, List, Optional
+import logging
+from dataclasses import dataclass, field
+
+import glob
+import json
+import os
+
+from moes.codec import DECODERS, DpsCodec, DpsField
+
+_logger = logging.getLogger(__name__)
+
+##########################################################################################################
+
+# Thermostat models, loaded from declarative json definitions (one model per file, see moes/models):
+# {
+#   "model": "BHT-002",
+#   "temperature_min": 5.0, "temperature_max": 35.0,
+#   "dps": {
+#       "2":   {"name": "target_temperature", "scale": 2},
+#       "3":   {"name": "home_temperature", "scale": 2, "read_only": true},
+#       "4":   {"name": "manual_operating_mode", "enum": ["0", "1"]},
+#       "5":   {"name": "eco_mode", "type": "bool"},
+#       "102": {"name": null}
+#   }
+# }
+# A dps `name` is a ThermostatState field (null = known dps, ignored); the read_only fields are never written.
+# Every model compiles its DpsCodec once, shared by all the devices of the model (a mixed fleet runs in one process).
+
+MODELS_DIRECTORY = os.path.join(os.path.dirname(__file__), 'models')
+
+DEFAULT_MODEL = 'BHT-002'
+
+##########################################################################################################
+
+@dataclass
+class ThermostatModel(object):
+    name: str
+    # dps id => definition (name / scale / enum / type / read_only)
+    dps: Dict[str, Dict[str, Any]]
+    temperature_min: float = 5.0
+    temperature_max: float = 35.0
+    description: Optional[str] = None
+
+    codec: DpsCodec = field(init=False, repr=False)
+    read_only_fields: FrozenSet[str] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.dps = {str(dps_id): definition for dps_id, definition in self.dps.items()}
+        self.codec = DpsCodec(DpsField.of(dps_id, definition.get('name'), definition) for dps_id, definition in self.dps.items())
+        self.read_only_fields = frozenset(definition['name'] for definition in self.dps.values()
+                                          if definition.get('name') and definition.get('read_only'))
+
+    @property
+    def metric_map(self) -> Dict[int, Optional[str]]:
+        """dps id => state field (the `moes_metric_map` layout)."""
+        return {int(dps_id): definition.get('name') for dps_id, definition in self.dps.items()}
+
+    def tinytuya_dps_data(self) -> Dict[str, Dict[str, Any]]:
+        """The `dps_data` of the tinytuya ThermostatDevice (a new dict, tinytuya updates it)."""
+        dps_data = {}
+        for dps_id, definition in self.dps.items():
+            dps_definition = {'name': definition.get('name') or f'ignore_{dps_id}'}
+            if 'scale' in definition:
+                dps_definition['scale'] = definition['scale']
+            if 'enum' in definition:
+                dps_definition['enum'] = list(definition['enum'])
+            if 'type' in definition:
+                dps_definition['decode'] = DECODERS[definition['type']]
+            dps_data[dps_id] = dps_definition
+        return dps_data
+
+    def clamp_temperature(self, temperature: float) -> float:
+        return min(max(temperature, self.temperature_min), self.temperature_max)
+
+    @staticmethod
+    def from_json(dictionary: Dict[str, Any]) -> "ThermostatModel":
+        if not dictionary.get('model'):
+            raise ValueError('Model definition without [model] name')
+        if not dictionary.get('dps'):
+            raise ValueError(f'Model definition [{dictionary["model"]}] without [dps]')
+
+        names = [definition.get('name') for definition in dictionary['dps'].values() if definition.get('name')]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise ValueError(f'Model definition [{dictionary["model"]}] maps several dps to {duplicates}')
+
+        return ThermostatModel(name=dictionary['model'], dps=dictionary['dps'],
+                               temperature_min=dictionary.get('temperature_min', 5.0),
+                               temperature_max=dictionary.get('temperature_max', 35.0),
+                               description=dictionary.get('description'))
+
+##########################################################################################################
+
+class ModelRegistry(object):
+    """The known thermostat models, by name."""
+
+    def __init__(self):
+        self._models: Dict[str, ThermostatModel] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._models
+
+    @property
+    def names(self) -> List[str]:
+        return sorted(self._models)
+
+    def register(self, model: ThermostatModel) -> ThermostatModel:
+        if model.name in self._models:
+            _logger.info('Replacing the definition of the model [%s]', model.name)
+        self._models[model.name] = model
+        return model
+
+    def get(self, name: str) -> ThermostatModel:
+        model = self._models.get(name)
+        if model is None:
+            raise ValueError(f'Unknown thermostat model [{name}], known models: {self.names}')
+        return model
+
+    def load_file(self, file_path: str) -> ThermostatModel:
+        with open(file_path, 'r') as definition_file:
+            model = self.register(ThermostatModel.from_json(json.load(definition_file)))
+
+        _logger.debug('Loaded the model [%s] from [%s]', model.name, file_path)
+        return model
+
+    def load_directory(self, directory: str) -> List[ThermostatModel]:
+        return [self.load_file(file_path) for file_path in sorted(glob.glob(os.path.join(directory, '*.json')))]
+
+
+# the process wide registry, with the bundled definitions
+MODELS: Final = ModelRegistry()
+MODELS.load_directory(MODELS_DIRECTORY)
+
+##########################################################################################################
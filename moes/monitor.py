@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+from typing import Dict, List, Optional
+import logging
+
+import selectors
+import socket
+import threading
+import time
+import traceback
+
+from generic.metrics import METRICS
+from generic.scheduler import TimerScheduler
+from moes.MoesThermostat import MoesBhtThermostat, ITERATION_INDEX_LIMIT
+
+_logger = logging.getLogger(__name__)
+
+##########################################################################################################
+
+# Concurrency model (multi-device mode):
+#  * one thread (the caller of DeviceMonitor.run) owns the I/O of ALL the thermostats
+#  * the persistent tuya sockets are multiplexed with a selector, so a device is only read when it has data
+#  * heartbeats / full status requests / full status publishes of all the devices are timers of ONE shared
+#    TimerScheduler; the selector wait lasts until the next timer is due (or until a socket has data)
+#  * the mqtt side runs on the single paho network thread of the shared MqttClient
+# => the number of threads (and their stacks) does not grow with the number of devices.
+
+LOOP_ITERATION_SECONDS = METRICS.histogram('bridge_loop_iteration_seconds', 'Work time of one device I/O loop iteration (without the waiting)', ('engine',))
+
+##########################################################################################################
+
+class DeviceMonitor(object):
+    """Monitors several thermostats from a single thread, waiting on their sockets with a selector."""
+
+    def __init__(self, thermostats: List[MoesBhtThermostat], scheduler: TimerScheduler | None = None,
+                 max_wait_seconds: float = 60.0):
+        self.thermostats = thermostats
+        self.scheduler = scheduler if scheduler is not None else TimerScheduler()
+        # upper bound for a selector wait (the timers and the wakeup socket normally end the wait before)
+        self.max_wait_seconds = max_wait_seconds
+
+        self._selector = selectors.DefaultSelector()
+        # device index => watched socket (the thermostats are not hashable)
+        self._registered_sockets: Dict[int, object] = {}
+        self._stop_event = threading.Event()
+
+        # written to when a timer is scheduled from another thread (ex: mqtt callbacks), to end the selector wait
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self._selector.register(self._wakeup_reader, selectors.EVENT_READ, data=None)
+
+        self._iteration_seconds = LOOP_ITERATION_SECONDS.labels('selector')
+
+    def run(self, max_iterations: int = 0):
+        _logger.info('Start monitoring [%s] devices for [x%s]', len(self.thermostats), max_iterations)
+
+        self.scheduler.on_wakeup = self.wakeup
+        for thermostat in self.thermostats:
+            thermostat.init_monitoring(self.scheduler)
+
+        iteration = 1
+        while not self._stop_event.is_set() and (max_iterations <= 0 or iteration <= max_iterations):
+            _logger.debug('# [ %4d / %4d ]', iteration, max_iterations)
+
+            self.step()
+
+            iteration += 1
+            if max_iterations <= 0 and iteration > ITERATION_INDEX_LIMIT:
+                iteration = 1
+
+        for thermostat in self.thermostats:
+            thermostat.stop_monitoring()
+        self.scheduler.on_wakeup = None
+        self.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.wakeup()
+
+    def wakeup(self):
+        try:
+            self._wakeup_writer.send(b'\0')
+        except (BlockingIOError, OSError):
+            # already signaled (buffer full) or closed
+            pass
+
+    def step(self) -> int:
+        """Run one monitoring pass: wait for socket data or the next timer, then serve both.
+        Returns the number of devices that were polled."""
+        ready = self._wait_for_ready_devices()
+        start_time = time.perf_counter()
+
+        polled = 0
+        for index, thermostat in enumerate(self.thermostats):
+            # a disconnected device is (re)connected by polling it, when its reconnect backoff allows it
+            if index in ready or (thermostat.device.socket is None and thermostat.connection.can_attempt()):
+                self._guarded(thermostat, thermostat.poll)
+                polled += 1
+
+        self.scheduler.run_due()
+
+        self._iteration_seconds.observe(time.perf_counter() - start_time)
+        return polled
+
+    def close(self):
+        for index in list(self._registered_sockets):
+            self._unregister(index)
+        self._selector.close()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+
+    def _wait_for_ready_devices(self) -> set[int]:
+        self._sync_registrations()
+
+        timeout = min(self.scheduler.seconds_until_next(default=self.max_wait_seconds), self.max_wait_seconds)
+        for thermostat in self.thermostats:
+            if thermostat.device.socket is None:
+                # do not wait past the next reconnect attempt
+                timeout = min(timeout, thermostat.connection.seconds_until_retry())
+
+        ready = set()
+        for key, _ in self._selector.select(timeout):
+            if key.data is None:
+                self._drain_wakeup()
+            else:
+                ready.add(key.data)
+        return ready
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_reader.recv(1024):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _sync_registrations(self):
+        for index, thermostat in enumerate(self.thermostats):
+            sock = thermostat.device.socket
+            registered = self._registered_sockets.get(index)
+
+            if registered is not None and registered is not sock:
+                self._unregister(index)
+                registered = None
+
+            if sock is not None and registered is None:
+                try:
+                    self._selector.register(sock, selectors.EVENT_READ, data=index)
+                    self._registered_sockets[index] = sock
+                except (ValueError, OSError) as e:
+                    _logger.warning('Failed to watch socket of [%s]: [%s]', thermostat.name, e)
+
+    def _unregister(self, index: int):
+        sock = self._registered_sockets.pop(index, None)
+        if sock is None:
+            return
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError, OSError):
+            pass
+
+    @staticmethod
+    def _guarded(thermostat: MoesBhtThermostat, action) -> Optional[object]:
+        # one misbehaving device must not take the whole monitor down
+        try:
+            return action()
+        except Exception as e:
+            _logger.error('Exception [%s] while monitoring: [%s]', thermostat.name, e)
+            if _logger.isEnabledFor(logging.ERROR):
+                traceback.print_exc()
+        return None
+
+##########################################################################################################
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+from typing import Callable, Deque
+import logging
+
+import collections
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+##########################################################################################################
+
+# Interval between two full status requests of one device (the BHT-002 does not push the eco mode changes, a full
+# status is the only way to see them):
+#  * a command, or a change of a settable field (pushed by the device: someone at the thermostat, or found by a full
+#    status), drops the interval to min_seconds for active_seconds: the related changes that are not pushed are seen
+#    quickly; the measured fields (home temperature) change on their own, they only count in the change rate
+#  * past that, every full status request stretches the interval (x growth_factor)
+#  * the interval stays within [min_seconds, max_seconds] => the eco mode detection latency is at most max_seconds
+# A stable fleet is polled every max_seconds instead of every minute. The interval and the rate of the state
+# changes (over the last hour) are exported per device.
+
+STATUS_MIN_SECONDS = 15
+STATUS_MAX_SECONDS = 5 * 60
+STATUS_GROWTH_FACTOR = 1.5
+# the interval stays at min_seconds for this long after a command / a state change
+STATUS_ACTIVE_SECONDS = 2 * 60
+
+CHANGE_RATE_WINDOW_SECONDS = 60 * 60
+
+##########################################################################################################
+
+class AdaptiveStatusInterval(object):
+    """The delay before the next full status request of one device, adapted to its change rate."""
+
+    def __init__(self, name: str, initial_seconds: float = 60,
+                 min_seconds: float = STATUS_MIN_SECONDS, max_seconds: float = STATUS_MAX_SECONDS,
+                 growth_factor: float = STATUS_GROWTH_FACTOR, active_seconds: float = STATUS_ACTIVE_SECONDS,
+                 time_func: Callable[[], float] = time.time):
+        if min_seconds <= 0 or max_seconds < min_seconds:
+            raise ValueError(f'Invalid status interval bounds [{min_seconds}, {max_seconds}] for [{name}]')
+
+        self.name = name
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.growth_factor = growth_factor
+        self.active_seconds = active_seconds
+        self.time_func = time_func
+
+        self.seconds = self._clamp(initial_seconds)
+        # the interval is min_seconds until then (after a command / a state change)
+        self.active_until: float | None = None
+        self.status_requests = 0
+
+        self._change_times: Deque[float] = collections.deque()
+        # the change rate is read by the metrics thread
+        self._change_lock = threading.Lock()
+
+    def on_status_request(self, now: float | None = None) -> float:
+        """A full status is requested: returns the delay until the next one (stretched when the device is idle)."""
+        now = now if now is not None else self.time_func()
+        self.status_requests += 1
+
+        if self.active_until is not None and now < self.active_until:
+            self.seconds = self.min_seconds
+        else:
+            self.seconds = self._clamp(self.seconds * self.growth_factor)
+
+        _logger.debug('Next full status of [%s] in [%s] seconds', self.name, self.seconds)
+        return self.seconds
+
+    def on_interaction(self, now: float | None = None) -> float:
+        """A command was sent to the device: poll at min_seconds for active_seconds. Returns the new interval."""
+        now = now if now is not None else self.time_func()
+        self.active_until = now + self.active_seconds
+        self.seconds = self.min_seconds
+        return self.seconds
+
+    def on_state_change(self, now: float | None = None, is_interaction: bool = True) -> float:
+        """The state of the device changed (pushed by the device or found by a full status). A change of a settable
+        field (is_interaction) is someone using the thermostat, same as a command; a measured value only counts in the
+        change rate. Returns the new interval."""
+        now = now if now is not None else self.time_func()
+        with self._change_lock:
+            self._change_times.append(now)
+            self._prune(now)
+        return self.on_interaction(now) if is_interaction else self.seconds
+
+    def changes_per_hour(self, now: float | None = None) -> float:
+        now = now if now is not None else self.time_func()
+        with self._change_lock:
+            self._prune(now)
+            return float(len(self._change_times)) * 3600 / CHANGE_RATE_WINDOW_SECONDS
+
+    def _prune(self, now: float) -> None:
+        # the caller holds the change lock
+        while self._change_times and self._change_times[0] < now - CHANGE_RATE_WINDOW_SECONDS:
+            self._change_times.popleft()
+
+    def _clamp(self, seconds: float) -> float:
+        return min(max(seconds, self.min_seconds), self.max_seconds)
+
+##########################################################################################################
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+from typing import Any, Dict, List, Optional
+import logging
+
+from tinytuya.core import command_types as CT
+from tinytuya.core import header as H
+from tinytuya.core.exceptions import DecodeError
+from tinytuya.core.message_helper import TuyaMessage, parse_header, unpack_message
+from tinytuya.core.XenonDevice import XenonDevice
+
+_logger = logging.getLogger(__name__)
+
+##########################################################################################################
+
+# Tuya local protocol (3.3) framing, used by the non-blocking (asyncio) engine.
+#
+# frame = prefix(0x000055AA) | seqno | cmd | length | [retcode] | payload | crc32 | suffix(0x0000AA55)
+# payload = AES-ECB(local_key) encrypted json, with a "3.3" + 12 * 0x00 header for most commands
+#
+# The encryption / json envelope is delegated to the tinytuya device object (same code path as the blocking
+# client), only the stream handling (buffering / resync / frame splitting) is done here.
+
+HEART_BEAT = CT.HEART_BEAT
+DP_QUERY = CT.DP_QUERY
+CONTROL = CT.CONTROL
+STATUS = CT.STATUS
+
+# tcp port of the local protocol
+TUYA_PORT = 6668
+
+# header + crc + suffix (+ retcode on device => client frames)
+MIN_FRAME_LENGTH = 16 + 4 + 4
+
+# a frame longer than this means the stream is corrupt / out of sync
+MAX_BUFFER_LENGTH = 64 * 1024
+
+##########################################################################################################
+
+class TuyaFrameReader(object):
+    """Splits a tcp byte stream into tuya (55AA) messages."""
+
+    def __init__(self, no_retcode: bool = False):
+        # device => client frames carry a return code, client => device frames (no_retcode=True) do not
+        self.no_retcode = no_retcode
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> List[TuyaMessage]:
+        self._buffer += data
+
+        messages = []
+        while True:
+            message = self._next_message()
+            if message is None:
+                break
+            messages.append(message)
+
+        if len(self._buffer) > MAX_BUFFER_LENGTH:
+            _logger.warning('Dropping [%s] unframed bytes', len(self._buffer))
+            self._buffer.clear()
+
+        return messages
+
+    def reset(self):
+        self._buffer.clear()
+
+    def _next_message(self) -> Optional[TuyaMessage]:
+        prefix_offset = self._buffer.find(H.PREFIX_55AA_BIN)
+        if prefix_offset < 0:
+            # keep a possible partial prefix
+            del self._buffer[:max(0, len(self._buffer) - (len(H.PREFIX_55AA_BIN) - 1))]
+            return None
+        if prefix_offset > 0:
+            _logger.debug('Skipping [%s] bytes before the message prefix', prefix_offset)
+            del self._buffer[:prefix_offset]
+
+        if len(self._buffer) < MIN_FRAME_LENGTH:
+            return None
+
+        try:
+            header = parse_header(bytes(self._buffer[:16]))
+        except DecodeError as e:
+            _logger.warning('Invalid frame header, resyncing: [%s]', e)
+            del self._buffer[:len(H.PREFIX_55AA_BIN)]
+            return self._next_message()
+
+        if len(self._buffer) < header.total_length:
+            return None
+
+        frame = bytes(self._buffer[:header.total_length])
+        del self._buffer[:header.total_length]
+
+        try:
+            message = unpack_message(frame, header=header, no_retcode=self.no_retcode)
+        except DecodeError as e:
+            _logger.warning('Invalid frame, dropped: [%s]', e)
+            return self._next_message()
+
+        if not message.crc_good:
+            _logger.warning('Frame with bad crc dropped: seqno=[%s] cmd=[%s]', message.seqno, message.cmd)
+            return self._next_message()
+
+        return message
+
+##########################################################################################################
+
+def encode_request(device: XenonDevice, command: int, data: Dict[str, Any] | None = None) -> bytes:
+    """Build the encrypted frame for `command` (same envelope / seqno as the blocking tinytuya client)."""
+    return device._encode_message(device.generate_payload(command, data))
+
+
+def decode_message(device: XenonDevice, message: TuyaMessage) -> Dict[str, Any] | None:
+    """Decrypt the payload of a received frame into the tinytuya response dict (None for empty acks)."""
+    if message is None or len(message.payload) == 0:
+        return None
+
+    result = device._decode_payload(message.payload)
+    if result is None:
+        return None
+
+    return device._process_response(result)
+
+##########################################################################################################
@@ -29,12 +29,24 @@ def main():
         tuya_dev_id=get_env_variable('BRIDGE_TUYA_DEV_ID', var_type=str),
         tuya_dev_ip=get_env_variable('BRIDGE_TUYA_DEV_IP', var_type=str),
         tuya_dev_local_key=get_env_variable('BRIDGE_TUYA_DEV_LOCAL_KEY', var_type=str),
+        # thermostat model (dps layout): BHT-002 (default) / BHT-6000 / ...
+        tuya_dev_model=get_env_variable('BRIDGE_TUYA_DEV_MODEL', var_type=str),
         mqtt_broker_addr=get_env_variable('BRIDGE_MQTT_BROKER_ADDR', var_type=str),
         mqtt_broker_port=get_env_variable('BRIDGE_MQTT_BROKER_PORT', default=8883, var_type=int),
         mqtt_user=get_env_variable('BRIDGE_MQTT_USER', var_type=str),
         mqtt_password=get_env_variable('BRIDGE_MQTT_PASSWORD', var_type=str),
         mqtt_tls_path=get_env_variable('BRIDGE_MQTT_TLS_PATH', var_type=str),
+        # serve the mqtt broker from the bridge process (listening on BRIDGE_MQTT_BROKER_ADDR / PORT, no TLS)
+        mqtt_embedded_broker=get_env_variable('BRIDGE_MQTT_EMBEDDED_BROKER', default=False, var_type=bool),
         static_data=get_env_variable('BRIDGE_STATIC_DATA', default=False, var_type=bool),
+        # multi-device mode: json inventory of the devices (replaces the BRIDGE_TUYA_DEV_* single device)
+        devices_file=get_env_variable('BRIDGE_DEVICES_FILE', var_type=str),
+        # device I/O engine: selector (default) / asyncio
+        tuya_engine=get_env_variable('BRIDGE_TUYA_ENGINE', var_type=str),
+        # state publish mode: state (default, full json on STATE) / fields (changed fields on STATE/<field>)
+        publish_mode=get_env_variable('BRIDGE_PUBLISH_MODE', var_type=str),
+        # directory of the recorded state changes (history_path of the config when not set)
+        history_path=get_env_variable('BRIDGE_HISTORY_PATH', var_type=str),
     )
 
     args.app_name = os.path.splitext(os.path.basename(__file__))[0]
@@ -20,15 +20,18 @@ def main():
         '--target_env', metavar='target_env', type=str,
         help='target environment (TEST/PROD)')
 
-    parser.add_argument('--tuya_dev_id', type=str, required=True,
+    parser.add_argument('--tuya_dev_id', type=str, required=False,
                         help='Tuya: device id')
 
-    parser.add_argument('--tuya_dev_ip', type=str, required=True,
+    parser.add_argument('--tuya_dev_ip', type=str, required=False,
                         help='Tuya: device ip address')
 
-    parser.add_argument('--tuya_dev_local_key', type=str, required=True,
+    parser.add_argument('--tuya_dev_local_key', type=str, required=False,
                         help='Tuya: device local key')
 
+    parser.add_argument('--tuya_dev_model', type=str, required=False,
+                        help='Tuya: thermostat model, the dps layout of the device (default BHT-002)')
+
     parser.add_argument('--mqtt_broker_addr', type=str, required=True,
                         help='Mqtt: server address')
 
@@ -43,11 +46,29 @@ def main():
     parser.add_argument('--mqtt_tls_path', type=str, required=False,
                         help='Mqtt: Path to the tls certificate used by the server')
 
+    parser.add_argument('--mqtt_embedded_broker', action='store_true',
+                        help='Mqtt: serve the broker from the bridge process (listening on --mqtt_broker_addr / port, no TLS)')
+
     parser.add_argument("--static_data", nargs='?', type=bool,
                         const=True, default=False)
 
+    parser.add_argument('--devices_file', type=str, required=False,
+                        help='Tuya: json inventory of the devices to bridge (multi-device mode, replaces --tuya_dev_*)')
+
+    parser.add_argument('--tuya_engine', type=str, required=False, choices=['selector', 'asyncio'],
+                        help='Tuya: device I/O engine (selector = blocking tinytuya calls, asyncio = non-blocking sockets)')
+
+    parser.add_argument('--publish_mode', type=str, required=False, choices=['state', 'fields'],
+                        help='Mqtt: what a state change publishes (state = full json on STATE, fields = changed fields on STATE/<field>)')
+
+    parser.add_argument('--history_path', type=str, required=False,
+                        help='Bridge: directory where the state changes are recorded, queried on HISTORY and http /history')
+
     args = parser.parse_args()
 
+    if not args.devices_file and not (args.tuya_dev_id and args.tuya_dev_ip and args.tuya_dev_local_key):
+        parser.error('either --devices_file or all of --tuya_dev_id / --tuya_dev_ip / --tuya_dev_local_key are required')
+
     args.app_name = os.path.splitext(os.path.basename(__file__))[0]
     args.tuya_dev_name="BHT-002-GALW"
     args.mqtt_broker_name="MQTT"
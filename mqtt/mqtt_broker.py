@@ -0,0 +1,539 @@
+#!/usr/bin/env python
+from typing import Dict, List, Optional, Tuple
+import logging
+from dataclasses import dataclass, field
+
+import asyncio
+import itertools
+import struct
+import threading
+
+from generic.metrics import METRICS
+
+_logger = logging.getLogger(__name__)
+
+##########################################################################################################
+
+# Minimal embedded MQTT 3.1.1 broker (asyncio, on its own thread), for a self-contained bridge on a small edge box
+# where the bridge is the only producer (BRIDGE_MQTT_EMBEDDED_BROKER), and as the deterministic broker of the tests
+# and benchmarks:
+#  * CONNECT: username / password checked when the broker has some; the will message is published when a client
+#    disappears without a DISCONNECT (or is silent for 1.5 x its keep alive)
+#  * PUBLISH QoS 0 / 1 (PUBACK) / 2 (PUBREC / PUBREL / PUBCOMP, the message is kept by packet id and routed on PUBREL:
+#    a retransmitted PUBLISH is delivered once), delivered with min(QoS of the publish, QoS of the subscription); the
+#    subscriptions are granted at most QoS 1
+#  * SUBSCRIBE / UNSUBSCRIBE with the + and # wildcards (a topic starting with $ is not matched by a leading wildcard)
+#  * retained messages (an empty retained payload removes the topic), sent on SUBSCRIBE
+#  * one event loop: the messages of a publisher reach every subscriber in publish order
+# Not supported: MQTT 5, TLS / websockets, persistent sessions (every session is a clean one, nothing is queued for
+# an offline client), retries of unacknowledged outbound QoS 1 messages.
+# A subscriber not reading its socket (more than max_buffer_bytes waiting) loses the messages, not the broker.
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+CONNACK_ACCEPTED = 0
+CONNACK_BAD_PROTOCOL_VERSION = 1
+CONNACK_IDENTIFIER_REJECTED = 2
+CONNACK_BAD_CREDENTIALS = 4
+
+SUBACK_FAILURE = 0x80
+MAX_GRANTED_QOS = 1
+
+MQTT_PORT = 1883
+CONNECT_TIMEOUT_SECONDS = 10.0
+MAX_PACKET_BYTES = 256 * 1024
+MAX_BUFFER_BYTES = 1024 * 1024
+
+BROKER_CLIENTS = METRICS.callback('mqtt_broker_clients', 'Clients connected to the embedded broker', 'gauge', ('broker',))
+BROKER_MESSAGES = METRICS.callback('mqtt_broker_messages_total', 'Messages through the embedded broker, per direction', 'counter', ('broker', 'direction'))
+
+##########################################################################################################
+
+class MqttProtocolError(Exception):
+    pass
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """Does topic match the subscription topic_filter (+ = one level, # = this level and the ones below)."""
+    if topic.startswith('$') and topic_filter[:1] in ('+', '#'):
+        return False
+
+    topic_levels = topic.split('/')
+    filter_levels = topic_filter.split('/')
+    for i, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if i >= len(topic_levels) or (level != '+' and level != topic_levels[i]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def is_valid_filter(topic_filter: str) -> bool:
+    levels = topic_filter.split('/')
+    for i, level in enumerate(levels):
+        if '#' in level and (level != '#' or i != len(levels) - 1):
+            return False
+        if '+' in level and level != '+':
+            return False
+    return bool(topic_filter)
+
+
+def is_wildcard(topic_filter: str) -> bool:
+    return '+' in topic_filter or '#' in topic_filter
+
+# packets ################################################################################
+
+def encode_packet(packet_type: int, flags: int, body: bytes) -> bytes:
+    header = bytearray([(packet_type << 4) | flags])
+    length = len(body)
+    while True:
+        length, digit = divmod(length, 128)
+        header.append(digit | (0x80 if length else 0))
+        if not length:
+            return bytes(header) + body
+
+
+def encode_string(value: str | bytes) -> bytes:
+    data = value.encode('utf-8') if isinstance(value, str) else value
+    return struct.pack('!H', len(data)) + data
+
+
+def encode_publish(topic: str, payload: bytes, qos: int = 0, retain: bool = False, packet_id: int = 0) -> bytes:
+    body = encode_string(topic) + (struct.pack('!H', packet_id) if qos else b'') + payload
+    return encode_packet(PUBLISH, (qos << 1) | (1 if retain else 0), body)
+
+
+class _PacketReader(object):
+    """Reads the fields of a packet body."""
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.offset = 0
+
+    def uint8(self) -> int:
+        self._check(1)
+        self.offset += 1
+        return self.body[self.offset - 1]
+
+    def uint16(self) -> int:
+        self._check(2)
+        self.offset += 2
+        return struct.unpack_from('!H', self.body, self.offset - 2)[0]
+
+    def binary(self) -> bytes:
+        length = self.uint16()
+        self._check(length)
+        self.offset += length
+        return self.body[self.offset - length:self.offset]
+
+    def string(self) -> str:
+        try:
+            return self.binary().decode('utf-8')
+        except UnicodeDecodeError:
+            raise MqttProtocolError('invalid utf-8 string')
+
+    def rest(self) -> bytes:
+        data = self.body[self.offset:]
+        self.offset = len(self.body)
+        return data
+
+    @property
+    def remaining(self) -> int:
+        return len(self.body) - self.offset
+
+    def _check(self, size: int) -> None:
+        if self.offset + size > len(self.body):
+            raise MqttProtocolError('truncated packet')
+
+
+async def read_packet(reader: asyncio.StreamReader, max_packet_bytes: int = MAX_PACKET_BYTES) -> Tuple[int, int, bytes]:
+    """(packet type, flags, body) of the next packet."""
+    first_byte = (await reader.readexactly(1))[0]
+    length, multiplier = 0, 1
+    for _ in range(4):
+        digit = (await reader.readexactly(1))[0]
+        length += (digit & 0x7F) * multiplier
+        if not digit & 0x80:
+            break
+        multiplier *= 128
+    else:
+        raise MqttProtocolError('invalid remaining length')
+
+    if length > max_packet_bytes:
+        raise MqttProtocolError(f'packet of [{length}] bytes')
+    body = await reader.readexactly(length) if length else b''
+    return first_byte >> 4, first_byte & 0x0F, body
+
+##########################################################################################################
+
+@dataclass
+class BrokerStats(object):
+    connections: int = 0
+    refused_connections: int = 0
+    # PUBLISH received from the clients / sent to the subscribers
+    messages_in: int = 0
+    messages_out: int = 0
+    # not sent to a slow subscriber
+    dropped: int = 0
+    wills: int = 0
+
+
+@dataclass
+class _Will(object):
+    topic: str
+    payload: bytes
+    qos: int
+    retain: bool
+
+
+@dataclass
+class _Session(object):
+    client_id: str
+    writer: asyncio.StreamWriter
+    keep_alive_seconds: int = 0
+    will: Optional[_Will] = None
+    # topic filter => granted qos
+    subscriptions: Dict[str, int] = field(default_factory=dict)
+    packet_ids: itertools.count = field(default_factory=lambda: itertools.count(1))
+    # inbound QoS 2 messages waiting for their PUBREL: packet id => (topic, payload, retain)
+    released: Dict[int, Tuple[str, bytes, bool]] = field(default_factory=dict)
+
+    def next_packet_id(self) -> int:
+        return next(self.packet_ids) % 0xFFFF + 1
+
+##########################################################################################################
+
+class EmbeddedMqttBroker(object):
+    """An in-process MQTT 3.1.1 broker, served by one asyncio event loop (own thread, or the caller's)."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = MQTT_PORT, username: str | None = None,
+                 password: str | None = None, name: str = 'embedded', max_buffer_bytes: int = MAX_BUFFER_BYTES):
+        self.host = host
+        # 0 = given by the os (known once started)
+        self.port = port
+        self.username = username or None
+        self.password = password or None
+        self.name = name
+        self.max_buffer_bytes = max_buffer_bytes
+
+        self.stats = BrokerStats()
+        # topic => (payload, qos)
+        self.retained: Dict[str, Tuple[bytes, int]] = {}
+
+        # client id => session
+        self._sessions: Dict[str, _Session] = {}
+        # topic filter => {client id => granted qos}, the exact topics looked up directly, the wildcards scanned
+        self._exact_subscriptions: Dict[str, Dict[str, int]] = {}
+        self._wildcard_subscriptions: Dict[str, Dict[str, int]] = {}
+        self._generated_ids = itertools.count(1)
+
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: List[asyncio.Task] = []
+        self._thread: threading.Thread | None = None
+        self._started = threading.Event()
+        self._stopped: asyncio.Event | None = None
+        self._error: BaseException | None = None
+
+        BROKER_CLIENTS.set_callback(lambda: len(self._sessions), name)
+        BROKER_MESSAGES.set_callback(lambda: self.stats.messages_in, name, 'in')
+        BROKER_MESSAGES.set_callback(lambda: self.stats.messages_out, name, 'out')
+
+    @property
+    def clients(self) -> List[str]:
+        return sorted(self._sessions)
+
+    @property
+    def topic_filters(self) -> List[str]:
+        """The subscribed topic filters (of all the clients)."""
+        return sorted([*self._exact_subscriptions, *self._wildcard_subscriptions])
+
+    # lifecycle ###########################################################################
+
+    def run(self, duration_seconds: float | None = None) -> None:
+        """Serve on the calling thread, until stop() (or for duration_seconds)."""
+        asyncio.run(self._run(duration_seconds))
+
+    def start(self, timeout: float = 10) -> "EmbeddedMqttBroker":
+        """Serve from a dedicated (daemon) thread, once listening."""
+        self._thread = threading.Thread(target=self.run, name='mqtt-broker', daemon=True)
+        self._thread.start()
+        if not self._started.wait(timeout):
+            raise TimeoutError('Mqtt broker did not start')
+        if self._error is not None:
+            raise self._error
+        return self
+
+    def stop(self, timeout: float = 10) -> None:
+        if self.loop is not None and self._stopped is not None and not self.loop.is_closed():
+            try:
+                self.loop.call_soon_threadsafe(self._stopped.set)
+            except RuntimeError:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def publish(self, topic: str, payload: str | bytes, qos: int = 0, retain: bool = False) -> None:
+        """Thread-safe: publish from the broker itself (as a client would)."""
+        if self.loop is None or self.loop.is_closed():
+            raise RuntimeError(f'Mqtt broker [{self.name}] is not started')
+        data = payload.encode('utf-8') if isinstance(payload, str) else payload
+        self.loop.call_soon_threadsafe(self._route, topic, data, qos, retain)
+
+    async def _run(self, duration_seconds: float | None) -> None:
+        self.loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        try:
+            self._server = await asyncio.start_server(self._on_connection, self.host, self.port)
+        except BaseException as e:
+            self._error = e
+            self._started.set()
+            raise
+        self.port = self._server.sockets[0].getsockname()[1]
+
+        _logger.info('Mqtt broker [%s] listening on [%s:%s]', self.name, self.host, self.port)
+        self._started.set()
+        try:
+            await asyncio.wait_for(self._stopped.wait(), timeout=duration_seconds)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._server.close()
+            for task in self._connections:
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+            _logger.info('Mqtt broker [%s] stopped: [%s]', self.name, self.stats)
+
+    # connections #########################################################################
+
+    async def _on_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._connections.append(task)
+        session = None
+        try:
+            session = await self._connect(reader, writer)
+            if session is not None:
+                await self._serve(session, reader)
+                # DISCONNECT: the will is discarded
+                session.will = None
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, OSError):
+            pass
+        except MqttProtocolError as e:
+            _logger.warning('Mqtt broker [%s] closing [%s]: [%s]', self.name, session.client_id if session else '?', e)
+        finally:
+            if session is not None:
+                self._disconnect(session)
+            writer.close()
+            self._connections.remove(task)
+
+    async def _connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> Optional[_Session]:
+        packet_type, flags, body = await asyncio.wait_for(read_packet(reader), timeout=CONNECT_TIMEOUT_SECONDS)
+        if packet_type != CONNECT:
+            raise MqttProtocolError(f'expected CONNECT, got [{packet_type}]')
+
+        packet = _PacketReader(body)
+        protocol_name, protocol_level = packet.string(), packet.uint8()
+        connect_flags, keep_alive = packet.uint8(), packet.uint16()
+        if (protocol_name, protocol_level) not in (('MQTT', 4), ('MQIsdp', 3)):
+            return self._refuse(writer, CONNACK_BAD_PROTOCOL_VERSION)
+
+        client_id = packet.string()
+        will = None
+        if connect_flags & 0x04:
+            will = _Will(topic=packet.string(), payload=packet.binary(), qos=min((connect_flags >> 3) & 0x03, MAX_GRANTED_QOS),
+                         retain=bool(connect_flags & 0x20))
+        username = packet.string() if connect_flags & 0x80 else None
+        password = packet.binary().decode('utf-8', errors='replace') if connect_flags & 0x40 else None
+
+        if not client_id:
+            if not connect_flags & 0x02:
+                # an empty client id needs a clean session
+                return self._refuse(writer, CONNACK_IDENTIFIER_REJECTED)
+            client_id = f'{self.name}-{next(self._generated_ids)}'
+        if self.username is not None and (username != self.username or password != self.password):
+            return self._refuse(writer, CONNACK_BAD_CREDENTIALS)
+
+        previous = self._sessions.get(client_id)
+        if previous is not None:
+            # the new connection of a client id takes over
+            _logger.info('Mqtt broker [%s] client [%s] reconnected, closing its previous connection', self.name, client_id)
+            self._disconnect(previous)
+            previous.writer.close()
+
+        session = _Session(client_id=client_id, writer=writer, keep_alive_seconds=keep_alive, will=will)
+        self._sessions[client_id] = session
+        self.stats.connections += 1
+        writer.write(encode_packet(CONNACK, 0, bytes([0, CONNACK_ACCEPTED])))
+        _logger.debug('Mqtt broker [%s] client [%s] connected | keep alive [%s]', self.name, client_id, keep_alive)
+        return session
+
+    def _refuse(self, writer: asyncio.StreamWriter, return_code: int) -> None:
+        self.stats.refused_connections += 1
+        writer.write(encode_packet(CONNACK, 0, bytes([0, return_code])))
+        _logger.warning('Mqtt broker [%s] refused a connection | return code [%s]', self.name, return_code)
+        return None
+
+    def _disconnect(self, session: _Session) -> None:
+        if self._sessions.get(session.client_id) is not session:
+            # already replaced by a new connection of the client id
+            return
+        del self._sessions[session.client_id]
+        for topic_filter in list(session.subscriptions):
+            self._unsubscribe(session, topic_filter)
+
+        if session.will is not None:
+            _logger.info('Mqtt broker [%s] client [%s] lost, publishing its will on [%s]', self.name, session.client_id, session.will.topic)
+            self.stats.wills += 1
+            self._route(session.will.topic, session.will.payload, session.will.qos, session.will.retain)
+            session.will = None
+
+    async def _serve(self, session: _Session, reader: asyncio.StreamReader) -> None:
+        timeout = session.keep_alive_seconds * 1.5 if session.keep_alive_seconds else None
+        # on python < 3.12, wait_for may swallow the cancellation (stop) of a read completing at the same time
+        while not self._stopped.is_set():
+            packet_type, flags, body = await asyncio.wait_for(read_packet(reader), timeout=timeout)
+
+            if packet_type == PUBLISH:
+                self._on_publish(session, flags, body)
+            elif packet_type == SUBSCRIBE:
+                self._on_subscribe(session, body)
+            elif packet_type == UNSUBSCRIBE:
+                self._on_unsubscribe(session, body)
+            elif packet_type == PINGREQ:
+                session.writer.write(encode_packet(PINGRESP, 0, b''))
+            elif packet_type == PUBREL:
+                self._on_publish_release(session, body)
+            elif packet_type == PUBACK:
+                # acknowledgement of an outbound QoS 1 message (not retried)
+                pass
+            elif packet_type == DISCONNECT:
+                return
+            else:
+                raise MqttProtocolError(f'unexpected packet [{packet_type}]')
+
+    # messages ############################################################################
+
+    def _on_publish(self, session: _Session, flags: int, body: bytes) -> None:
+        qos, retain = (flags >> 1) & 0x03, bool(flags & 0x01)
+        if qos > 2:
+            raise MqttProtocolError('invalid QoS 3')
+
+        packet = _PacketReader(body)
+        topic = packet.string()
+        if not topic or is_wildcard(topic):
+            raise MqttProtocolError(f'invalid publish topic [{topic}]')
+        packet_id = packet.uint16() if qos else 0
+        payload = packet.rest()
+
+        if qos == 2:
+            # routed on PUBREL; a retransmission (DUP) replaces the message not released yet
+            if packet_id not in session.released:
+                self.stats.messages_in += 1
+            session.released[packet_id] = (topic, payload, retain)
+            session.writer.write(encode_packet(PUBREC, 0, struct.pack('!H', packet_id)))
+            return
+
+        self.stats.messages_in += 1
+        if qos == 1:
+            session.writer.write(encode_packet(PUBACK, 0, struct.pack('!H', packet_id)))
+        self._route(topic, payload, min(qos, MAX_GRANTED_QOS), retain)
+
+    def _on_publish_release(self, session: _Session, body: bytes) -> None:
+        packet_id = _PacketReader(body).uint16()
+        # not known = a retransmitted PUBREL, already routed
+        released = session.released.pop(packet_id, None)
+        session.writer.write(encode_packet(PUBCOMP, 0, struct.pack('!H', packet_id)))
+        if released is not None:
+            topic, payload, retain = released
+            self._route(topic, payload, MAX_GRANTED_QOS, retain)
+
+    def _route(self, topic: str, payload: bytes, qos: int, retain: bool) -> None:
+        if retain:
+            if payload:
+                self.retained[topic] = (payload, qos)
+            else:
+                self.retained.pop(topic, None)
+
+        # client id => the highest granted qos of its matching subscriptions (one copy per client)
+        targets: Dict[str, int] = dict(self._exact_subscriptions.get(topic, {}))
+        for topic_filter, subscribers in self._wildcard_subscriptions.items():
+            if topic_matches(topic_filter, topic):
+                for client_id, granted_qos in subscribers.items():
+                    targets[client_id] = max(granted_qos, targets.get(client_id, 0))
+
+        for client_id, granted_qos in targets.items():
+            session = self._sessions.get(client_id)
+            if session is not None:
+                # retain is only set on the messages sent on SUBSCRIBE
+                self._send(session, topic, payload, min(qos, granted_qos), False)
+
+    def _send(self, session: _Session, topic: str, payload: bytes, qos: int, retain: bool) -> None:
+        if session.writer.is_closing():
+            return
+        if session.writer.transport.get_write_buffer_size() > self.max_buffer_bytes:
+            self.stats.dropped += 1
+            return
+        session.writer.write(encode_publish(topic, payload, qos, retain, session.next_packet_id() if qos else 0))
+        self.stats.messages_out += 1
+
+    # subscriptions #######################################################################
+
+    def _on_subscribe(self, session: _Session, body: bytes) -> None:
+        packet = _PacketReader(body)
+        packet_id = packet.uint16()
+        requests = []
+        while packet.remaining:
+            requests.append((packet.string(), packet.uint8()))
+        if not requests:
+            raise MqttProtocolError('SUBSCRIBE without topic filter')
+
+        return_codes = []
+        granted = []
+        for topic_filter, requested_qos in requests:
+            if not is_valid_filter(topic_filter) or requested_qos > 2:
+                return_codes.append(SUBACK_FAILURE)
+                continue
+            granted_qos = min(requested_qos, MAX_GRANTED_QOS)
+            session.subscriptions[topic_filter] = granted_qos
+            subscriptions = self._wildcard_subscriptions if is_wildcard(topic_filter) else self._exact_subscriptions
+            subscriptions.setdefault(topic_filter, {})[session.client_id] = granted_qos
+            return_codes.append(granted_qos)
+            granted.append((topic_filter, granted_qos))
+        session.writer.write(encode_packet(SUBACK, 0, struct.pack('!H', packet_id) + bytes(return_codes)))
+
+        for topic_filter, granted_qos in granted:
+            for topic, (payload, qos) in list(self.retained.items()):
+                if topic_matches(topic_filter, topic):
+                    self._send(session, topic, payload, min(qos, granted_qos), True)
+
+    def _on_unsubscribe(self, session: _Session, body: bytes) -> None:
+        packet = _PacketReader(body)
+        packet_id = packet.uint16()
+        while packet.remaining:
+            self._unsubscribe(session, packet.string())
+        session.writer.write(encode_packet(UNSUBACK, 0, struct.pack('!H', packet_id)))
+
+    def _unsubscribe(self, session: _Session, topic_filter: str) -> None:
+        session.subscriptions.pop(topic_filter, None)
+        subscriptions = self._wildcard_subscriptions if is_wildcard(topic_filter) else self._exact_subscriptions
+        subscribers = subscriptions.get(topic_filter)
+        if subscribers is not None:
+            subscribers.pop(session.client_id, None)
+            if not subscribers:
+                del subscriptions[topic_filter]
+
+##########################################################################################################
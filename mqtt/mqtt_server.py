@@ -1,18 +1,23 @@
 #!/usr/bin/env python
-from typing import Any, Final, Optional, Dict
+from typing import Any, Final, Optional, Dict, List, Set
 import logging
 from dataclasses import dataclass
 
-import json
 import threading
+import time
 import traceback
 
 from paho.mqtt.enums import MQTTErrorCode
 import paho.mqtt.client as mqtt
 
 from bridge import MqttCallbackOnMessage
+from generic import serializers
+from generic.metrics import METRICS
+from mqtt.publish_queue import PublishQueue
 
 
+_logger = logging.getLogger(__name__)
+
 ##########################################################################################################
 
 # MQTT broker details
@@ -28,6 +33,28 @@ from bridge import MqttCallbackOnMessage
 # LWT       = Online / Offline
 # STATE     = json with the entire state
 # COMMAND   = json with commands for the device
+# RESULT    = json with the outcome of a command
+# GET       = request of the current state (json {"fields": [...], "max_age": <seconds>, "id": ...} or empty),
+#             answered on GET/RESPONSE
+# HISTORY   = query of the recorded states (json {"from": .., "to": .., "step": .., "fields": [...], "id": ...}),
+#             answered on HISTORY/RESPONSE
+
+TOPIC_LWT = 'LWT'
+TOPIC_STATE = 'STATE'
+TOPIC_COMMAND = 'COMMAND'
+TOPIC_RESULT = 'RESULT'
+TOPIC_GET = 'GET'
+TOPIC_GET_RESPONSE = 'GET/RESPONSE'
+TOPIC_HISTORY = 'HISTORY'
+TOPIC_HISTORY_RESPONSE = 'HISTORY/RESPONSE'
+
+LWT_ONLINE = 'Online'
+LWT_OFFLINE = 'Offline'
+
+PUBLISH_SECONDS = METRICS.histogram('mqtt_publish_seconds', 'Duration of the mqtt client publish calls', ('client',))
+PUBLISH_QUEUE_DEPTH = METRICS.callback('mqtt_publish_queue_depth', 'Messages waiting in the publish queue', 'gauge', ('client',))
+PUBLISH_QUEUE_MESSAGES = METRICS.callback('mqtt_publish_queue_messages_total', 'Messages through the publish queue, per outcome', 'counter', ('client', 'outcome'))
+UNROUTED_MESSAGES = METRICS.callback('mqtt_unrouted_messages_total', 'Messages received on a topic without listener (dropped)', 'counter', ('client',))
 
 ##########################################################################################################
 
@@ -43,10 +70,13 @@ class MqttClient(object):
     topic_root: Final[str]
 
     def __init__(self, name:str, broker_address:str, broker_port: int, username: str, password: str, tls_cert_path:str|None, topic_root: str = 'home/tuya2mqtt_bridge',
-                 client: mqtt.Client | None = None):
+                 client: mqtt.Client | None = None, publish_queue: PublishQueue | None = None,
+                 wildcard_subscriptions: bool = True):
         self.name = name
 
+        # set by the paho callbacks once the network loop runs (the loop reconnects by itself)
         self.is_connected = False
+        self._is_loop_started = False
 
         self.broker_address = broker_address
         self.broker_port = broker_port
@@ -57,16 +87,38 @@ class MqttClient(object):
 
         # Attach callbacks
         self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
         self.client.on_message = self._on_message
 
         self.topic_root = topic_root
 
+        # None = publish inline, on the caller thread
+        self.publish_queue = publish_queue
+
+        self._publish_seconds = PUBLISH_SECONDS.labels(name)
+        if publish_queue is not None:
+            PUBLISH_QUEUE_DEPTH.set_callback(lambda: len(publish_queue), name)
+            for outcome in ('enqueued', 'published', 'coalesced', 'dropped', 'failed'):
+                PUBLISH_QUEUE_MESSAGES.set_callback(lambda outcome=outcome: getattr(publish_queue.stats, outcome), name, outcome)
+
         self._callback_mutex = threading.RLock()
         self._in_callback_mutex = threading.Lock()
         self._on_callback: MqttCallbackOnMessage | None = None
+        # the routing index: extra listen topics (one per device in multi-device mode) => callback, one dict lookup
+        # per received message
+        self._topic_callbacks: Dict[str, MqttCallbackOnMessage] = {}
+        # the subscribed topic filters: with wildcard_subscriptions, the listen topics of the devices under topic_root
+        # share one subscription (<topic_root>/+/COMMAND), instead of one per device
+        self.wildcard_subscriptions = wildcard_subscriptions
+        self._subscriptions: Set[str] = set()
+        self.unrouted_messages = 0
+        # retained Online on topic_lwt at every connection (the broker will sets it Offline): when topic_lwt is the
+        # liveness of the bridge, not the LWT of a device
+        self.publish_online = False
+        UNROUTED_MESSAGES.set_callback(lambda: self.unrouted_messages, name)
 
     def __setup_client(self, username: str, password: str, tls_cert_path:str|None) -> mqtt.Client:
-        logging.getLogger(__name__).debug(f'Setup mqtt client [{self.name}] with user [{username}]')
+        _logger.debug('Setup mqtt client [%s] with user [%s]', self.name, username)
         # Create an MQTT client instance
         client = mqtt.Client()
 
@@ -79,79 +131,169 @@ class MqttClient(object):
         return client
 
     def connect(self):
-        logging.getLogger(__name__).debug(f'Connecting to [{self.name}] on [{self.broker_address}:{self.broker_port}]')
+        _logger.debug('Connecting to [%s] on [%s:%s]', self.name, self.broker_address, self.broker_port)
+        # the broker publishes it if the bridge disappears without disconnecting
+        self.client.will_set(self.topic_lwt, LWT_OFFLINE, retain=True)
+
         # Connect to the broker
-        response = self.client.connect(self.broker_address, self.broker_port)
+        try:
+            response = self.client.connect(self.broker_address, self.broker_port)
+        except (OSError, ValueError) as e:
+            response = e
         self.is_connected = (response == MQTTErrorCode.MQTT_ERR_SUCCESS)
 
         if self.is_connected:
-            logging.getLogger(__name__).info(f'Connected to [{self.name}] on [{self.broker_address}:{self.broker_port}]')
+            _logger.info('Connected to [%s] on [%s:%s]', self.name, self.broker_address, self.broker_port)
         else:
-            logging.getLogger(__name__).error(f'Failed to connect [{self.name}] on [{self.broker_address}:{self.broker_port}] | response code [{response}]')
+            _logger.error('Failed to connect [%s] on [%s:%s] | response code [%s]', self.name, self.broker_address, self.broker_port, response)
 
     def loop_start(self):
-        logging.getLogger(__name__).info(f'Starting [{self.name}] listening loop.')
+        _logger.info('Starting [%s] listening loop.', self.name)
 
         if not self.is_connected:
             self.connect()
 
         # Start the network listening loop in a separate thread
         self.client.loop_start()
+        self._is_loop_started = True
+
+        if self.publish_queue is not None:
+            self.publish_queue.start(self._publish_now)
 
     def loop_stop(self):
-        logging.getLogger(__name__).info(f'Stopping [{self.name}] listening loop.')
+        _logger.info('Stopping [%s] listening loop.', self.name)
+
+        if self.publish_queue is not None:
+            self.publish_queue.stop()
 
         self.client.loop_stop()
+        self._is_loop_started = False
         self.client.disconnect()
         self.is_connected = False
 
-    def publish(self, topic: str, payload: str):
-        logging.getLogger(__name__).debug(f'Publishing to [{self.name}] message [{payload}] on topic [{topic}].')
+    def publish(self, topic: str, payload: str | bytes, qos: int = 0, retain: bool = False):
+        if self.publish_queue is not None:
+            # the publisher thread sends it, a slow broker does not block the caller (the device I/O); the topic
+            # policies of the queue may override qos / retain
+            self.publish_queue.put(topic, payload, qos=qos, retain=retain)
+        else:
+            self._publish_now(topic, payload, qos=qos, retain=retain)
 
-        if not self.is_connected:
+    def _publish_now(self, topic: str, payload: str | bytes, qos: int = 0, retain: bool = False) -> bool:
+        _logger.debug('Publishing to [%s] message [%s] on topic [%s] | qos [%s] / retain [%s].', self.name, payload, topic, qos, retain)
+
+        if not self.is_connected and not self._is_loop_started:
+            # once the network loop runs, the reconnection is left to it (not raced from the publisher thread)
             self.connect()
 
-        if self.is_connected:
-            self.client.publish(topic, payload)
-            logging.getLogger(__name__).debug(f'Published to [{self.name}] message [{payload}] on topic [{topic}].')
+        if not self.is_connected:
+            # the publish queue keeps it for a retry (or drops it, per its policy)
+            _logger.warning('Not connected to [%s], message on topic [%s] not published', self.name, topic)
+            return False
+
+        start_time = time.perf_counter()
+        message_info = self.client.publish(topic, payload, qos=qos, retain=retain)
+        self._publish_seconds.observe(time.perf_counter() - start_time)
+        if message_info is not None and message_info.rc != MQTTErrorCode.MQTT_ERR_SUCCESS:
+            _logger.warning('Failed to publish to [%s] on topic [%s] | response code [%s]', self.name, topic, message_info.rc)
+            return False
+
+        _logger.debug('Published to [%s] message [%s] on topic [%s].', self.name, payload, topic)
+        return True
+
+    def publish_state(self, data: Dict[str, Any], topic: str | None = None):
+        _logger.debug('Publishing state to [%s] data=[%s]', self.name, data)
+        # the full state is retained, so a (re)subscribing consumer gets it right away
+        self.publish(topic=topic if topic else self.topic_status, payload=serializers.dumps(data), retain=True)
+
+    def add_listener(self, topic: str, callback: MqttCallbackOnMessage) -> None:
+        """Route the messages received on `topic` to `callback` (instead of the default on_callback)."""
+        subscription = self.subscription_of(topic)
+        _logger.info('Add listener on [%s] for topic [%s] | subscription [%s]', self.name, topic, subscription)
 
-    def publish_state(self, data: Dict[str, Any]):
-        logging.getLogger(__name__).debug(f'Publishing state to [{self.name}] data=[{data}]')
-        self.publish(topic=self.topic_status, payload=json.dumps(data))
+        with self._callback_mutex:
+            self._topic_callbacks[topic] = callback
+            is_new_subscription = subscription not in self._subscriptions
+            self._subscriptions.add(subscription)
+
+        if self.is_connected and is_new_subscription:
+            self.client.subscribe(subscription)
+
+    @property
+    def subscriptions(self) -> List[str]:
+        """The topic filters subscribed (once connected)."""
+        with self._callback_mutex:
+            return sorted(self._subscriptions | {self.topic_listen})
+
+    def subscription_of(self, topic: str) -> str:
+        """The topic filter subscribed for a listen topic: <topic_root>/+/<suffix> for the topics of the devices under
+        topic_root (one subscription for all of them), the topic itself otherwise."""
+        prefix = f'{self._topic_root}/'
+        if self.wildcard_subscriptions and topic.startswith(prefix):
+            device_level, separator, suffix = topic[len(prefix):].partition('/')
+            if separator and suffix and device_level not in ('+', '#'):
+                return f'{prefix}+/{suffix}'
+        return topic
+
+    def callback_of(self, topic: str | None) -> MqttCallbackOnMessage | None:
+        """The listener of topic: the one added for it, the default on_callback for topic_listen (None = dropped)."""
+        with self._callback_mutex:
+            callback = self._topic_callbacks.get(topic) if topic is not None else None
+            if callback is None and (topic is None or topic == self.topic_listen):
+                callback = self._on_callback
+        return callback
 
     # Callback when the client connects to the broker
     def _on_connect(self, client, userdata, flags, rc):
         if rc == 0:
-            logging.getLogger(__name__).debug(f"Connected to [{self.name}] successfully!")
-            # Subscribe to a topic
-            client.subscribe(self.topic_listen)
-            logging.getLogger(__name__).debug(f"Subscribed to topic: [{self.topic_listen}]")
+            _logger.debug("Connected to [%s] successfully!", self.name)
+            self.is_connected = True
+            subscriptions = self.subscriptions
+            # one SUBSCRIBE for all the topic filters
+            client.subscribe([(subscription, 0) for subscription in subscriptions])
+            _logger.debug("Subscribed to topics: [%s]", subscriptions)
+            if self.publish_online:
+                client.publish(self.topic_lwt, LWT_ONLINE, retain=True)
         else:
-            logging.getLogger(__name__).debug(f"Connection to [{self.name}] failed with code [{rc}]")
+            _logger.debug("Connection to [%s] failed with code [%s]", self.name, rc)
+
+    # Callback when the client is disconnected from the broker (the network loop reconnects)
+    def _on_disconnect(self, client, userdata, rc):
+        self.is_connected = False
+        if rc != 0:
+            _logger.warning('Connection to [%s] lost | response code [%s]', self.name, rc)
+        else:
+            _logger.debug('Disconnected from [%s]', self.name)
 
     # Callback when a message is received
     def _on_message(self, client, userdata, msg: mqtt.MQTTMessage):
-        logging.getLogger(__name__).debug(f"Received from [{self.name}] on topic [{msg.topic}] from [{userdata}] message: \n{msg.payload.decode()}")
+        _logger.debug("Received from [%s] on topic [%s] from [%s] message: \n%r", self.name, msg.topic, userdata, msg.payload)
+
+        if self.callback_of(msg.topic) is None:
+            # under a wildcard subscription, but not for one of the devices of this bridge
+            self.unrouted_messages += 1
+            _logger.debug('No listener on [%s] for topic [%s], message dropped', self.name, msg.topic)
+            return
 
         try:
-            message_data = json.loads(msg.payload)
-            self._handle_on_state_changed(message_data)
+            # an empty payload is a request without parameters (GET)
+            message_data = serializers.loads(msg.payload) if msg.payload else {}
+            self._handle_on_state_changed(message_data, topic=msg.topic)
         except Exception as e:
-            logging.getLogger(__name__).warning(f'Exception [{self.name}][ _on_message] while parsing json message: [%s]', e)
-            if logging.getLogger(__name__).isEnabledFor(logging.ERROR):
+            _logger.warning('Exception [%s][ _on_message] while parsing json message: [%s]', self.name, e)
+            if _logger.isEnabledFor(logging.ERROR):
                 traceback.print_exc()
 
-    def _handle_on_state_changed(self, state_current: Dict[str, Any]) -> None:
-        with self._callback_mutex:
-            on_callback = self.on_callback
+    def _handle_on_state_changed(self, state_current: Dict[str, Any], topic: str | None = None) -> None:
+        on_callback = self.callback_of(topic)
 
         if on_callback:
             with self._in_callback_mutex:
                 try:
                     on_callback(self, state_current)
                 except Exception as e:
-                    logging.getLogger(__name__).error(f'Exception [{self.name}][_handle_on_state_changed]: [%s]', e)
-                    if logging.getLogger(__name__).isEnabledFor(logging.ERROR):
+                    _logger.error('Exception [%s][_handle_on_state_changed]: [%s]', self.name, e)
+                    if _logger.isEnabledFor(logging.ERROR):
                         traceback.print_exc()
 
     @property
@@ -160,15 +302,20 @@ class MqttClient(object):
 
     @topic_root.setter
     def topic_root(self, topic_root: str | None) -> None:
-        logging.getLogger(__name__).info(f'Set topic_root [{topic_root}]')
+        _logger.info('Set topic_root [%s]', topic_root)
 
         if topic_root:
             self._topic_root = topic_root
-            self.topic_lwt = f'{self._topic_root}/LWT'
-            self.topic_status = f'{self._topic_root}/STATE'
-            self.topic_listen = f'{self._topic_root}/COMMAND'
-
-        logging.getLogger(__name__).debug(f'topic_lwt=[{self.topic_lwt}] / topic_status=[{self.topic_status}] / topic_listen=[{self.topic_listen}]')
+            self.topic_lwt = f'{self._topic_root}/{TOPIC_LWT}'
+            self.topic_status = f'{self._topic_root}/{TOPIC_STATE}'
+            self.topic_listen = f'{self._topic_root}/{TOPIC_COMMAND}'
+            self.topic_result = f'{self._topic_root}/{TOPIC_RESULT}'
+            self.topic_get = f'{self._topic_root}/{TOPIC_GET}'
+            self.topic_get_response = f'{self._topic_root}/{TOPIC_GET_RESPONSE}'
+            self.topic_history = f'{self._topic_root}/{TOPIC_HISTORY}'
+            self.topic_history_response = f'{self._topic_root}/{TOPIC_HISTORY_RESPONSE}'
+
+        _logger.debug('topic_lwt=[%s] / topic_status=[%s] / topic_listen=[%s]', self.topic_lwt, self.topic_status, self.topic_listen)
 
     @property
     def on_callback(self) -> MqttCallbackOnMessage | None:
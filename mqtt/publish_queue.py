@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+from typing import Callable, Dict, List, Optional, Tuple
+import logging
+from dataclasses import dataclass
+
+import collections
+import fnmatch
+import threading
+import time
+import traceback
+
+_logger = logging.getLogger(__name__)
+
+##########################################################################################################
+
+# Outbound mqtt messages go through a bounded queue, drained by one publisher thread:
+#  * the device I/O threads only enqueue, a slow / unreachable broker never stalls the device polling
+#  * QoS / retain are configured per topic pattern (fnmatch style, `*` also matches `/`)
+#  * on coalescing topics (STATE), a queued message not sent yet is replaced by the newer one (superseded states)
+#  * when the queue is full: OVERFLOW_DROP_OLDEST / OVERFLOW_DROP_NEWEST, or OVERFLOW_BLOCK the producer for a
+#    bounded time (then drop the new message)
+#  * a failed publish (broker down) is kept at the head of the queue and retried after retry_delay_seconds
+
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_DROP_NEWEST = 'drop_newest'
+OVERFLOW_BLOCK = 'block'
+
+MAX_QUEUE_SIZE = 1000
+BLOCK_TIMEOUT_SECONDS = 1.0
+RETRY_DELAY_SECONDS = 5.0
+
+# topic, payload, qos, retain => published
+PublishFunction = Callable[[str, str | bytes, int, bool], bool]
+
+##########################################################################################################
+
+@dataclass
+class TopicPolicy(object):
+    # None = use the value given by the publisher
+    qos: Optional[int] = None
+    retain: Optional[bool] = None
+    # replace the queued (not sent yet) message of the same topic
+    coalesce: bool = False
+
+
+DEFAULT_TOPIC_POLICIES: List[Tuple[str, TopicPolicy]] = [
+    ('*/STATE', TopicPolicy(coalesce=True)),
+    ('*/STATE/*', TopicPolicy(coalesce=True)),
+]
+
+
+@dataclass
+class PublishQueueStats(object):
+    enqueued: int = 0
+    published: int = 0
+    coalesced: int = 0
+    dropped: int = 0
+    failed: int = 0
+
+##########################################################################################################
+
+class _QueuedMessage(object):
+    __slots__ = ('topic', 'payload', 'qos', 'retain', 'coalesce')
+
+    def __init__(self, topic: str, payload: str | bytes, qos: int, retain: bool, coalesce: bool):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.coalesce = coalesce
+
+##########################################################################################################
+
+class PublishQueue(object):
+    """Bounded outbound mqtt queue, drained by a dedicated publisher thread."""
+
+    def __init__(self, max_size: int = MAX_QUEUE_SIZE, overflow_policy: str = OVERFLOW_DROP_OLDEST,
+                 topic_policies: List[Tuple[str, TopicPolicy]] | None = None,
+                 block_timeout_seconds: float = BLOCK_TIMEOUT_SECONDS, retry_delay_seconds: float = RETRY_DELAY_SECONDS):
+        if overflow_policy not in (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST, OVERFLOW_BLOCK):
+            raise ValueError(f'Unknown overflow policy [{overflow_policy}]')
+
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+        self.topic_policies = topic_policies if topic_policies is not None else list(DEFAULT_TOPIC_POLICIES)
+        self.block_timeout_seconds = block_timeout_seconds
+        self.retry_delay_seconds = retry_delay_seconds
+
+        self.stats = PublishQueueStats()
+
+        self._queue: collections.deque[_QueuedMessage] = collections.deque()
+        # topic => its queued message, for the coalescing topics
+        self._pending: Dict[str, _QueuedMessage] = {}
+        self._policy_cache: Dict[str, TopicPolicy] = {}
+        self._in_flight = 0
+
+        self._condition = threading.Condition()
+        self._publish_func: PublishFunction | None = None
+        self._is_stopping = False
+        self._thread: threading.Thread | None = None
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._queue)
+
+    def policy_of(self, topic: str) -> TopicPolicy:
+        policy = self._policy_cache.get(topic)
+        if policy is None:
+            policy = next((p for pattern, p in self.topic_policies if fnmatch.fnmatchcase(topic, pattern)), TopicPolicy())
+            self._policy_cache[topic] = policy
+        return policy
+
+    def put(self, topic: str, payload: str | bytes, qos: int = 0, retain: bool = False) -> bool:
+        """Queue a message. Returns False if it was dropped (queue full)."""
+        policy = self.policy_of(topic)
+        qos = policy.qos if policy.qos is not None else qos
+        retain = policy.retain if policy.retain is not None else retain
+
+        with self._condition:
+            self.stats.enqueued += 1
+
+            if policy.coalesce:
+                queued = self._pending.get(topic)
+                if queued is not None:
+                    queued.payload, queued.qos, queued.retain = payload, qos, retain
+                    self.stats.coalesced += 1
+                    return True
+
+            if len(self._queue) >= self.max_size and not self._make_room():
+                self.stats.dropped += 1
+                _logger.warning('Publish queue full, dropping message on topic [%s]', topic)
+                return False
+
+            message = _QueuedMessage(topic, payload, qos, retain, policy.coalesce)
+            self._queue.append(message)
+            if message.coalesce:
+                self._pending[topic] = message
+            self._condition.notify_all()
+        return True
+
+    def start(self, publish_func: PublishFunction) -> None:
+        with self._condition:
+            self._publish_func = publish_func
+            self._is_stopping = False
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='mqtt-publisher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop the publisher thread, after trying to send the queued messages for up to `timeout` seconds."""
+        self.flush(timeout)
+        with self._condition:
+            self._is_stopping = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Wait until all the queued messages were sent. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._queue or self._in_flight:
+                if self._thread is None or self._is_stopping:
+                    return False
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def _make_room(self) -> bool:
+        # called with the lock held, on a full queue
+        if self.overflow_policy == OVERFLOW_DROP_OLDEST:
+            self._forget(self._queue.popleft())
+            self.stats.dropped += 1
+            return True
+
+        if self.overflow_policy == OVERFLOW_BLOCK:
+            # backpressure, bounded so a dead broker can not stall the producer (the device I/O) for long
+            self._condition.wait_for(lambda: len(self._queue) < self.max_size or self._is_stopping,
+                                     timeout=self.block_timeout_seconds)
+            return len(self._queue) < self.max_size
+
+        return False
+
+    def _forget(self, message: _QueuedMessage) -> None:
+        if message.coalesce and self._pending.get(message.topic) is message:
+            del self._pending[message.topic]
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queue or self._is_stopping)
+                if self._is_stopping:
+                    break
+                message = self._queue.popleft()
+                self._forget(message)
+                self._in_flight += 1
+
+            is_published = self._publish(message)
+
+            with self._condition:
+                self._in_flight -= 1
+                if is_published:
+                    self.stats.published += 1
+                else:
+                    self.stats.failed += 1
+                    self._requeue(message)
+                self._condition.notify_all()
+
+                if not is_published:
+                    self._condition.wait_for(lambda: self._is_stopping, timeout=self.retry_delay_seconds)
+
+    def _publish(self, message: _QueuedMessage) -> bool:
+        try:
+            return self._publish_func(message.topic, message.payload, message.qos, message.retain)
+        except Exception as e:
+            _logger.error('Exception while publishing on topic [%s]: [%s]', message.topic, e)
+            if _logger.isEnabledFor(logging.ERROR):
+                traceback.print_exc()
+            return False
+
+    def _requeue(self, message: _QueuedMessage) -> None:
+        # called with the lock held; a newer message of the same (coalescing) topic supersedes the failed one
+        if message.coalesce and message.topic in self._pending:
+            self.stats.coalesced += 1
+            return
+
+        if len(self._queue) >= self.max_size:
+            # the queue got full while the message was in flight: the overflow policy applies to it too
+            self.stats.dropped += 1
+            if self.overflow_policy != OVERFLOW_DROP_NEWEST:
+                # drop_oldest: it is the oldest message; block: the publisher thread can not wait for itself
+                _logger.warning('Publish queue full, dropping the failed message on topic [%s]', message.topic)
+                return
+            dropped = self._queue.pop()
+            self._forget(dropped)
+            _logger.warning('Publish queue full, dropping message on topic [%s]', dropped.topic)
+
+        if message.coalesce:
+            self._pending[message.topic] = message
+        self._queue.appendleft(message)
+
+##########################################################################################################
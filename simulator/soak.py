@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+from typing import Any, Dict, List
+import logging
+from dataclasses import dataclass, field, asdict
+
+import argparse
+import json
+import random
+import threading
+import time
+
+from moes.MoesThermostat import MoesBhtThermostat, ThermostatState
+from moes.async_engine import AsyncTuyaEngine
+from moes.monitor import DeviceMonitor
+from moes.connection_manager import STATE_CONNECTED
+from simulator.tuya_simulator import TuyaDeviceSimulator, PROFILES
+
+_logger = logging.getLogger(__name__)
+
+##########################################################################################################
+
+# Throughput / recovery of MoesBhtThermostat against simulated devices (no mqtt):
+#
+#   python -m simulator.soak --devices 100 --duration 300 --profile flaky --engine asyncio --commands_per_second 5
+#
+# Every thermostat gets a random setpoint at commands_per_second (over the whole fleet); at the end:
+#  * the dps frames / state updates processed per second, the commands sent (and the ones not applied yet)
+#  * the connection losses and the recovery time (lost => connected again), per the reconnect backoff
+#  * the devices whose state differs from the simulated one (not converged)
+
+ENGINE_SELECTOR = 'selector'
+ENGINE_ASYNCIO = 'asyncio'
+
+##########################################################################################################
+
+@dataclass
+class SoakReport(object):
+    devices: int
+    engine: str
+    duration_seconds: float
+    updates: int = 0
+    updates_per_second: float = 0.0
+    commands: int = 0
+    # submitted but not applied yet when the soak ended (the I/O thread did not keep up)
+    commands_pending: int = 0
+    connection_losses: int = 0
+    recoveries: int = 0
+    recovery_seconds_mean: float = 0.0
+    recovery_seconds_max: float = 0.0
+    not_converged: List[str] = field(default_factory=list)
+    simulator: Dict[str, Any] = field(default_factory=dict)
+
+
+class _DeviceProbe(object):
+    """Counts the updates and times the reconnections of one thermostat."""
+
+    def __init__(self, thermostat: MoesBhtThermostat):
+        self.updates = 0
+        self.losses = 0
+        self.recovery_seconds: List[float] = []
+        self._lost_time: float | None = None
+
+        thermostat.data_listeners.append(self._on_data)
+        thermostat.connection.on_state_changed = self._on_connection_state
+
+    def _on_data(self, state_data: Dict[str, Any]) -> None:
+        self.updates += 1
+
+    def _on_connection_state(self, connection_state: str) -> None:
+        if connection_state == STATE_CONNECTED:
+            if self._lost_time is not None:
+                self.recovery_seconds.append(time.time() - self._lost_time)
+                self._lost_time = None
+        elif self._lost_time is None:
+            self.losses += 1
+            self._lost_time = time.time()
+
+##########################################################################################################
+
+def run_soak(simulator: TuyaDeviceSimulator, duration_seconds: float, engine: str = ENGINE_ASYNCIO,
+             commands_per_second: float = 1.0, seed: int = 1) -> SoakReport:
+    """Bridge the (started) simulated devices for duration_seconds, and report."""
+    rng = random.Random(seed)
+    thermostats = []
+    for device in simulator.devices:
+        thermostat = MoesBhtThermostat(name=device.name, tuya_id=device.tuya_id, local_ip=device.host,
+                                       tuya_local_key=device.local_key, port=device.port)
+        thermostats.append(thermostat)
+    probes = [_DeviceProbe(thermostat) for thermostat in thermostats]
+
+    if engine == ENGINE_ASYNCIO:
+        io_engine = AsyncTuyaEngine(thermostats)
+        io_thread = io_engine.start()
+        stop = io_engine.stop
+    else:
+        io_engine = DeviceMonitor(thermostats)
+        io_thread = threading.Thread(target=io_engine.run, name='tuya-monitor', daemon=True)
+        io_thread.start()
+        stop = io_engine.stop
+
+    commands = 0
+    start_time = time.time()
+    try:
+        while time.time() - start_time < duration_seconds:
+            if commands_per_second > 0:
+                thermostat = rng.choice(thermostats)
+                thermostat.submit_state(ThermostatState(target_temperature=rng.randrange(30, 50) / 2))
+                commands += 1
+                time.sleep(1.0 / commands_per_second)
+            else:
+                time.sleep(0.1)
+        # the last commands are applied, the devices answer a last status
+        for thermostat in thermostats:
+            thermostat.request_status()
+        time.sleep(min(5.0, max(1.0, duration_seconds / 10)))
+    finally:
+        stop()
+        io_thread.join(timeout=10)
+    elapsed = time.time() - start_time
+
+    recoveries = [seconds for probe in probes for seconds in probe.recovery_seconds]
+    report = SoakReport(devices=len(thermostats), engine=engine, duration_seconds=round(elapsed, 3),
+                        updates=sum(probe.updates for probe in probes), commands=commands,
+                        commands_pending=sum(thermostat._command_queue.qsize() + len(thermostat.commands.pending)
+                                             for thermostat in thermostats),
+                        connection_losses=sum(probe.losses for probe in probes), recoveries=len(recoveries),
+                        simulator=asdict(simulator.stats))
+    report.updates_per_second = round(report.updates / elapsed, 2) if elapsed else 0.0
+    if recoveries:
+        report.recovery_seconds_mean = round(sum(recoveries) / len(recoveries), 3)
+        report.recovery_seconds_max = round(max(recoveries), 3)
+    report.not_converged = [thermostat.name for thermostat, device in zip(thermostats, simulator.devices)
+                            if thermostat.device.codec.decode(device.dps) != {state_field: value for state_field, value in
+                                                                              thermostat.state_current.to_dict().items() if value is not None}]
+    return report
+
+##########################################################################################################
+
+def main():
+    parser = argparse.ArgumentParser(description='Soak test of the thermostat client against simulated devices')
+    parser.add_argument('--devices', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='home')
+    parser.add_argument('--engine', choices=(ENGINE_SELECTOR, ENGINE_ASYNCIO), default=ENGINE_ASYNCIO)
+    parser.add_argument('--commands_per_second', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s | %(levelname)s | %(name)s | %(message)s')
+
+    # one ip, ports given by the os: no loopback alias / port 6668 needed
+    simulator = TuyaDeviceSimulator.create(args.devices, profile=PROFILES[args.profile], base_ip='127.0.0.1',
+                                           port=0, same_ip=True).start()
+    try:
+        report = run_soak(simulator, args.duration, engine=args.engine,
+                          commands_per_second=args.commands_per_second, seed=args.seed)
+    finally:
+        simulator.stop()
+
+    print(json.dumps(asdict(report), indent=2))
+
+
+##########################################################################################################
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+from typing import Any, Callable, Dict, List, Optional, Set
+import logging
+from dataclasses import dataclass, field
+
+import argparse
+import asyncio
+import ipaddress
+import json
+import random
+import struct
+import threading
+import time
+
+from tinytuya.core import header as H
+from tinytuya.core.crypto_helper import AESCipher
+from tinytuya.core.message_helper import TuyaMessage, pack_message
+
+from moes.tuya_protocol import TuyaFrameReader, HEART_BEAT, DP_QUERY, CONTROL, STATUS, TUYA_PORT
+
+_logger = logging.getLogger(__name__)
+
+##########################################################################################################
+
+# Virtual BHT-002 thermostats speaking the Tuya 3.3 local protocol (tcp, AES-ECB with the local key), for the
+# load / soak tests of the bridge on one box, without hardware:
+#
+#   python -m simulator.tuya_simulator --devices 200 --inventory_file sim_devices.json [--profile flaky]
+#   python moes_tuya_thermostat_bridge.py --devices_file sim_devices.json ...
+#
+# Every device listens on its own (ip, port): by default 127.0.1.1, 127.0.1.2, ... on the tuya port (6668), the
+# whole 127.0.0.0/8 is local on Linux; --same_ip uses one ip and consecutive ports instead.
+#
+# A device answers like the BHT-002:
+#  * DP_QUERY => the full dps / HEART_BEAT => empty ack / CONTROL => empty ack, then a STATUS push of the changed
+#    dps (the eco mode change is NOT pushed, see the README quirks)
+#  * the home temperature drifts every change_interval_seconds (pushed), the eco mode is toggled from the device
+#    "keypad" every eco_change_interval_seconds (not pushed, only seen by a DP_QUERY)
+#  * answers are delayed by latency_seconds (+ jitter), a request is lost with loss_ratio
+#  * every drop_after_commands commands, the device closes the connection and refuses the new ones for
+#    drop_seconds (the "breaks the connection for up to a minute" quirk)
+#  * a connection with nothing received for heartbeat_timeout_seconds is closed by the device
+
+# dps of a BHT-002 (see moes/MoesThermostat)
+BHT_002_DPS = {'1': True, '2': 40, '3': 40, '4': '0', '5': False, '6': False, '102': 0, '104': True}
+DPS_HOME_TEMPERATURE = '3'
+DPS_ECO_MODE = '5'
+
+DEFAULT_BASE_IP = '127.0.1.1'
+SIMULATED_LOCAL_KEY = '0123456789abcdef'
+
+##########################################################################################################
+
+@dataclass
+class SimulatorProfile(object):
+    """The scripted behaviour of a virtual device (0 = never / none)."""
+    latency_seconds: float = 0.0
+    latency_jitter_seconds: float = 0.0
+    loss_ratio: float = 0.0
+    change_interval_seconds: float = 0.0
+    eco_change_interval_seconds: float = 0.0
+    drop_after_commands: int = 0
+    drop_seconds: float = 60.0
+    heartbeat_timeout_seconds: float = 30.0
+
+
+PROFILES: Dict[str, SimulatorProfile] = {
+    # answers right away, never changes by itself
+    'ideal': SimulatorProfile(),
+    # a home thermostat: some latency, the temperature changes every few minutes, the eco mode every hour
+    'home': SimulatorProfile(latency_seconds=0.05, latency_jitter_seconds=0.05,
+                             change_interval_seconds=180, eco_change_interval_seconds=3600),
+    # a bad wifi link and a device dropping the connection for a minute every 10 commands
+    'flaky': SimulatorProfile(latency_seconds=0.2, latency_jitter_seconds=0.3, loss_ratio=0.05,
+                              change_interval_seconds=60, eco_change_interval_seconds=600,
+                              drop_after_commands=10, drop_seconds=60),
+}
+
+##########################################################################################################
+
+@dataclass
+class SimulatorStats(object):
+    connections: int = 0
+    refused_connections: int = 0
+    requests: int = 0
+    lost_requests: int = 0
+    status_requests: int = 0
+    heartbeats: int = 0
+    commands: int = 0
+    pushes: int = 0
+    drops: int = 0
+
+    def add(self, other: "SimulatorStats") -> "SimulatorStats":
+        for name in self.__dataclass_fields__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        return self
+
+##########################################################################################################
+
+class VirtualThermostat(object):
+    """One simulated BHT-002: a tcp server speaking the tuya 3.3 local protocol."""
+
+    def __init__(self, name: str, tuya_id: str, local_key: str, host: str, port: int = TUYA_PORT,
+                 profile: SimulatorProfile | None = None, dps: Dict[str, Any] | None = None,
+                 random_func=random.random):
+        self.name = name
+        self.tuya_id = tuya_id
+        self.local_key = local_key
+        self.host = host
+        self.port = port
+        self.profile = profile if profile is not None else SimulatorProfile()
+        self.dps: Dict[str, Any] = dict(dps if dps is not None else BHT_002_DPS)
+        self.random_func = random_func
+
+        self.stats = SimulatorStats()
+        # on_command(device, dps): called from the simulator loop with the dps changed by every CONTROL request
+        self.on_command: Optional[Callable[["VirtualThermostat", Dict[str, Any]], None]] = None
+        # new connections are refused until then (after a drop)
+        self.unavailable_until = 0.0
+
+        self._cipher = AESCipher(local_key.encode('latin1'))
+        self._push_seqno = 1
+        self._writers: Set[asyncio.StreamWriter] = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def is_available(self) -> bool:
+        return time.time() >= self.unavailable_until
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._on_connection, self.host, self.port)
+        # port 0 => the one given by the os
+        self.port = self._server.sockets[0].getsockname()[1]
+
+        if self.profile.change_interval_seconds:
+            self._tasks.append(asyncio.create_task(self._run_changes(), name=f'sim-{self.name}-changes'))
+        if self.profile.eco_change_interval_seconds:
+            self._tasks.append(asyncio.create_task(self._run_eco_changes(), name=f'sim-{self.name}-eco'))
+        _logger.debug('Virtual device [%s] listening on [%s:%s]', self.name, self.host, self.port)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+        self.drop_connections()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def drop_connections(self, unavailable_seconds: float = 0.0) -> None:
+        """Close the open connections, refusing the new ones for unavailable_seconds."""
+        self.unavailable_until = max(self.unavailable_until, time.time() + unavailable_seconds)
+        for writer in list(self._writers):
+            writer.close()
+        self._writers.clear()
+
+    def set_dps(self, dps: Dict[str, Any], push: bool = True) -> None:
+        """Change dps from the device side (someone at the thermostat)."""
+        self.dps.update({str(index): value for index, value in dps.items()})
+        if push:
+            self._push(dps)
+
+    # protocol ############################################################################
+
+    async def _on_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        if not self.is_available:
+            self.stats.refused_connections += 1
+            writer.close()
+            return
+
+        self.stats.connections += 1
+        self._writers.add(writer)
+        frame_reader = TuyaFrameReader(no_retcode=True)
+        try:
+            while True:
+                data = await asyncio.wait_for(reader.read(4096), timeout=self.profile.heartbeat_timeout_seconds or None)
+                if not data:
+                    break
+                for message in frame_reader.feed(data):
+                    await self._on_request(message, writer)
+                    if writer.is_closing():
+                        return
+        except (asyncio.TimeoutError, ConnectionError, OSError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _on_request(self, message: TuyaMessage, writer: asyncio.StreamWriter) -> None:
+        self.stats.requests += 1
+        if self.profile.loss_ratio and self.random_func() < self.profile.loss_ratio:
+            self.stats.lost_requests += 1
+            return
+
+        latency = self.profile.latency_seconds + self.profile.latency_jitter_seconds * self.random_func()
+        if latency > 0:
+            await asyncio.sleep(latency)
+
+        if message.cmd == HEART_BEAT:
+            self.stats.heartbeats += 1
+            self._send(writer, message.seqno, HEART_BEAT, None)
+
+        elif message.cmd == DP_QUERY:
+            self.stats.status_requests += 1
+            self._send(writer, message.seqno, DP_QUERY, {'devId': self.tuya_id, 'dps': dict(self.dps)})
+
+        elif message.cmd == CONTROL:
+            self.stats.commands += 1
+            request = self._decrypt(message.payload)
+            changes = {str(index): value for index, value in (request or {}).get('dps', {}).items()}
+            self.dps.update(changes)
+            if self.on_command is not None:
+                self.on_command(self, changes)
+            self._send(writer, message.seqno, CONTROL, None)
+            # the BHT-002 does not push the eco mode changes
+            pushed = {index: value for index, value in changes.items() if index != DPS_ECO_MODE}
+            if pushed:
+                self._push(pushed)
+
+            if self.profile.drop_after_commands and self.stats.commands % self.profile.drop_after_commands == 0:
+                _logger.info('Virtual device [%s] drops the connection for [%s] seconds', self.name, self.profile.drop_seconds)
+                self.stats.drops += 1
+                self.drop_connections(self.profile.drop_seconds)
+
+        else:
+            # not used by the bridge, acknowledged
+            self._send(writer, message.seqno, message.cmd, None)
+
+    def _push(self, dps: Dict[str, Any]) -> None:
+        for writer in list(self._writers):
+            self.stats.pushes += 1
+            self._send(writer, self._push_seqno, STATUS, {'devId': self.tuya_id, 'dps': dps, 't': int(time.time())})
+        self._push_seqno += 1
+
+    def _send(self, writer: asyncio.StreamWriter, seqno: int, command: int, data: Dict[str, Any] | None) -> None:
+        if writer.is_closing():
+            return
+
+        payload = b''
+        if data is not None:
+            payload = self._cipher.encrypt(json.dumps(data, separators=(',', ':')).encode('utf-8'), False)
+            if command not in H.NO_PROTOCOL_HEADER_CMDS:
+                payload = H.PROTOCOL_33_HEADER + payload
+
+        # device => client frames carry a return code (0 = ok) before the payload
+        frame = TuyaMessage(seqno, command, 0, struct.pack(H.MESSAGE_RETCODE_FMT, 0) + payload, 0, True, H.PREFIX_55AA_VALUE, False)
+        writer.write(pack_message(frame))
+
+    def _decrypt(self, payload: bytes) -> Optional[Dict[str, Any]]:
+        if payload.startswith(H.PROTOCOL_VERSION_BYTES_33):
+            payload = payload[len(H.PROTOCOL_33_HEADER):]
+        try:
+            return json.loads(self._cipher.decrypt(payload, False, decode_text=False))
+        except (ValueError, TypeError) as e:
+            _logger.warning('Virtual device [%s] received an invalid payload: [%s]', self.name, e)
+            return None
+
+    # scripted changes ####################################################################
+
+    async def _run_changes(self) -> None:
+        while True:
+            await asyncio.sleep(self._next_interval(self.profile.change_interval_seconds))
+            # +/- 0.5 degrees (the dps is in 0.5 degrees)
+            home_temperature = self.dps.get(DPS_HOME_TEMPERATURE, 40) + (1 if self.random_func() < 0.5 else -1)
+            self.set_dps({DPS_HOME_TEMPERATURE: min(max(home_temperature, 20), 60)})
+
+    async def _run_eco_changes(self) -> None:
+        while True:
+            await asyncio.sleep(self._next_interval(self.profile.eco_change_interval_seconds))
+            self.set_dps({DPS_ECO_MODE: not self.dps.get(DPS_ECO_MODE, False)}, push=False)
+
+    def _next_interval(self, mean_seconds: float) -> float:
+        # +/- 50%, so the devices do not all change at the same time
+        return mean_seconds * (0.5 + self.random_func())
+
+##########################################################################################################
+
+class TuyaDeviceSimulator(object):
+    """A fleet of virtual thermostats, served by one asyncio event loop (own thread, or the caller's)."""
+
+    def __init__(self, devices: List[VirtualThermostat]):
+        self.devices = devices
+
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._started = threading.Event()
+        self._stopped: asyncio.Event | None = None
+        self._error: BaseException | None = None
+
+    @staticmethod
+    def create(count: int, profile: SimulatorProfile | None = None, base_ip: str = DEFAULT_BASE_IP,
+               port: int = TUYA_PORT, same_ip: bool = False, name_prefix: str = 'SIM') -> "TuyaDeviceSimulator":
+        """count devices on consecutive ips (same port), or on one ip with consecutive ports (same_ip, port 0 =
+        ports given by the os)."""
+        devices = []
+        for i in range(count):
+            host = base_ip if same_ip else str(ipaddress.ip_address(base_ip) + i)
+            device_port = (port + i if port else 0) if same_ip else port
+            devices.append(VirtualThermostat(name=f'{name_prefix}-{i:04d}', tuya_id=f'sim{i:017d}',
+                                             local_key=SIMULATED_LOCAL_KEY, host=host, port=device_port, profile=profile))
+        return TuyaDeviceSimulator(devices)
+
+    @property
+    def stats(self) -> SimulatorStats:
+        total = SimulatorStats()
+        for device in self.devices:
+            total.add(device.stats)
+        return total
+
+    def get(self, name: str) -> Optional[VirtualThermostat]:
+        return next((device for device in self.devices if device.name == name), None)
+
+    def inventory(self, topic_prefix: str = 'sim/hvac/thermostat') -> Dict[str, Any]:
+        """The bridge device inventory (--devices_file) of the virtual devices."""
+        return {
+            'topic_prefix': topic_prefix,
+            'devices': [{'name': device.name, 'tuya_id': device.tuya_id, 'local_ip': device.host,
+                         'port': device.port, 'tuya_local_key': device.local_key} for device in self.devices],
+        }
+
+    def cpu_seconds(self) -> float | None:
+        """CPU time used by the simulator thread (None: not started with start(), or no per-thread clock)."""
+        if self._thread is None or self._thread.ident is None or not hasattr(time, 'pthread_getcpuclockid'):
+            return None
+        try:
+            return time.clock_gettime(time.pthread_getcpuclockid(self._thread.ident))
+        except OSError:
+            # the thread is gone
+            return None
+
+    def call_soon_threadsafe(self, callback, *args) -> None:
+        """Run callback on the simulator loop (ex: device.drop_connections from a test)."""
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def run(self, duration_seconds: float | None = None) -> None:
+        """Serve the devices on the calling thread, until stop() (or for duration_seconds)."""
+        asyncio.run(self._run(duration_seconds))
+
+    def start(self, timeout: float = 10) -> "TuyaDeviceSimulator":
+        """Serve the devices from a dedicated (daemon) thread, once they all listen."""
+        self._thread = threading.Thread(target=self.run, name='tuya-simulator', daemon=True)
+        self._thread.start()
+        if not self._started.wait(timeout):
+            raise TimeoutError('Tuya simulator did not start')
+        if self._error is not None:
+            raise self._error
+        return self
+
+    def stop(self, timeout: float = 10) -> None:
+        if self.loop is not None and self._stopped is not None and not self.loop.is_closed():
+            try:
+                self.loop.call_soon_threadsafe(self._stopped.set)
+            except RuntimeError:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    async def _run(self, duration_seconds: float | None) -> None:
+        self.loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        try:
+            await asyncio.gather(*(device.start() for device in self.devices))
+        except BaseException as e:
+            self._error = e
+            self._started.set()
+            await asyncio.gather(*(device.stop() for device in self.devices), return_exceptions=True)
+            raise
+
+        _logger.info('Tuya simulator serving [%s] virtual devices', len(self.devices))
+        self._started.set()
+        try:
+            await asyncio.wait_for(self._stopped.wait(), timeout=duration_seconds)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            await asyncio.gather(*(device.stop() for device in self.devices), return_exceptions=True)
+            _logger.info('Tuya simulator stopped: [%s]', self.stats)
+
+##########################################################################################################
+
+def main():
+    parser = argparse.ArgumentParser(description='Virtual Tuya 3.3 thermostats (BHT-002) for load / soak tests')
+    parser.add_argument('--devices', type=int, default=10)
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='home')
+    parser.add_argument('--base_ip', default=DEFAULT_BASE_IP)
+    parser.add_argument('--port', type=int, default=TUYA_PORT)
+    parser.add_argument('--same_ip', action='store_true', help='one ip, consecutive ports (from --port)')
+    parser.add_argument('--inventory_file', help='write the bridge device inventory (--devices_file) of the devices')
+    parser.add_argument('--duration', type=float, default=None, help='seconds (default: until interrupted)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(name)s | %(message)s')
+
+    simulator = TuyaDeviceSimulator.create(args.devices, profile=PROFILES[args.profile], base_ip=args.base_ip,
+                                           port=args.port, same_ip=args.same_ip)
+    if args.inventory_file:
+        with open(args.inventory_file, 'w') as inventory_file:
+            json.dump(simulator.inventory(), inventory_file, indent=2)
+        print(f'Inventory of [{args.devices}] devices written to [{args.inventory_file}]')
+
+    try:
+        simulator.run(args.duration)
+    except KeyboardInterrupt:
+        pass
+    print(simulator.stats)
+
+
+##########################################################################################################
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ import logging
 
 import json
 import re
+import time
 
 import generic.config as config
 from generic.config_logging import init_logging
@@ -35,6 +36,7 @@ def mock_tuya_device(mocker) -> ThermostatDevice:
     mocker.patch.object(ThermostatDevice, 'turn_on', return_value=None)
     mocker.patch.object(ThermostatDevice, 'turn_off', return_value=None)
     mocker.patch.object(ThermostatDevice, 'set_value', return_value=None)
+    mocker.patch.object(ThermostatDevice, 'set_multiple_values', return_value=None)
 
     return ThermostatDevice('123', '1.1.1.1', '', version=3.3)
 
@@ -118,3 +120,167 @@ def test_set_state(json_message, moes_thermo):
 
 
 # ***************************************************************************************
+def test_heartbeat_sent_once_per_interval(moes_thermo, mocker):
+    # given
+    moes_thermo.device.socket = mocker.MagicMock()
+    moes_thermo.is_synchronized = True
+    moes_thermo.init_monitoring()
+
+    # when
+    for _ in range(10):
+        moes_thermo.scheduler.run_due()
+    assert ThermostatDevice.sendPing.call_count == 0
+    moes_thermo.scheduler.run_due(now=moes_thermo.ping_time + 0.1)
+
+    # then
+    assert ThermostatDevice.sendPing.call_count == 1
+    moes_thermo.device.socket = None
+
+
+def test_state_change_written_as_one_frame(moes_thermo):
+    # when
+    moes_thermo.set_state(ThermostatState.from_json({'is_on': True, 'eco_mode': True, 'lock_enabled': True}))
+
+    # then
+    ThermostatDevice.set_multiple_values.assert_called_once_with({'1': True, '5': True, '6': True}, nowait=False)
+
+
+def test_write_answer_updates_the_state(moes_thermo, mocker):
+    # given
+    mocker.patch.object(ThermostatDevice, 'set_multiple_values', return_value={'dps': {'2': 46}})
+
+    # when
+    moes_thermo.set_state(ThermostatState.from_json({'target_temperature': 22.5}))
+
+    # then
+    assert moes_thermo.state_current.target_temperature == 23.0
+
+def test_command_brings_the_next_full_status_forward(moes_thermo):
+    # given
+    moes_thermo.init_monitoring()
+    status_get_time = moes_thermo.full_status_get_time
+
+    # when
+    moes_thermo.set_state(ThermostatState.from_json({'eco_mode': True}))
+
+    # then
+    assert moes_thermo.full_status_get_time < status_get_time
+    assert moes_thermo.scheduler.deadline_of(moes_thermo.timer_key('status_get')) == moes_thermo.full_status_get_time
+    assert moes_thermo.status_interval.seconds == moes_thermo.full_status_get_min_seconds
+    moes_thermo.stop_monitoring()
+
+
+def test_home_temperature_changes_let_the_status_interval_grow(moes_thermo):
+    # given
+    moes_thermo.init_monitoring()
+    moes_thermo.is_synchronized = True
+
+    # when
+    for i in range(10):
+        moes_thermo._process_data_updates({'home_temperature': 20.0 + i * 0.5})
+        moes_thermo.status_interval.on_status_request()
+
+    # then
+    assert moes_thermo.state_current.home_temperature == 24.5
+    assert moes_thermo.status_interval.seconds == moes_thermo.status_interval.max_seconds
+    assert moes_thermo.status_interval.changes_per_hour() == 10
+    moes_thermo._process_data_updates({'eco_mode': True})
+    assert moes_thermo.status_interval.seconds == moes_thermo.status_interval.min_seconds
+    moes_thermo.stop_monitoring()
+
+def test_queued_commands_are_applied_a_few_per_turn(moes_thermo):
+    # given
+    moes_thermo.commands.debounce_seconds = 0
+    applied = []
+    for target_temperature in range(15, 21):
+        moes_thermo.submit_state(ThermostatState(target_temperature=target_temperature),
+                                 on_done=lambda state, error: applied.append(state))
+
+    # when
+    moes_thermo.scheduler.run_due()
+
+    # then
+    assert len(applied) == moes_thermo.commands_per_turn
+    assert moes_thermo.scheduler.deadline_of(moes_thermo.timer_key('commands')) is not None
+    moes_thermo.scheduler.run_due()
+    assert len(applied) == 6
+
+
+def test_setters_write_right_away_with_the_default_settings(moes_thermo):
+    # when
+    moes_thermo.turn_on()
+    moes_thermo.set_target_temperature(21.0)
+
+    # then
+    assert [call.args[0] for call in ThermostatDevice.set_multiple_values.call_args_list] == [{'1': True}, {'2': 42}]
+    assert moes_thermo.commands.pending == {}
+
+
+def test_queued_commands_debounced_into_one_frame(moes_thermo):
+    # given
+    now = time.time()
+    moes_thermo.submit_state(ThermostatState(target_temperature=20.0))
+    moes_thermo.submit_state(ThermostatState(is_on=True))
+    moes_thermo.submit_state(ThermostatState(target_temperature=21.5, eco_mode=True))
+
+    # when
+    moes_thermo.scheduler.run_due(now=now)
+    assert ThermostatDevice.set_multiple_values.call_count == 0
+    moes_thermo.scheduler.run_due(now=now + moes_thermo.command_debounce_seconds + 0.1)
+
+    # then
+    ThermostatDevice.set_multiple_values.assert_called_once_with({'2': 43, '1': True, '5': True}, nowait=False)
+    assert moes_thermo.commands.pending == {}
+
+
+
+# ***************************************************************************************
+def test_state_is_immutable():
+    # given
+    state = ThermostatState(is_on=True, target_temperature=20.0)
+
+    # when
+    with pytest.raises(AttributeError):
+        state.is_on = False
+    new_state = state.replace(target_temperature=21.5)
+
+    # then
+    assert state.target_temperature == 20.0
+    assert new_state.target_temperature == 21.5 and new_state.is_on is True
+    assert state.replace(target_temperature=20.0) is state
+    assert state.clone() is state
+
+
+def test_state_diff():
+    # given
+    previous = ThermostatState(is_on=True, target_temperature=20.0, eco_mode=False)
+
+    # when
+    current = previous.replace(target_temperature=22.0, eco_mode=True)
+
+    # then
+    assert current.diff(previous) == {'target_temperature': 22.0, 'eco_mode': True}
+    assert previous.diff(previous) == {}
+    assert current != previous and current == ThermostatState(is_on=True, target_temperature=22.0, eco_mode=True)
+
+
+def test_state_changes_keep_previous_state(moes_thermo):
+    # given
+    initial_state = moes_thermo.state_current
+
+    # when
+    moes_thermo.handle_data({'dps': {'2': 44, '5': True}})
+
+    # then
+    assert moes_thermo.state_previous is initial_state
+    assert moes_thermo.state_current.diff(initial_state) == {'target_temperature': 22.0, 'eco_mode': True}
+    assert json.loads(moes_thermo.state_current.to_json())['target_temperature'] == 22.0
+
+
+def test_set_state_target_temperature_in_celsius(moes_thermo):
+    # when
+    new_state = moes_thermo.set_state(ThermostatState.from_json({'target_temperature': 22.5}))
+
+    # then
+    assert new_state.target_temperature == 22.5
+    ThermostatDevice.set_multiple_values.assert_called_once_with({'2': 45}, nowait=False)
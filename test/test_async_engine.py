@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+import pytest
+import logging
+
+import asyncio
+import json
+import struct
+import threading
+import time
+
+from tinytuya.core import header as H
+from tinytuya.core.crypto_helper import AESCipher
+from tinytuya.core.message_helper import TuyaMessage, pack_message
+
+import generic.config as config
+from generic.config_logging import init_logging
+from moes.MoesThermostat import MoesBhtThermostat, MoesBht002Thermostat
+from moes.async_engine import AsyncTuyaEngine
+from moes.tuya_protocol import TuyaFrameReader, DP_QUERY, CONTROL, STATUS
+
+
+##########################################################################################################
+
+LOCAL_KEY = '0123456789abcdef'
+
+# ***************************************************************************************
+@pytest.fixture(scope="session", autouse=True)
+def active_config():
+    return config.ActiveConfig(app_name=__name__, config=config.DEV)
+
+@pytest.fixture(scope="session", autouse=True)
+def setup_before_any_test(active_config):
+    init_logging(active_config)
+
+
+class FakeTuyaDevice(object):
+    """Minimal tuya 3.3 device: answers DP_QUERY with its dps and records the CONTROL commands."""
+
+    def __init__(self, dps):
+        self.dps = dps
+        self.received_commands = []
+        self.cipher = AESCipher(LOCAL_KEY.encode())
+        self.port = None
+        self.loop = None
+        self._ready = threading.Event()
+
+    def start(self):
+        threading.Thread(target=lambda: asyncio.run(self._serve()), daemon=True).start()
+        assert self._ready.wait(5)
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        frame_reader = TuyaFrameReader(no_retcode=True)
+        while data := await reader.read(4096):
+            for message in frame_reader.feed(data):
+                payload = message.payload
+                if payload.startswith(H.PROTOCOL_VERSION_BYTES_33):
+                    payload = payload[len(H.PROTOCOL_33_HEADER):]
+                request = json.loads(self.cipher.decrypt(payload, False, decode_text=False)) if payload else {}
+
+                if message.cmd == DP_QUERY:
+                    writer.write(self._frame(message.seqno, DP_QUERY, {'dps': self.dps}))
+                elif message.cmd == CONTROL:
+                    self.received_commands.append(request.get('dps'))
+                    self.dps.update(request.get('dps', {}))
+                    writer.write(self._frame(message.seqno, CONTROL, None))
+                    writer.write(self._frame(0, STATUS, {'dps': request.get('dps')}, with_header=True))
+            await writer.drain()
+
+    def _frame(self, seqno, command, data, with_header=False):
+        payload = b''
+        if data is not None:
+            payload = self.cipher.encrypt(json.dumps(data).encode(), False)
+            if with_header:
+                payload = H.PROTOCOL_33_HEADER + payload
+        payload = struct.pack(H.MESSAGE_RETCODE_FMT, 0) + payload
+        return pack_message(TuyaMessage(seqno, command, 0, payload, 0, True, H.PREFIX_55AA_VALUE, None))
+
+
+@pytest.fixture
+def fake_device():
+    device = FakeTuyaDevice({'1': True, '2': 42, '3': 39, '4': '1', '5': False, '6': False})
+    device.start()
+    return device
+
+@pytest.fixture
+def moes_thermo(fake_device) -> MoesBhtThermostat:
+    device = MoesBht002Thermostat('123', '127.0.0.1', LOCAL_KEY, version=3.3)
+    device.port = fake_device.port
+    return MoesBhtThermostat(name="FAKE-Moes", tuya_id='123', local_ip='127.0.0.1', tuya_local_key=LOCAL_KEY, device=device)
+
+
+def wait_for(condition, timeout=5.0) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+# ***************************************************************************************
+def test_frame_reader_splits_and_resyncs():
+    # given
+    frame = pack_message(TuyaMessage(1, STATUS, 0, struct.pack('>I', 0) + b'payload', 0, True, H.PREFIX_55AA_VALUE, None))
+    reader = TuyaFrameReader()
+
+    # when
+    messages = reader.feed(b'garbage' + frame[:10])
+    messages += reader.feed(frame[10:] + frame)
+
+    # then
+    assert [m.payload for m in messages] == [b'payload', b'payload']
+
+
+def test_engine_reads_status_and_writes_commands(moes_thermo, fake_device):
+    # given
+    published = []
+    moes_thermo.on_callback = lambda device, data: published.append(dict(data))
+    engine = AsyncTuyaEngine([moes_thermo])
+
+    # when
+    engine.start()
+    try:
+        assert wait_for(lambda: moes_thermo.state_current.target_temperature == 21.0)
+        assert wait_for(lambda: moes_thermo.transport is not None)
+
+        moes_thermo.set_lock_enabled(True)
+        assert wait_for(lambda: fake_device.received_commands == [{'6': True}])
+    finally:
+        engine.stop()
+
+    # then
+    assert published[0]['target_temperature'] == 21.0
+    assert published[0]['home_temperature'] == 19.5
+    assert moes_thermo.is_synchronized
+
+
+def test_engine_stopped_before_its_loop_runs(moes_thermo):
+    # given
+    engine = AsyncTuyaEngine([moes_thermo])
+
+    # when
+    engine.stop()
+    engine.run()
+
+    # then
+    assert engine.is_stopping
+    assert moes_thermo.transport is None
+
+
+def test_engine_stopped_right_after_start(moes_thermo):
+    # given
+    engine = AsyncTuyaEngine([moes_thermo])
+
+    # when
+    thread = engine.start()
+    engine.stop()
+    thread.join(timeout=5)
+
+    # then
+    assert not thread.is_alive()
+
+# ***************************************************************************************
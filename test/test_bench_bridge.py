@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+import pytest
+
+from benchmark.bench_bridge import run_bridge_bench, percentiles, compare, BROKER_EMBEDDED
+from bridge.bridge import ENGINE_ASYNCIO, ENGINE_SELECTOR
+
+
+##########################################################################################################
+
+# ***************************************************************************************
+@pytest.mark.parametrize('engine', [ENGINE_ASYNCIO, ENGINE_SELECTOR])
+def test_bridge_bench_measures_both_directions(engine):
+    # when
+    result = run_bridge_bench(3, rounds=2, engine=engine, command_debounce_seconds=0, round_timeout_seconds=5)
+
+    # then
+    assert result.lost == 0
+    assert result.device_to_mqtt_ms['p50'] > 0
+    assert result.mqtt_to_device_ms['p99'] >= result.mqtt_to_device_ms['p50'] > 0
+    assert result.mqtt_to_result_ms['p50'] > 0
+    # 2 rounds x 3 devices: STATE published / COMMAND received + RESULT published
+    assert result.messages >= 3 * 2 * 3
+    assert result.rss_mb > 0
+
+
+def test_bridge_bench_through_the_embedded_broker():
+    # when
+    result = run_bridge_bench(3, rounds=2, broker=BROKER_EMBEDDED, command_debounce_seconds=0, round_timeout_seconds=5)
+
+    # then
+    assert result.broker == BROKER_EMBEDDED
+    assert result.lost == 0
+    assert result.messages >= 3 * 2 * 3
+
+
+def test_percentiles_nearest_rank():
+    # when
+    stats = percentiles([i / 1000 for i in range(1, 101)])
+
+    # then
+    assert stats == {'p50': 50.0, 'p95': 95.0, 'p99': 99.0, 'max': 100.0, 'mean': 50.5}
+    assert percentiles([]) == {}
+
+
+def test_regressions_against_a_baseline():
+    # given
+    baseline = {'results': [{'devices': 10, 'device_to_mqtt_ms': {'p95': 2.0}, 'messages_per_second': 1000.0},
+                            {'devices': 100, 'device_to_mqtt_ms': {'p95': 20.0}, 'messages_per_second': 1000.0}]}
+    results = {'results': [{'devices': 10, 'device_to_mqtt_ms': {'p95': 2.2}, 'messages_per_second': 700.0},
+                           {'devices': 100, 'device_to_mqtt_ms': {'p95': 30.0}, 'messages_per_second': 1100.0},
+                           {'devices': 500, 'device_to_mqtt_ms': {'p95': 90.0}, 'messages_per_second': 900.0}]}
+
+    # when
+    regressions = compare(results, baseline, tolerance=0.2)
+
+    # then
+    assert len(regressions) == 2
+    assert 'messages_per_second' in regressions[0] and regressions[0].strip().startswith('10 devices')
+    assert 'device_to_mqtt_ms.p95' in regressions[1] and regressions[1].strip().startswith('100 devices')
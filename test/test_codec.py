@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+import pytest
+
+from moes.codec import DpsCodec, DpsField
+from moes.device_models import MODELS
+
+
+##########################################################################################################
+
+# ***************************************************************************************
+@pytest.fixture
+def codec() -> DpsCodec:
+    return MODELS.get('BHT-002').codec
+
+# ***************************************************************************************
+def test_decode_dps_into_state_delta(codec):
+    # given
+    dps = {'1': True, '2': 41, '3': 39, '4': '1', '5': False, '6': True, '102': 0, '104': True}
+
+    # when
+    delta = codec.decode(dps)
+
+    # then
+    assert delta == {'is_on': True, 'target_temperature': 20.5, 'home_temperature': 19.5,
+                     'manual_operating_mode': True, 'eco_mode': False, 'lock_enabled': True}
+
+
+def test_decode_skips_unknown_and_invalid_dps(codec):
+    # given
+    dps = {'2': 40, '4': 'unexpected', '99': 1, '5': None}
+
+    # when
+    delta = codec.decode(dps)
+
+    # then
+    assert delta == {'target_temperature': 20.0}
+
+
+@pytest.mark.parametrize('field_name, value, expected', [
+    ('is_on', False, ('1', False)),
+    ('target_temperature', 22.5, ('2', 45)),
+    ('manual_operating_mode', True, ('4', '1')),
+    ('manual_operating_mode', False, ('4', '0')),
+    ('lock_enabled', True, ('6', True)),
+])
+def test_encode_state_field(codec, field_name, value, expected):
+    # when
+    encoded = codec.encode(field_name, value)
+
+    # then
+    assert encoded == expected
+    assert codec.decode({encoded[0]: encoded[1]}) == {field_name: value}
+
+
+def test_lookups_both_directions(codec):
+    # then
+    assert codec.field_of('2') == 'target_temperature'
+    assert codec.field_of(5) == 'eco_mode'
+    assert codec.field_of('102') is None
+    assert codec.dps_of('lock_enabled') == '6'
+    assert codec.dps_of('unknown') is None
+
+
+def test_flag_needs_two_values():
+    # then
+    with pytest.raises(ValueError):
+        DpsField.flag('4', 'mode', ['0', '1', '2'])
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+import pytest
+
+from generic.scheduler import TimerScheduler
+from moes.command_batcher import CommandBatcher
+
+
+##########################################################################################################
+
+class FakeClock(object):
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+# ***************************************************************************************
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+@pytest.fixture
+def scheduler(clock) -> TimerScheduler:
+    return TimerScheduler(time_func=clock)
+
+@pytest.fixture
+def written() -> list:
+    return []
+
+@pytest.fixture
+def batcher(scheduler, written) -> CommandBatcher:
+    return CommandBatcher('MOCK-Moes', lambda: scheduler, lambda dps, nowait: written.append((dps, nowait)),
+                          debounce_seconds=0.5)
+
+# ***************************************************************************************
+def test_burst_debounced_into_latest_value(batcher, scheduler, clock, written):
+    # given
+    with batcher.debounced():
+        for setpoint in range(40, 60):
+            batcher.submit({2: setpoint})
+            clock.now += 0.01
+
+    # when
+    scheduler.run_due()
+    assert written == []
+    clock.now += 0.5
+    scheduler.run_due()
+
+    # then
+    assert written == [({'2': 59}, False)]
+
+
+def test_different_dps_merged_in_one_frame(batcher, scheduler, clock, written):
+    # given
+    with batcher.debounced():
+        batcher.submit({1: True}, nowait=True)
+        batcher.submit({4: '1'}, nowait=True)
+
+    # when
+    clock.now += 1
+    scheduler.run_due()
+
+    # then
+    assert written == [({'1': True, '4': '1'}, True)]
+    assert batcher.pending == {}
+
+
+def test_batch_without_debounce_sent_on_exit(batcher, written):
+    # given
+    batcher.debounce_seconds = 0
+
+    # when
+    with batcher.batch():
+        batcher.submit({1: True})
+        batcher.submit({6: False})
+        assert written == []
+
+    # then
+    assert written == [({'1': True, '6': False}, False)]
+
+
+def test_writes_outside_debounced_sent_right_away(batcher, scheduler, written):
+    # given
+    with batcher.debounced():
+        batcher.submit({2: 42})
+
+    # when
+    batcher.submit({1: True})
+
+    # then
+    assert written == [({'2': 42, '1': True}, False)]
+    assert scheduler.deadline_of(batcher.timer_key) is None
+
+# ***************************************************************************************
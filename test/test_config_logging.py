@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+import logging
+import os
+import queue
+
+import pytest
+
+from generic.config_logging import DroppingQueueHandler, TimestampedRotatingFileHandler
+
+
+##########################################################################################################
+
+def _record(message: str) -> logging.LogRecord:
+    return logging.LogRecord('test', logging.INFO, __file__, 1, message, None, None)
+
+# ***************************************************************************************
+@pytest.fixture
+def file_pattern(tmp_path) -> str:
+    return str(tmp_path / '{timestamp}_{app_name}.log')
+
+# ***************************************************************************************
+def test_queue_handler_drops_when_full():
+    # given
+    handler = DroppingQueueHandler(queue.Queue(maxsize=2))
+
+    # when
+    for i in range(5):
+        handler.handle(_record(f'message {i}'))
+
+    # then
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
+
+
+def test_file_rotated_by_size(file_pattern, tmp_path):
+    # given
+    handler = TimestampedRotatingFileHandler(file_pattern, 'APP', max_bytes=100)
+    first_file = handler.baseFilename
+
+    # when
+    for i in range(10):
+        handler.emit(_record(f'a log line of about 25 [{i}]'))
+    handler.close()
+
+    # then
+    assert handler.baseFilename != first_file
+    assert all(os.path.getsize(f) <= 100 for f in tmp_path.glob('*_APP.log'))
+
+
+def test_file_rotated_by_time(file_pattern):
+    # given
+    handler = TimestampedRotatingFileHandler(file_pattern, 'APP', rotation_seconds=60)
+    first_file = handler.baseFilename
+
+    # when
+    handler.rollover_at = 0
+    handler.emit(_record('after the rotation time'))
+    handler.close()
+
+    # then
+    assert handler.baseFilename != first_file
+
+
+def test_old_files_deleted(file_pattern, tmp_path):
+    # given
+    for timestamp in ('20200101_000000', '20200102_000000', '20200103_000000'):
+        (tmp_path / f'{timestamp}_APP.log').write_text('old')
+    (tmp_path / '20200101_000000_OTHER.log').write_text('other app')
+    handler = TimestampedRotatingFileHandler(file_pattern, 'APP', max_bytes=10, backup_count=2)
+
+    # when
+    handler.emit(_record('larger than the max bytes'))
+    handler.emit(_record('larger than the max bytes'))
+    handler.close()
+
+    # then
+    app_files = sorted(f.name for f in tmp_path.glob('*_APP.log'))
+    assert len(app_files) == 3
+    assert '20200101_000000_APP.log' not in app_files
+    assert (tmp_path / '20200101_000000_OTHER.log').exists()
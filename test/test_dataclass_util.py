@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+from typing import Any, List, Optional, Union
+from dataclasses import dataclass
+
+import pytest
+
+from generic.dataclass_util import get_validator, get_valid_dataclass_fields, get_invalid_type_dataclass_fields, validate_many
+
+
+##########################################################################################################
+
+@dataclass
+class SampleData(object):
+    name: str
+    temperature: Optional[float] = None
+    value: Union[int, str] = 0
+    tags: List[str] = None
+    extra: Any = None
+
+# ***************************************************************************************
+def test_valid_fields():
+    # given
+    data = {'name': 'A', 'temperature': None, 'value': 'x', 'tags': ['t'], 'extra': object, 'unknown': 1}
+
+    # when
+    valid_fields = get_valid_dataclass_fields(SampleData, data)
+
+    # then
+    assert valid_fields == {'name': 'A', 'temperature': None, 'value': 'x', 'tags': ['t'], 'extra': object}
+
+
+@pytest.mark.parametrize('data, invalid_fields', [
+    ({'name': None}, ['name']),
+    ({'name': 1}, ['name']),
+    ({'temperature': '21'}, ['temperature']),
+    ({'value': 1.5}, ['value']),
+    ({'tags': 'not a list'}, ['tags']),
+    ({'name': 'A', 'temperature': 21.5, 'value': 3}, []),
+])
+def test_invalid_type_fields(data, invalid_fields):
+    # then
+    assert get_invalid_type_dataclass_fields(SampleData, data) == invalid_fields
+
+
+def test_validate_many():
+    # given
+    items = [{'name': 'A'}, {'name': 2, 'temperature': 20.0}, 'not a dict']
+
+    # when
+    valid_items = validate_many(SampleData, items)
+
+    # then
+    assert valid_items == [{'name': 'A'}, {'temperature': 20.0}, {}]
+
+
+def test_validator_compiled_once():
+    # then
+    assert get_validator(SampleData) is get_validator(SampleData)
+    assert get_validator(SampleData).checks['temperature'] == ((float,), True, 'float')
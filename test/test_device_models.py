@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+import pytest
+
+import json
+
+from tinytuya.Contrib import ThermostatDevice
+
+from bridge.inventory import DeviceInventory, load_device_inventory
+from moes.MoesThermostat import MoesBhtThermostat, ThermostatState
+from moes.device_models import MODELS, ThermostatModel
+
+
+##########################################################################################################
+
+TRV_DEFINITION = {
+    'model': 'TEST-TRV',
+    'temperature_min': 5.0,
+    'temperature_max': 30.0,
+    'dps': {
+        '1': {'name': 'is_on', 'type': 'bool'},
+        '4': {'name': 'target_temperature', 'scale': 10},
+        '5': {'name': 'home_temperature', 'scale': 10, 'read_only': True},
+        '7': {'name': 'lock_enabled', 'type': 'bool'},
+    },
+}
+
+# ***************************************************************************************
+@pytest.fixture
+def mock_tuya_device(mocker):
+    mocker.patch.object(ThermostatDevice, 'set_multiple_values', return_value=None)
+
+@pytest.fixture
+def bht_6000(mock_tuya_device) -> MoesBhtThermostat:
+    return MoesBhtThermostat(name='MOCK-6000', tuya_id='123', local_ip='1.1.1.1', tuya_local_key='secret_key', model='BHT-6000')
+
+# ***************************************************************************************
+def test_bundled_models():
+    # then
+    assert {'BHT-002', 'BHT-6000'} <= set(MODELS.names)
+    assert MODELS.get('BHT-002').read_only_fields == {'home_temperature'}
+    with pytest.raises(ValueError):
+        MODELS.get('UNKNOWN')
+
+
+def test_model_from_definition():
+    # when
+    model = ThermostatModel.from_json(TRV_DEFINITION)
+
+    # then
+    assert model.codec.decode({'1': True, '4': 215, '5': 198}) == {'is_on': True, 'target_temperature': 21.5, 'home_temperature': 19.8}
+    assert model.codec.encode('target_temperature', 21.5) == ('4', 215)
+    assert model.clamp_temperature(32.0) == 30.0
+
+
+def test_model_definition_with_duplicate_field():
+    # given
+    definition = dict(TRV_DEFINITION, dps={'1': {'name': 'is_on'}, '2': {'name': 'is_on'}})
+
+    # then
+    with pytest.raises(ValueError):
+        ThermostatModel.from_json(definition)
+
+
+def test_device_decodes_its_model_dps(bht_6000):
+    # when
+    bht_6000.handle_data({'dps': {'1': True, '2': 'manual', '16': 215, '24': 203, '40': True}})
+
+    # then
+    assert bht_6000.state_current == ThermostatState(is_on=True, target_temperature=21.5, home_temperature=20.3,
+                                                     manual_operating_mode=True, lock_enabled=True)
+
+
+def test_device_writes_only_its_model_fields(bht_6000):
+    # given
+    bht_6000.commands.debounce_seconds = 0
+
+    # when
+    bht_6000.set_state(ThermostatState(target_temperature=22.0, eco_mode=True, home_temperature=30.0))
+
+    # then
+    assert bht_6000.state_current.eco_mode is None
+    assert bht_6000.state_current.home_temperature == 0.0
+    ThermostatDevice.set_multiple_values.assert_called_once_with({'16': 220}, nowait=False)
+
+
+def test_inventory_with_model_files(tmp_path):
+    # given
+    (tmp_path / 'trv.json').write_text(json.dumps(TRV_DEFINITION))
+    inventory_file = tmp_path / 'devices.json'
+    inventory_file.write_text(json.dumps({
+        'model_files': ['trv.json'],
+        'devices': [
+            {'name': 'LIVING', 'tuya_id': '1', 'local_ip': '192.168.1.10', 'tuya_local_key': 'k1'},
+            {'name': 'BEDROOM', 'tuya_id': '2', 'local_ip': '192.168.1.11', 'tuya_local_key': 'k2', 'model': 'TEST-TRV'},
+        ],
+    }))
+
+    # when
+    inventory = load_device_inventory(str(inventory_file))
+
+    # then
+    assert [device.model for device in inventory.devices] == ['BHT-002', 'TEST-TRV']
+    assert MODELS.get('TEST-TRV').temperature_max == 30.0
+
+
+def test_inventory_with_unknown_model():
+    # given
+    inventory = DeviceInventory.from_json({'devices': [
+        {'name': 'LIVING', 'tuya_id': '1', 'local_ip': '192.168.1.10', 'tuya_local_key': 'k1', 'model': 'BHT-9999'},
+    ]})
+
+    # then
+    with pytest.raises(ValueError):
+        inventory.load_models()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+import pytest
+
+import calendar
+import json
+import os
+import time
+
+from bridge.history import HistoryRecorder, HEADER, RECORD
+from moes.MoesThermostat import ThermostatState
+
+# 2026-10-01 00:00:00 UTC
+DAY = calendar.timegm((2026, 10, 1, 0, 0, 0))
+STATE = ThermostatState(is_on=True, target_temperature=21.5, home_temperature=19.5,
+                        manual_operating_mode=False, eco_mode=False, lock_enabled=False)
+
+
+##########################################################################################################
+
+# ***************************************************************************************
+@pytest.fixture
+def history_path(tmp_path) -> str:
+    return str(tmp_path / 'history')
+
+
+@pytest.fixture
+def history(history_path) -> HistoryRecorder:
+    return HistoryRecorder(history_path, retention_days=0, max_points=3)
+
+
+def record_heating(history: HistoryRecorder, name: str, start: float, count: int, interval: float = 60) -> None:
+    # home temperature going up by 0.5 every interval
+    for index in range(count):
+        history.record(name, STATE.replace(home_temperature=19.5 + index * 0.5), record_time=start + index * interval)
+
+# ***************************************************************************************
+def test_recorded_states_are_read_back(history, history_path):
+    # given
+    history.record('LIVING', STATE, record_time=DAY + 10)
+    history.record('LIVING', ThermostatState(home_temperature=20.0), record_time=DAY + 20)
+
+    # when
+    written = history.flush()
+    answer = history.query('LIVING', DAY, DAY + 60)
+
+    # then
+    assert written == 2
+    assert os.path.getsize(os.path.join(history_path, 'LIVING', '2026-10-01.hist')) == HEADER.size + 2 * RECORD.size
+    assert answer['points'] == [
+        {'time': DAY + 10, **STATE.to_dict()},
+        {'time': DAY + 20, **ThermostatState(home_temperature=20.0).to_dict()},
+    ]
+    assert answer['truncated'] is False
+
+
+def test_unchanged_state_is_not_recorded_again(history):
+    # given
+    history.record('LIVING', STATE, record_time=DAY)
+
+    # when
+    is_recorded = history.record('LIVING', STATE.replace(), record_time=DAY + 10)
+
+    # then
+    assert is_recorded is False
+    assert history.flush() == 1
+
+
+def test_range_query_over_several_days(history, history_path):
+    # given
+    record_heating(history, 'LIVING', DAY - 120, 4)
+    record_heating(history, 'KITCHEN', DAY, 2)
+    history.flush()
+    # a record cut by a crash
+    with open(os.path.join(history_path, 'LIVING', '2026-10-01.hist'), 'ab') as history_file:
+        history_file.write(b'\x01\x02\x03')
+
+    # when
+    answer = history.query('LIVING', DAY - 60, DAY + 60, fields=['home_temperature', 'unknown'])
+
+    # then
+    assert history.days('LIVING') == ['2026-09-30', '2026-10-01']
+    assert answer['fields'] == ['home_temperature']
+    assert answer['points'] == [{'time': DAY - 60, 'home_temperature': 20.0},
+                                {'time': DAY, 'home_temperature': 20.5},
+                                {'time': DAY + 60, 'home_temperature': 21.0}]
+
+
+def test_records_appended_after_a_truncated_record(history, history_path):
+    # given
+    history.record('LIVING', STATE, record_time=DAY + 10)
+    history.flush()
+    with open(os.path.join(history_path, 'LIVING', '2026-10-01.hist'), 'ab') as history_file:
+        history_file.write(b'\x01\x02\x03')
+
+    # when
+    history.record('LIVING', STATE.replace(eco_mode=True), record_time=DAY + 20)
+    history.flush()
+
+    # then
+    assert os.path.getsize(os.path.join(history_path, 'LIVING', '2026-10-01.hist')) == HEADER.size + 2 * RECORD.size
+    assert [point['eco_mode'] for point in history.query('LIVING', DAY, DAY + 60)['points']] == [False, True]
+
+
+def test_buffered_records_are_queried_without_writing_them(history, history_path):
+    # given
+    record_heating(history, 'LIVING', DAY, 2)
+    history.flush()
+    history.record('LIVING', STATE.replace(home_temperature=25.0), record_time=DAY + 600)
+
+    # when
+    answer = history.query('LIVING', DAY, DAY + 3600, fields=['home_temperature'])
+
+    # then
+    assert [point['home_temperature'] for point in answer['points']] == [19.5, 20.0, 25.0]
+    assert os.path.getsize(os.path.join(history_path, 'LIVING', '2026-10-01.hist')) == HEADER.size + 2 * RECORD.size
+
+
+def test_unbounded_range_reads_only_the_existing_files(history):
+    # given
+    record_heating(history, 'LIVING', DAY, 2)
+    history.flush()
+
+    # when
+    start_time = time.perf_counter()
+    answer = history.query_request('LIVING', {'from': '-1e12', 'to': '1e15'})
+
+    # then
+    assert time.perf_counter() - start_time < 1
+    assert len(answer['points']) == 2
+
+
+def test_query_is_truncated_to_max_points(history):
+    # given
+    record_heating(history, 'LIVING', DAY, 5)
+
+    # when
+    answer = history.query('LIVING', DAY, DAY + 3600)
+
+    # then
+    assert len(answer['points']) == 3
+    assert answer['truncated'] is True
+    assert answer['stats'] == {'target_temperature': {'min': 21.5, 'max': 21.5, 'avg': 21.5},
+                               'home_temperature': {'min': 19.5, 'max': 21.5, 'avg': 20.5}}
+
+
+def test_downsampled_query(history):
+    # given
+    record_heating(history, 'LIVING', DAY, 5)
+    history.record('LIVING', STATE.replace(home_temperature=21.5, eco_mode=True), record_time=DAY + 290)
+
+    # when
+    answer = history.query('LIVING', DAY, DAY + 3600, step=180, fields=['home_temperature', 'eco_mode'])
+
+    # then
+    assert answer['points'] == [
+        {'time': DAY, 'count': 3, 'home_temperature': {'min': 19.5, 'max': 20.5, 'avg': 20.0}, 'eco_mode': False},
+        {'time': DAY + 180, 'count': 3, 'home_temperature': {'min': 21.0, 'max': 21.5, 'avg': 21.33}, 'eco_mode': True},
+    ]
+
+
+def test_downsampled_query_is_truncated_to_max_points(history):
+    # given
+    record_heating(history, 'LIVING', DAY, 5)
+
+    # when
+    answer = history.query('LIVING', DAY, DAY + 3600, step=60, fields=['home_temperature'])
+
+    # then
+    assert [point['time'] for point in answer['points']] == [DAY, DAY + 60, DAY + 120]
+    assert answer['truncated'] is True
+    assert answer['stats'] == {'home_temperature': {'min': 19.5, 'max': 21.5, 'avg': 20.5}}
+
+
+def test_old_days_are_removed(history_path):
+    # given
+    history = HistoryRecorder(history_path, retention_days=2)
+    history.record('LIVING', STATE, record_time=DAY - 2 * 24 * 60 * 60)
+    history.flush()
+
+    # when
+    history.record('LIVING', STATE.replace(eco_mode=True), record_time=DAY - 24 * 60 * 60)
+    history.record('LIVING', STATE, record_time=DAY)
+    history.flush()
+
+    # then
+    assert history.days('LIVING') == ['2026-09-30', '2026-10-01']
+
+
+def test_states_written_by_the_background_thread(history):
+    # given
+    history.start()
+
+    # when
+    history.record('LIVING', STATE)
+    deadline = time.time() + 5
+    while history.records == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    history.stop()
+
+    # then
+    assert history.records == 1
+    assert len(history.query('LIVING', time.time() - 60, time.time())['points']) == 1
+
+# ***************************************************************************************
+def test_http_history_of_a_device(history):
+    # given
+    now = time.time()
+    record_heating(history, 'LIVING', now - 3600, 3, interval=1200)
+
+    # when
+    status, body = history.handle_http('/history/LIVING', 'from=-1800&step=3600&fields=home_temperature')
+
+    # then
+    assert status == 200
+    answer = json.loads(body)
+    assert answer['to'] - answer['from'] == pytest.approx(1800, abs=1)
+    assert answer['stats'] == {'home_temperature': {'min': 20.5, 'max': 20.5, 'avg': 20.5}}
+
+
+def test_http_history_errors_and_devices(history):
+    # given
+    record_heating(history, 'LIVING', DAY, 1)
+    history.flush()
+
+    # when
+    devices_status, devices_body = history.handle_http('/history', '')
+    unknown_status, unknown_body = history.handle_http('/history/UNKNOWN', '')
+    bad_step_status, _ = history.handle_http('/history/LIVING', 'step=0')
+    bad_range_status, _ = history.handle_http('/history/LIVING', f'from={DAY + 10}&to={DAY}')
+
+    # then
+    assert devices_status == 200
+    assert json.loads(devices_body) == {'devices': {'LIVING': ['2026-10-01']}}
+    assert unknown_status == 404 and json.loads(unknown_body)['devices'] == ['LIVING']
+    assert bad_step_status == 400
+    assert bad_range_status == 400
@@ -33,6 +33,7 @@ def mock_tuya_device(mocker) -> ThermostatDevice:
     mocker.patch.object(ThermostatDevice, 'turn_on', return_value=None)
     mocker.patch.object(ThermostatDevice, 'turn_off', return_value=None)
     mocker.patch.object(ThermostatDevice, 'set_value', return_value=None)
+    mocker.patch.object(ThermostatDevice, 'set_multiple_values', return_value=None)
 
     return ThermostatDevice('123', '1.1.1.1', '', version=3.3)
 
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+import pytest
+
+import urllib.request
+
+from generic.metrics import MetricsRegistry, start_metrics_server
+
+
+##########################################################################################################
+
+# ***************************************************************************************
+@pytest.fixture
+def registry() -> MetricsRegistry:
+    return MetricsRegistry()
+
+# ***************************************************************************************
+def test_counter_and_callback_exposition(registry):
+    # given
+    counter = registry.counter('tuya_error_frames_total', 'Error responses', ('device',))
+    depth = registry.callback('mqtt_publish_queue_depth', 'Queued messages', 'gauge', ('client',))
+    depth.set_callback(lambda: 3, 'Mqtt')
+
+    # when
+    child = counter.labels('LIVING')
+    child.inc()
+    child.inc()
+
+    # then
+    text = registry.render()
+    assert '# TYPE tuya_error_frames_total counter' in text
+    assert 'tuya_error_frames_total{device="LIVING"} 2' in text
+    assert 'mqtt_publish_queue_depth{client="Mqtt"} 3' in text
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    # given
+    histogram = registry.histogram('tuya_device_request_seconds', 'Durations', ('operation',), buckets=(0.1, 1.0))
+
+    # when
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.labels('status').observe(value)
+
+    # then
+    text = registry.render()
+    assert 'tuya_device_request_seconds_bucket{operation="status",le="0.1"} 2' in text
+    assert 'tuya_device_request_seconds_bucket{operation="status",le="1.0"} 3' in text
+    assert 'tuya_device_request_seconds_bucket{operation="status",le="+Inf"} 4' in text
+    assert 'tuya_device_request_seconds_count{operation="status"} 4' in text
+
+
+def test_registering_twice_returns_the_same_metric(registry):
+    # when
+    first = registry.counter('reconnects_total', 'Reconnects', ('device',))
+
+    # then
+    assert registry.counter('reconnects_total', 'Reconnects', ('device',)) is first
+    with pytest.raises(ValueError):
+        registry.histogram('reconnects_total', 'Reconnects')
+
+
+def test_metrics_served_over_http(registry):
+    # given
+    registry.counter('requests_total', 'Requests').inc()
+    server = start_metrics_server(port=0, address='127.0.0.1', registry=registry)
+
+    # when
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{server.server_address[1]}/metrics', timeout=5) as response:
+            body = response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # then
+    assert 'requests_total 1' in body
+
+
+def test_routes_served_over_http(registry):
+    # given
+    routes = {'/state': lambda path, query: (200, f'{{"path": "{path}", "query": "{query}"}}'.encode())}
+    server = start_metrics_server(port=0, address='127.0.0.1', registry=registry, routes=routes)
+
+    # when
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}/state/LIVING?fields=eco_mode'
+        with urllib.request.urlopen(url, timeout=5) as response:
+            content_type = response.headers['Content-Type']
+            body = response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # then
+    assert content_type.startswith('application/json')
+    assert body == '{"path": "/state/LIVING", "query": "fields=eco_mode"}'
+
+# ***************************************************************************************
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+import pytest
+
+import json
+import queue
+import socket
+import struct
+import time
+
+import paho.mqtt.client as mqtt
+
+from mqtt.mqtt_broker import EmbeddedMqttBroker, topic_matches, is_valid_filter, encode_packet, encode_string, encode_publish, \
+    CONNECT, CONNACK, PUBLISH, PUBREC, PUBREL, PUBCOMP
+from mqtt.mqtt_server import MqttClient
+
+
+##########################################################################################################
+
+# ***************************************************************************************
+@pytest.fixture
+def broker() -> EmbeddedMqttBroker:
+    broker = EmbeddedMqttBroker(port=0, name='test').start()
+    yield broker
+    broker.stop()
+
+
+def subscriber_of(broker: EmbeddedMqttBroker, *topic_filters: str) -> (mqtt.Client, queue.Queue):
+    messages = queue.Queue()
+    client = mqtt.Client(client_id='subscriber')
+    client.on_message = lambda client, userdata, message: messages.put((message.topic, message.payload, message.retain))
+    client.connect('127.0.0.1', broker.port)
+    for topic_filter in topic_filters:
+        client.subscribe(topic_filter, qos=1)
+    client.loop_start()
+    return client, messages
+
+
+def publisher_of(broker: EmbeddedMqttBroker, client_id: str = 'publisher') -> mqtt.Client:
+    client = mqtt.Client(client_id=client_id)
+    client.connect('127.0.0.1', broker.port)
+    client.loop_start()
+    return client
+
+
+def wait_until(condition, timeout: float = 5) -> bool:
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def recv_exactly(connection: socket.socket, size: int) -> bytes:
+    data = b''
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def stop(*clients: mqtt.Client):
+    for client in clients:
+        client.disconnect()
+        client.loop_stop()
+
+# ***************************************************************************************
+@pytest.mark.parametrize('topic_filter, topic, expected', [
+    ('home/hvac/STATE', 'home/hvac/STATE', True),
+    ('home/+/STATE', 'home/hvac/STATE', True),
+    ('home/+/STATE', 'home/hvac/thermostat/STATE', False),
+    ('home/#', 'home/hvac/thermostat/STATE', True),
+    ('home/#', 'home', True),
+    ('#', '$SYS/broker/clients', False),
+    ('+/broker/clients', '$SYS/broker/clients', False),
+    ('$SYS/#', '$SYS/broker/clients', True),
+])
+def test_topic_matches(topic_filter, topic, expected):
+    assert topic_matches(topic_filter, topic) is expected
+
+
+@pytest.mark.parametrize('topic_filter, expected', [
+    ('home/+/STATE', True), ('home/#', True), ('home/#/STATE', False), ('home/hv+c', False), ('', False),
+])
+def test_valid_filters(topic_filter, expected):
+    assert is_valid_filter(topic_filter) is expected
+
+
+def test_messages_are_routed_to_the_matching_subscriptions(broker):
+    # given
+    subscriber, messages = subscriber_of(broker, 'home/+/STATE', 'home/kitchen/#')
+    assert wait_until(lambda: len(broker.topic_filters) == 2)
+    publisher = publisher_of(broker)
+
+    # when
+    for topic in ('home/living/STATE', 'home/kitchen/STATE', 'home/living/RESULT'):
+        publisher.publish(topic, topic.encode(), qos=1).wait_for_publish(5)
+
+    # then
+    assert messages.get(timeout=5)[0] == 'home/living/STATE'
+    # one copy, while matched by both subscriptions
+    assert messages.get(timeout=5)[0] == 'home/kitchen/STATE'
+    time.sleep(0.1)
+    assert messages.empty()
+    stop(subscriber, publisher)
+
+
+def test_retained_messages_are_sent_on_subscribe(broker):
+    # given
+    publisher = publisher_of(broker)
+    publisher.publish('home/living/STATE', b'{"is_on": true}', retain=True).wait_for_publish(5)
+    publisher.publish('home/kitchen/STATE', b'{"is_on": false}', retain=True).wait_for_publish(5)
+    publisher.publish('home/kitchen/STATE', b'', retain=True).wait_for_publish(5)
+    assert wait_until(lambda: list(broker.retained) == ['home/living/STATE'])
+
+    # when
+    subscriber, messages = subscriber_of(broker, 'home/+/STATE')
+
+    # then
+    assert messages.get(timeout=5) == ('home/living/STATE', b'{"is_on": true}', True)
+    stop(subscriber, publisher)
+
+
+def test_will_is_published_when_a_client_is_lost(broker):
+    # given
+    subscriber, messages = subscriber_of(broker, 'bridge/LWT')
+    lost_client = mqtt.Client(client_id='bridge')
+    lost_client.will_set('bridge/LWT', 'Offline', retain=True)
+    lost_client.connect('127.0.0.1', broker.port)
+    lost_client.loop(timeout=1)
+    assert wait_until(lambda: 'bridge' in broker.clients)
+
+    # when
+    lost_client.socket().close()
+
+    # then
+    assert messages.get(timeout=5)[:2] == ('bridge/LWT', b'Offline')
+    assert broker.retained['bridge/LWT'][0] == b'Offline'
+    assert broker.stats.wills == 1
+    stop(subscriber)
+
+
+def test_clients_with_bad_credentials_are_refused():
+    # given
+    broker = EmbeddedMqttBroker(port=0, username='bridge', password='secret').start()
+    client = mqtt.Client()
+    client.username_pw_set('bridge', 'wrong')
+
+    # when
+    client.connect('127.0.0.1', broker.port)
+    client.loop(timeout=1)
+
+    # then
+    assert broker.stats.refused_connections == 1
+    assert broker.clients == []
+    broker.stop()
+
+
+def test_qos_2_message_is_routed_once_on_release(broker):
+    # given
+    subscriber, messages = subscriber_of(broker, 'home/+/STATE')
+    assert wait_until(lambda: len(broker.topic_filters) == 1)
+    publisher = socket.create_connection(('127.0.0.1', broker.port), timeout=5)
+    publisher.sendall(encode_packet(CONNECT, 0, encode_string('MQTT') + bytes([4, 0x02]) + struct.pack('!H', 60)
+                                    + encode_string('raw-publisher')))
+    assert recv_exactly(publisher, 4) == encode_packet(CONNACK, 0, bytes([0, 0]))
+
+    # when
+    publisher.sendall(encode_publish('home/living/STATE', b'on', qos=2, packet_id=7))
+    # retransmission (DUP flag)
+    publisher.sendall(encode_packet(PUBLISH, 0x08 | (2 << 1), encode_string('home/living/STATE') + struct.pack('!H', 7) + b'on'))
+    assert recv_exactly(publisher, 8) == encode_packet(PUBREC, 0, struct.pack('!H', 7)) * 2
+    time.sleep(0.1)
+    assert messages.empty()
+    publisher.sendall(encode_packet(PUBREL, 0x02, struct.pack('!H', 7)))
+
+    # then
+    assert recv_exactly(publisher, 4) == encode_packet(PUBCOMP, 0, struct.pack('!H', 7))
+    assert messages.get(timeout=5) == ('home/living/STATE', b'on', False)
+    time.sleep(0.1)
+    assert messages.empty()
+    assert broker.stats.messages_in == 1
+    publisher.close()
+    stop(subscriber)
+
+
+def test_publish_on_a_broker_not_started():
+    # when / then
+    with pytest.raises(RuntimeError):
+        EmbeddedMqttBroker(port=0, name='not-started').publish('home/living/STATE', 'on')
+
+def test_bridge_client_through_the_broker(broker):
+    # given
+    commands = queue.Queue()
+    mqtt_client = MqttClient(name='Mqtt', broker_address='127.0.0.1', broker_port=broker.port, username='', password='',
+                             tls_cert_path=None, topic_root='home/hvac/thermostat')
+    mqtt_client.on_callback = lambda client, data: commands.put(data)
+    mqtt_client.loop_start()
+    subscriber, messages = subscriber_of(broker, 'home/hvac/thermostat/STATE')
+    assert wait_until(lambda: len(broker.clients) == 2 and len(broker.topic_filters) == 2)
+
+    # when
+    mqtt_client.publish_state({'is_on': True})
+    subscriber.publish('home/hvac/thermostat/COMMAND', b'{"target_temperature": 21.5}')
+
+    # then
+    topic, payload, retain = messages.get(timeout=5)
+    assert topic == 'home/hvac/thermostat/STATE' and json.loads(payload) == {'is_on': True}
+    assert commands.get(timeout=5) == {'target_temperature': 21.5}
+    mqtt_client.loop_stop()
+    stop(subscriber)
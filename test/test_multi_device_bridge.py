@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+import pytest
+import logging
+
+import json
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.enums import MQTTErrorCode
+from tinytuya.Contrib import ThermostatDevice
+
+import generic.config as config
+from generic.config_logging import init_logging
+from bridge.bridge import Tuya2MqttBridge, MultiDeviceBridge
+from bridge.history import HistoryRecorder
+from bridge.inventory import DeviceInventory, load_device_inventory
+from bridge.state_store import StateStore
+from moes.MoesThermostat import MoesBhtThermostat
+from moes.monitor import DeviceMonitor
+from moes.connection_manager import ConnectionManager, STATE_CONNECTED, STATE_DEGRADED, STATE_OPEN_CIRCUIT
+from mqtt.mqtt_server import MqttClient
+
+
+##########################################################################################################
+
+# ***************************************************************************************
+@pytest.fixture(scope="session", autouse=True)
+def active_config():
+    return config.ActiveConfig(app_name=__name__, config=config.DEV)
+
+@pytest.fixture(scope="session", autouse=True)
+def setup_before_any_test(active_config):
+    init_logging(active_config)
+
+@pytest.fixture
+def mock_tuya_device(mocker) -> ThermostatDevice:
+    mocker.patch.object(ThermostatDevice, 'sendPing', return_value=None)
+    mocker.patch.object(ThermostatDevice, 'receive', return_value=None)
+    mocker.patch.object(ThermostatDevice, 'status', return_value={'dps': {'1': True, '2': 40, '3': 41}})
+    mocker.patch.object(ThermostatDevice, 'turn_on', return_value=None)
+    mocker.patch.object(ThermostatDevice, 'turn_off', return_value=None)
+    mocker.patch.object(ThermostatDevice, 'set_value', return_value=None)
+    mocker.patch.object(ThermostatDevice, 'set_multiple_values', return_value=None)
+
+    return ThermostatDevice('123', '1.1.1.1', '', version=3.3)
+
+@pytest.fixture
+def mock_mqtt_client(mocker) -> mqtt.Client:
+    mocker.patch.object(mqtt.Client, 'connect', return_value=MQTTErrorCode.MQTT_ERR_SUCCESS)
+    mocker.patch.object(mqtt.Client, 'loop_start', return_value=None)
+    mocker.patch.object(mqtt.Client, 'subscribe', return_value=(MQTTErrorCode.MQTT_ERR_SUCCESS, 1))
+    mocker.patch.object(mqtt.Client, 'publish', return_value=None)
+
+    return mqtt.Client()
+
+@pytest.fixture
+def mqtt_service(mock_mqtt_client) -> MqttClient:
+    return MqttClient(name='Mqtt', broker_address='broker_address', broker_port=1234,
+                      username="mqtt_user", password="mqtt_password",
+                      tls_cert_path=None,
+                      topic_root='home/hvac/thermostat',
+                      client=mock_mqtt_client)
+
+@pytest.fixture
+def inventory() -> DeviceInventory:
+    return DeviceInventory.from_json({
+        'topic_prefix': 'home/hvac/thermostat',
+        'devices': [
+            {'name': 'LIVING', 'tuya_id': '1', 'local_ip': '1.1.1.1', 'tuya_local_key': 'k1'},
+            {'name': 'KITCHEN', 'tuya_id': '2', 'local_ip': '1.1.1.2', 'tuya_local_key': 'k2', 'topic_root': 'home/kitchen/thermostat'},
+        ]
+    })
+
+@pytest.fixture
+def bridges(mock_tuya_device, mqtt_service, inventory) -> list[Tuya2MqttBridge]:
+    return [
+        Tuya2MqttBridge(tuya_device=MoesBhtThermostat(name=device.name, tuya_id=device.tuya_id,
+                                                      local_ip=device.local_ip, tuya_local_key=device.tuya_local_key),
+                        mqtt_client=mqtt_service, topic_root=inventory.topic_root_of(device))
+        for device in inventory.devices
+    ]
+
+# ***************************************************************************************
+def test_inventory_topic_roots(inventory):
+    # then
+    assert [inventory.topic_root_of(device) for device in inventory.devices] == ['home/hvac/thermostat/LIVING', 'home/kitchen/thermostat']
+
+
+@pytest.mark.parametrize('inventory_data', [
+    {'devices': [{'name': 'A', 'tuya_id': '1', 'local_ip': '1.1.1.1'}]},
+    {'devices': [{'name': 'A', 'tuya_id': '1', 'local_ip': '1.1.1.1', 'tuya_local_key': 'k'},
+                 {'name': 'A', 'tuya_id': '2', 'local_ip': '1.1.1.2', 'tuya_local_key': 'k'}]},
+])
+def test_inventory_rejects_invalid_definitions(inventory_data):
+    # when / then
+    with pytest.raises(ValueError):
+        DeviceInventory.from_json(inventory_data)
+
+
+def test_load_device_inventory(tmp_path):
+    # given
+    inventory_file = tmp_path / 'devices.json'
+    inventory_file.write_text(json.dumps({'devices': [{'name': 'A', 'tuya_id': '1', 'local_ip': '1.1.1.1', 'tuya_local_key': 'k'}]}))
+
+    # when
+    inventory = load_device_inventory(str(inventory_file))
+
+    # then
+    assert len(inventory.devices) == 1
+    assert inventory.topic_root_of(inventory.devices[0]) == 'home/hvac/thermostat/A'
+
+
+def test_multi_device_bridge_publishes_on_device_topics(bridges, mqtt_service, mock_mqtt_client):
+    # given
+    bridge = MultiDeviceBridge(bridges=bridges, mqtt_client=mqtt_service)
+
+    # when
+    bridge.start(max_iterations=2)
+
+    # then
+    published_topics = {call.args[0] for call in mock_mqtt_client.publish.call_args_list}
+    assert published_topics == {'home/hvac/thermostat/LIVING/STATE', 'home/kitchen/thermostat/STATE',
+                                'home/hvac/thermostat/LIVING/LWT', 'home/kitchen/thermostat/LWT'}
+
+
+def test_multi_device_bridge_routes_commands_to_device(bridges, mqtt_service):
+    # given
+    for bridge in bridges:
+        bridge.attach()
+    message = mqtt.MQTTMessage(topic=b'home/kitchen/thermostat/COMMAND')
+    message.payload = b'{"lock_enabled": true}'
+
+    # when
+    mqtt_service._on_message(mqtt_service.client, None, message)
+    assert bridges[1].tuya_device.state_current.lock_enabled is False
+    for bridge in bridges:
+        bridge.tuya_device.scheduler.run_due()
+
+    # then
+    assert bridges[1].tuya_device.state_current.lock_enabled is True
+    assert bridges[0].tuya_device.state_current.lock_enabled is False
+
+
+def test_command_result_published(bridges, mqtt_service, mock_mqtt_client):
+    # given
+    bridges[0].attach()
+    message = mqtt.MQTTMessage(topic=b'home/hvac/thermostat/LIVING/COMMAND')
+    message.payload = b'{"eco_mode": true}'
+
+    # when
+    mqtt_service._on_message(mqtt_service.client, None, message)
+    bridges[0].tuya_device.scheduler.run_due()
+
+    # then
+    topic, payload = mock_mqtt_client.publish.call_args.args
+    assert topic == 'home/hvac/thermostat/LIVING/RESULT'
+    result = json.loads(payload)
+    assert result['command'] == {'eco_mode': True}
+    assert result['result'] == 'OK'
+    assert result['state']['eco_mode'] is True
+
+
+def test_command_batch_applied_in_order(bridges, mqtt_service, mock_mqtt_client):
+    # given
+    bridges[0].attach()
+    message = mqtt.MQTTMessage(topic=b'home/hvac/thermostat/LIVING/COMMAND')
+    message.payload = b'[{"eco_mode": true}, {"target_temperature": 21.5, "home_temperature": 30.0}, {"lock_enabled": "yes"}]'
+
+    # when
+    mqtt_service._on_message(mqtt_service.client, None, message)
+    bridges[0].tuya_device.scheduler.run_due()
+
+    # then
+    results = [json.loads(call.args[1]) for call in mock_mqtt_client.publish.call_args_list
+               if call.args[0] == 'home/hvac/thermostat/LIVING/RESULT']
+    assert [result['command'] for result in results] == [{'eco_mode': True}, {'target_temperature': 21.5}, {'lock_enabled': 'yes'}]
+    state = bridges[0].tuya_device.state_current
+    assert state.eco_mode is True and state.target_temperature == 21.5 and state.lock_enabled is False
+
+
+
+def test_get_of_a_disconnected_device_answered_from_the_cache(bridges, mqtt_service, mock_mqtt_client):
+    # given
+    bridges[0].attach()
+    message = mqtt.MQTTMessage(topic=b'home/hvac/thermostat/LIVING/GET')
+    message.payload = b'{"fields": ["target_temperature", "eco_mode"], "id": 7}'
+
+    # when
+    mqtt_service._on_message(mqtt_service.client, None, message)
+
+    # then
+    responses = [json.loads(call.args[1]) for call in mock_mqtt_client.publish.call_args_list
+                 if call.args[0] == 'home/hvac/thermostat/LIVING/GET/RESPONSE']
+    assert len(responses) == 1
+    assert responses[0]['id'] == 7
+    assert list(responses[0]['state']) == ['target_temperature', 'eco_mode']
+    assert responses[0]['stale'] == ['target_temperature', 'eco_mode']
+
+
+def test_last_known_state_restored_and_published(bridges, mock_mqtt_client, tmp_path):
+    # given
+    state_store = StateStore(str(tmp_path / 'state.jsonl'))
+    state_store.save('LIVING', {'is_on': True, 'target_temperature': 22.5, 'eco_mode': True}, {'eco_mode': 1000.0}, synchronized=True)
+    bridges[0].state_store = state_store
+
+    # when
+    bridges[0].attach()
+
+    # then
+    thermostat = bridges[0].tuya_device
+    assert thermostat.state_current.target_temperature == 22.5 and thermostat.state_current.eco_mode is True
+    assert not thermostat.is_synchronized
+    assert thermostat.field_update_times == {'eco_mode': 1000.0}
+    published = [call.args[1] for call in mock_mqtt_client.publish.call_args_list
+                 if call.args[0] == 'home/hvac/thermostat/LIVING/STATE']
+    assert published == [thermostat.state_current.to_json()]
+    ThermostatDevice.set_multiple_values.assert_not_called()
+
+
+def test_state_changes_are_persisted(bridges, tmp_path):
+    # given
+    state_store = StateStore(str(tmp_path / 'state.jsonl'))
+    bridges[0].state_store = state_store
+    bridges[0].attach()
+
+    # when
+    bridges[0].tuya_device.handle_data({'dps': {'2': 45, '5': True}})
+    state_store.flush()
+
+    # then
+    record = StateStore(state_store.file_path).load()['LIVING']
+    assert record['state']['target_temperature'] == 22.5 and record['state']['eco_mode'] is True
+    assert set(record['updated']) == {'target_temperature', 'eco_mode'}
+
+def test_device_monitor_polls_disconnected_devices(bridges):
+    # given
+    thermostats = [bridge.tuya_device for bridge in bridges]
+    monitor = DeviceMonitor(thermostats)
+    for thermostat in thermostats:
+        thermostat.init_monitoring()
+
+    # when
+    polled = monitor.step()
+
+    # then
+    assert polled == len(thermostats)
+    assert all(thermostat.state_current.target_temperature == 20.0 for thermostat in thermostats)
+
+
+def test_connection_backoff_and_circuit_breaker():
+    # given
+    now = [1000.0]
+    connection = ConnectionManager('A', base_delay_seconds=1, max_delay_seconds=60, failure_threshold=3,
+                                   time_func=lambda: now[0], random_func=lambda: 0.5)
+    states = []
+    connection.on_state_changed = states.append
+
+    # when
+    delays = []
+    for _ in range(4):
+        connection.record_failure()
+        delays.append(connection.seconds_until_retry())
+    assert not connection.can_attempt()
+    now[0] += 60
+    assert connection.can_attempt()
+    connection.record_success()
+
+    # then
+    assert delays == [1, 2, 60, 60]
+    assert states == [STATE_DEGRADED, STATE_OPEN_CIRCUIT, STATE_CONNECTED]
+    assert connection.reconnects == 1
+
+
+def test_device_monitor_waits_for_reconnect_backoff(bridges):
+    # given
+    thermostats = [bridge.tuya_device for bridge in bridges]
+    monitor = DeviceMonitor(thermostats)
+    thermostats[0].connection.record_failure()
+
+    # when
+    polled = monitor.step()
+
+    # then
+    assert polled == 1
+    assert thermostats[1].connection.is_connected
+
+# ***************************************************************************************
+
+
+def test_multi_device_bridge_subscribes_with_wildcards(bridges, mqtt_service):
+    # when
+    for bridge in bridges:
+        bridge.attach()
+
+    # then
+    assert mqtt_service.subscription_of('home/hvac/thermostat/LIVING/COMMAND') == 'home/hvac/thermostat/+/COMMAND'
+    assert mqtt_service.subscriptions == ['home/hvac/thermostat/+/COMMAND', 'home/hvac/thermostat/+/GET',
+                                          'home/hvac/thermostat/COMMAND',
+                                          'home/kitchen/thermostat/COMMAND', 'home/kitchen/thermostat/GET']
+
+
+def test_multi_device_bridge_drops_commands_of_unknown_devices(bridges, mqtt_service):
+    # given
+    for bridge in bridges:
+        bridge.attach()
+    message = mqtt.MQTTMessage(topic=b'home/hvac/thermostat/UNKNOWN/COMMAND')
+    message.payload = b'{"lock_enabled": true}'
+
+    # when
+    mqtt_service._on_message(mqtt_service.client, None, message)
+    for bridge in bridges:
+        bridge.tuya_device.scheduler.run_due()
+
+    # then
+    assert mqtt_service.unrouted_messages == 1
+    assert all(bridge.tuya_device.state_current.lock_enabled is False for bridge in bridges)
+
+
+def test_multi_device_bridge_answers_history_queries(bridges, mqtt_service, mock_mqtt_client, tmp_path):
+    # given
+    history = HistoryRecorder(str(tmp_path / 'history'))
+    for bridge in bridges:
+        bridge.history = history
+        bridge.attach()
+    bridges[1].tuya_device.connect()
+    message = mqtt.MQTTMessage(topic=b'home/kitchen/thermostat/HISTORY')
+    message.payload = b'{"from": -60, "fields": ["home_temperature"], "id": "abc"}'
+
+    # when
+    mqtt_service._on_message(mqtt_service.client, None, message)
+
+    # then
+    topic, payload = mock_mqtt_client.publish.call_args.args[:2]
+    response = json.loads(payload)
+    assert topic == 'home/kitchen/thermostat/HISTORY/RESPONSE'
+    assert response['id'] == 'abc'
+    assert [point['home_temperature'] for point in response['points']] == [20.5]
+
+
+def test_multi_device_bridge_lwt_of_the_bridge_and_of_the_devices(bridges, mqtt_service, mock_mqtt_client):
+    # given
+    bridge = MultiDeviceBridge(bridges=bridges, mqtt_client=mqtt_service)
+    bridge.start(max_iterations=1)
+
+    # when
+    mqtt_service._on_connect(mock_mqtt_client, None, {}, 0)
+    online_call = mock_mqtt_client.publish.call_args
+    mock_mqtt_client.publish.reset_mock()
+    bridge.stop()
+
+    # then
+    assert online_call.args[:2] == ('home/hvac/thermostat/LWT', 'Online') and online_call.kwargs['retain'] is True
+    lwt_calls = {call.args[0]: call.args[1] for call in mock_mqtt_client.publish.call_args_list}
+    assert lwt_calls == {'home/hvac/thermostat/LIVING/LWT': 'Offline', 'home/kitchen/thermostat/LWT': 'Offline',
+                         'home/hvac/thermostat/LWT': 'Offline'}
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+import pytest
+import logging
+
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+import app
+import generic.config as config
+from generic.config_logging import init_logging
+from mqtt.mqtt_server import MqttClient
+from mqtt.publish_queue import PublishQueue, TopicPolicy, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST
+
+
+##########################################################################################################
+
+# ***************************************************************************************
+@pytest.fixture(scope="session", autouse=True)
+def active_config():
+    return config.ActiveConfig(app_name=__name__, config=config.DEV)
+
+@pytest.fixture(scope="session", autouse=True)
+def setup_before_any_test(active_config):
+    init_logging(active_config)
+
+
+class FakeBroker(object):
+    """publish function recording the messages, failing while `is_down`."""
+
+    def __init__(self):
+        self.messages = []
+        self.is_down = False
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def __call__(self, topic, payload, qos, retain) -> bool:
+        self.gate.wait(5)
+        if self.is_down:
+            return False
+        self.messages.append((topic, payload, qos, retain))
+        return True
+
+def wait_until(condition, timeout: float = 5) -> bool:
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.001)
+    return condition()
+
+@pytest.fixture
+def broker() -> FakeBroker:
+    return FakeBroker()
+
+# ***************************************************************************************
+def test_messages_published_in_order_with_topic_policy(broker):
+    # given
+    queue = PublishQueue(topic_policies=[('*/LWT', TopicPolicy(qos=1, retain=True))])
+    queue.start(broker)
+
+    # when
+    queue.put('home/A/LWT', 'Online')
+    queue.put('home/A/RESULT', '{}')
+
+    # then
+    assert queue.flush(timeout=5)
+    queue.stop()
+    assert broker.messages == [('home/A/LWT', 'Online', 1, True), ('home/A/RESULT', '{}', 0, False)]
+    assert queue.stats.published == 2
+
+
+def test_superseded_states_coalesced_while_broker_is_slow(broker):
+    # given
+    broker.gate.clear()
+    queue = PublishQueue()
+    queue.start(broker)
+    queue.put('home/A/STATE', 'first')
+
+    # when
+    for i in range(10):
+        queue.put('home/B/STATE', f'state-{i}')
+    broker.gate.set()
+
+    # then
+    assert queue.flush(timeout=5)
+    queue.stop()
+    assert [payload for topic, payload, _, _ in broker.messages] == ['first', 'state-9']
+    assert queue.stats.coalesced == 9
+
+
+@pytest.mark.parametrize('overflow_policy, expected_payloads', [
+    (OVERFLOW_DROP_OLDEST, ['1', '2']),
+    (OVERFLOW_DROP_NEWEST, ['0', '1']),
+])
+def test_overflow_policy(broker, overflow_policy, expected_payloads):
+    # given
+    queue = PublishQueue(max_size=2, overflow_policy=overflow_policy)
+
+    # when
+    for i in range(3):
+        queue.put('home/A/RESULT', str(i))
+    queue.start(broker)
+
+    # then
+    assert queue.flush(timeout=5)
+    queue.stop()
+    assert [payload for _, payload, _, _ in broker.messages] == expected_payloads
+    assert queue.stats.dropped == 1
+
+
+def test_failed_publish_is_retried(broker):
+    # given
+    broker.is_down = True
+    queue = PublishQueue(retry_delay_seconds=0.01)
+    queue.start(broker)
+
+    # when
+    queue.put('home/A/STATE', 'state')
+    assert not queue.flush(timeout=0.1)
+    broker.is_down = False
+
+    # then
+    assert queue.flush(timeout=5)
+    queue.stop()
+    assert broker.messages == [('home/A/STATE', 'state', 0, False)]
+    assert queue.stats.failed >= 1
+
+
+@pytest.mark.parametrize('overflow_policy, expected_payloads', [
+    (OVERFLOW_DROP_OLDEST, ['b', 'c']),
+    (OVERFLOW_DROP_NEWEST, ['a', 'b']),
+])
+def test_failed_publish_is_requeued_within_the_bound(broker, overflow_policy, expected_payloads):
+    # given
+    broker.is_down = True
+    broker.gate.clear()
+    queue = PublishQueue(max_size=2, overflow_policy=overflow_policy, retry_delay_seconds=0.01)
+    queue.start(broker)
+    queue.put('home/A/RESULT', 'a')
+    # the publisher thread holds 'a'
+    assert wait_until(lambda: len(queue) == 0)
+
+    # when
+    queue.put('home/A/RESULT', 'b')
+    queue.put('home/A/RESULT', 'c')
+    broker.gate.set()
+    assert wait_until(lambda: queue.stats.failed > 0)
+    broker.is_down = False
+
+    # then
+    assert queue.flush(timeout=5)
+    queue.stop()
+    assert [payload for _, payload, _, _ in broker.messages] == expected_payloads
+    assert queue.stats.dropped == 1
+
+
+def test_reconnect_left_to_the_network_loop(mocker):
+    # given
+    client = mocker.MagicMock(spec=mqtt.Client)
+    client.connect.return_value = mqtt.MQTT_ERR_SUCCESS
+    client.publish.return_value = None
+    queue = PublishQueue(retry_delay_seconds=0.01)
+    mqtt_client = MqttClient(name='Mqtt', broker_address='localhost', broker_port=1883, username='', password='',
+                             tls_cert_path=None, topic_root='home/A', client=client, publish_queue=queue)
+    mqtt_client.loop_start()
+    mqtt_client._on_connect(client, None, {}, 0)
+
+    # when
+    mqtt_client._on_disconnect(client, None, 1)
+    mqtt_client.publish('home/A/RESULT', 'a')
+    assert wait_until(lambda: queue.stats.failed > 0)
+    assert not mqtt_client.is_connected
+    mqtt_client._on_connect(client, None, {}, 0)
+
+    # then
+    assert queue.flush(timeout=5)
+    mqtt_client.loop_stop()
+    assert client.connect.call_count == 1
+    client.publish.assert_called_once_with('home/A/RESULT', 'a', qos=0, retain=False)
+
+
+def test_publish_queue_from_the_config(active_config):
+    # given
+    class QueueConfig(config.DEVConfig):
+        mqtt_publish_queue_size = 2
+        mqtt_publish_overflow_policy = OVERFLOW_DROP_NEWEST
+        mqtt_topic_policies = (('*/RESULT', {'qos': 1}), ('*/STATE', {'retain': True, 'coalesce': True}))
+
+    # when
+    queue = app.create_publish_queue(config.ActiveConfig(app_name=__name__, config=QueueConfig()))
+    mqtt_client = MqttClient(name='Mqtt', broker_address='localhost', broker_port=1883, username='', password='',
+                             tls_cert_path=None, topic_root='home/A', client=mqtt.Client(), publish_queue=queue)
+    mqtt_client.publish('home/A/RESULT', b'{}')
+    mqtt_client.publish('home/A/GET/RESPONSE', b'{}', qos=2)
+
+    # then
+    assert (queue.max_size, queue.overflow_policy) == (2, OVERFLOW_DROP_NEWEST)
+    assert queue.policy_of('home/A/STATE') == TopicPolicy(retain=True, coalesce=True)
+    assert [(message.topic, message.qos) for message in queue._queue] == [('home/A/RESULT', 1), ('home/A/GET/RESPONSE', 2)]
+
+# ***************************************************************************************
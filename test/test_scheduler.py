@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+import pytest
+
+from generic.scheduler import TimerScheduler
+
+
+##########################################################################################################
+
+class FakeClock(object):
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+# ***************************************************************************************
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+@pytest.fixture
+def scheduler(clock) -> TimerScheduler:
+    return TimerScheduler(time_func=clock)
+
+# ***************************************************************************************
+def test_runs_due_timers_in_deadline_order(scheduler, clock):
+    # given
+    calls = []
+    scheduler.schedule_in('b', 5, lambda: calls.append('b'))
+    scheduler.schedule_in('a', 1, lambda: calls.append('a'))
+    scheduler.schedule_in('c', 10, lambda: calls.append('c'))
+
+    # when
+    clock.now += 6
+    executed = scheduler.run_due()
+
+    # then
+    assert executed == 2
+    assert calls == ['a', 'b']
+    assert scheduler.seconds_until_next() == 4
+
+
+def test_rescheduling_a_key_replaces_its_timer(scheduler, clock):
+    # given
+    calls = []
+    scheduler.schedule_in('ping', 1, lambda: calls.append(1))
+
+    # when
+    scheduler.schedule_in('ping', 9, lambda: calls.append(9))
+    clock.now += 5
+    scheduler.run_due()
+
+    # then
+    assert calls == []
+    assert len(scheduler) == 1
+    assert scheduler.deadline_of('ping') == clock.now + 4
+
+
+def test_cancel_and_self_rescheduling(scheduler, clock):
+    # given
+    calls = []
+
+    def periodic():
+        calls.append(clock.now)
+        scheduler.schedule_in('periodic', 10, periodic)
+
+    scheduler.schedule_in('periodic', 10, periodic)
+    scheduler.schedule_in('cancelled', 1, lambda: calls.append('cancelled'))
+    scheduler.cancel('cancelled')
+
+    # when
+    for _ in range(3):
+        clock.now += 10
+        scheduler.run_due()
+
+    # then
+    assert calls == [1010.0, 1020.0, 1030.0]
+    assert scheduler.seconds_until_next() == 10
+
+
+def test_wakeup_only_for_earlier_deadlines(scheduler):
+    # given
+    wakeups = []
+    scheduler.on_wakeup = lambda: wakeups.append(1)
+
+    # when
+    scheduler.schedule_in('late', 60, lambda: None)
+    scheduler.schedule_in('later', 120, lambda: None)
+    scheduler.schedule_in('early', 1, lambda: None)
+
+    # then
+    assert len(wakeups) == 2
+
+
+def test_failing_timer_does_not_stop_others(scheduler, clock):
+    # given
+    calls = []
+    scheduler.schedule_in('bad', 1, lambda: 1 / 0)
+    scheduler.schedule_in('good', 2, lambda: calls.append('good'))
+
+    # when
+    clock.now += 3
+    scheduler.run_due()
+
+    # then
+    assert calls == ['good']
+
+# ***************************************************************************************
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+import pytest
+
+import json
+
+from generic.serializers import available_serializers, get_serializer, SERIALIZER_STDLIB
+
+
+##########################################################################################################
+
+STATE = {'is_on': True, 'target_temperature': 21.5, 'home_temperature': None, 'name': 'Living °C'}
+
+# ***************************************************************************************
+@pytest.mark.parametrize('name', available_serializers())
+def test_round_trip(name):
+    # given
+    serializer = get_serializer(name)
+
+    # when
+    payload = serializer.dumps(STATE)
+
+    # then
+    assert isinstance(payload, bytes)
+    assert json.loads(payload) == STATE
+    assert serializer.loads(payload) == STATE
+    assert serializer.loads(payload.decode()) == STATE
+
+
+def test_stdlib_payload_is_compact():
+    # when
+    payload = get_serializer(SERIALIZER_STDLIB).dumps({'is_on': True, 'eco_mode': False})
+
+    # then
+    assert payload == b'{"is_on":true,"eco_mode":false}'
+
+
+def test_unknown_serializer():
+    # then
+    with pytest.raises(ValueError):
+        get_serializer('pickle')
+
+
+def test_stdlib_always_available():
+    # then
+    assert SERIALIZER_STDLIB in available_serializers()
+    assert get_serializer().name in available_serializers()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+import pytest
+
+import json
+import time
+
+from tinytuya.Contrib import ThermostatDevice
+
+from bridge.state_cache import StateCache, StateCacheRegistry
+from generic.scheduler import TimerScheduler
+from moes.MoesThermostat import MoesBhtThermostat
+
+ALL_DPS = {'1': True, '2': 43, '3': 39, '4': '1', '5': False, '6': False}
+
+
+##########################################################################################################
+
+# ***************************************************************************************
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture
+def moes_thermo(mocker, clock) -> MoesBhtThermostat:
+    mocker.patch.object(ThermostatDevice, 'status', return_value=None)
+    thermostat = MoesBhtThermostat(name="MOCK-Moes", tuya_id='123', local_ip='1.1.1.1', tuya_local_key='secret_key')
+    thermostat.scheduler = TimerScheduler(time_func=clock)
+    thermostat.connection.record_success()
+    mocker.patch.object(thermostat, 'request_status')
+    # all the fields received from the device
+    thermostat.handle_data({'dps': ALL_DPS})
+    return thermostat
+
+
+@pytest.fixture
+def state_cache(moes_thermo, clock) -> StateCache:
+    cache = StateCache(moes_thermo, ttl_seconds=60, timeout_seconds=5, time_func=clock)
+    cache.attach()
+    return cache
+
+
+def age(moes_thermo, seconds: float, fields=None):
+    for state_field in fields or list(moes_thermo.field_update_times):
+        moes_thermo.field_update_times[state_field] -= seconds
+
+# ***************************************************************************************
+def test_fresh_fields_are_served_from_memory(moes_thermo, state_cache):
+    # given
+    answers = []
+
+    # when
+    state_cache.get(answers.append, fields=['target_temperature', 'home_temperature'])
+
+    # then
+    assert len(answers) == 1
+    assert answers[0]['state'] == {'target_temperature': 21.5, 'home_temperature': 19.5}
+    assert answers[0]['stale'] == []
+    assert set(answers[0]['age']) == {'target_temperature', 'home_temperature'}
+    assert state_cache.refreshes == 0
+    moes_thermo.request_status.assert_not_called()
+
+
+def test_stale_fields_are_refreshed_once_for_concurrent_gets(moes_thermo, state_cache):
+    # given
+    age(moes_thermo, 120, ['home_temperature'])
+    answers = []
+
+    # when
+    state_cache.get(answers.append, fields=['home_temperature'])
+    state_cache.get(answers.append)
+    assert answers == []
+    moes_thermo.handle_data({'dps': {'3': 40}})
+
+    # then
+    assert moes_thermo.request_status.call_count == 1
+    assert state_cache.refreshes == 1
+    assert len(answers) == 2
+    assert answers[0]['state'] == {'home_temperature': 20.0}
+    assert answers[0]['stale'] == []
+    assert answers[1]['state']['home_temperature'] == 20.0
+    assert moes_thermo.scheduler.deadline_of(state_cache.timer_key) is None
+
+
+def test_max_age_of_the_request_overrides_the_ttl(moes_thermo, state_cache):
+    # given
+    age(moes_thermo, 10)
+    answers = []
+
+    # when
+    state_cache.get(answers.append, fields=['target_temperature'], max_age=5)
+
+    # then
+    assert answers == []
+    assert state_cache.refreshes == 1
+
+
+def test_timeout_serves_the_cached_values(moes_thermo, state_cache, clock):
+    # given
+    age(moes_thermo, 120)
+    answers = []
+    state_cache.get(answers.append, fields=['target_temperature'])
+
+    # when
+    clock.now += 5
+    moes_thermo.scheduler.run_due()
+
+    # then
+    assert len(answers) == 1
+    assert answers[0]['state'] == {'target_temperature': 21.5}
+    assert answers[0]['stale'] == ['target_temperature']
+
+
+def test_disconnected_device_is_not_polled(moes_thermo, state_cache):
+    # given
+    age(moes_thermo, 120)
+    moes_thermo.connection.record_failure()
+    answers = []
+
+    # when
+    state_cache.get(answers.append)
+
+    # then
+    assert len(answers) == 1
+    assert len(answers[0]['stale']) == len(state_cache.fields)
+    moes_thermo.request_status.assert_not_called()
+
+
+def test_unknown_fields_are_ignored(state_cache):
+    # when
+    snapshot = state_cache.get_blocking(fields=['target_temperature', 'not_a_field'])
+
+    # then
+    assert list(snapshot['state']) == ['target_temperature']
+
+# ***************************************************************************************
+def test_http_state_of_a_device(state_cache):
+    # given
+    registry = StateCacheRegistry()
+    registry.register(state_cache)
+
+    # when
+    status, body = registry.handle_http('/state/MOCK-Moes', 'fields=target_temperature,eco_mode')
+
+    # then
+    assert status == 200
+    assert json.loads(body)['state'] == {'target_temperature': 21.5, 'eco_mode': False}
+
+
+def test_http_state_of_all_devices(state_cache):
+    # given
+    registry = StateCacheRegistry()
+    registry.register(state_cache)
+
+    # when
+    status, body = registry.handle_http('/state', '')
+
+    # then
+    assert status == 200
+    assert list(json.loads(body)) == ['MOCK-Moes']
+
+
+def test_http_unknown_device_and_bad_max_age(state_cache):
+    # given
+    registry = StateCacheRegistry()
+    registry.register(state_cache)
+
+    # then
+    assert registry.handle_http('/state/OTHER', '')[0] == 404
+    assert json.loads(registry.handle_http('/state/OTHER', '')[1])['devices'] == ['MOCK-Moes']
+    assert registry.handle_http('/state/MOCK-Moes', 'max_age=soon')[0] == 400
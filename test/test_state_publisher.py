@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+import pytest
+import logging
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.enums import MQTTErrorCode
+from tinytuya.Contrib import ThermostatDevice
+
+import generic.config as config
+from generic import serializers
+from generic.config_logging import init_logging
+from generic.scheduler import TimerScheduler
+from bridge.state_publisher import StatePublisher
+from moes.MoesThermostat import MoesBhtThermostat
+from mqtt.mqtt_server import MqttClient
+
+
+##########################################################################################################
+
+TOPIC = 'home/hvac/thermostat/MOCK-Moes/STATE'
+
+# ***************************************************************************************
+@pytest.fixture(scope="session", autouse=True)
+def active_config():
+    return config.ActiveConfig(app_name=__name__, config=config.DEV)
+
+@pytest.fixture(scope="session", autouse=True)
+def setup_before_any_test(active_config):
+    init_logging(active_config)
+
+
+class FakeClock(object):
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+@pytest.fixture
+def mock_tuya_device(mocker) -> ThermostatDevice:
+    mocker.patch.object(ThermostatDevice, 'sendPing', return_value=None)
+    mocker.patch.object(ThermostatDevice, 'status', return_value=None)
+
+    return ThermostatDevice('123', '1.1.1.1', '', version=3.3)
+
+@pytest.fixture
+def moes_thermo(mock_tuya_device, clock) -> MoesBhtThermostat:
+    thermostat = MoesBhtThermostat(name="MOCK-Moes", tuya_id='123', local_ip='1.1.1.1', tuya_local_key='secret_key')
+    thermostat.scheduler = TimerScheduler(time_func=clock)
+    return thermostat
+
+@pytest.fixture
+def mock_mqtt_client(mocker) -> mqtt.Client:
+    mocker.patch.object(mqtt.Client, 'connect', return_value=MQTTErrorCode.MQTT_ERR_SUCCESS)
+    mocker.patch.object(mqtt.Client, 'publish', return_value=None)
+
+    return mqtt.Client()
+
+@pytest.fixture
+def publisher(moes_thermo, mock_mqtt_client) -> StatePublisher:
+    mqtt_service = MqttClient(name='Mqtt', broker_address='broker_address', broker_port=1234,
+                              username="mqtt_user", password="mqtt_password", tls_cert_path=None,
+                              client=mock_mqtt_client)
+    publisher = StatePublisher(moes_thermo, mqtt_service, TOPIC, refresh_seconds=600)
+    publisher.start()
+    return publisher
+
+# ***************************************************************************************
+def test_state_change_published_retained(publisher, mock_mqtt_client):
+    # when
+    published = publisher.publish({'is_on': True})
+
+    # then
+    assert published
+    mock_mqtt_client.publish.assert_called_once_with(TOPIC, serializers.dumps({'is_on': True}), qos=0, retain=True)
+
+
+def test_duplicate_state_not_republished_inside_window(publisher, mock_mqtt_client, clock):
+    # given
+    publisher.publish({'is_on': True})
+    clock.now += 10
+
+    # when
+    published = publisher.publish({'is_on': True})
+
+    # then
+    assert not published
+    assert mock_mqtt_client.publish.call_count == 1
+
+
+def test_state_republished_when_refresh_window_expires(publisher, moes_thermo, mock_mqtt_client, clock):
+    # given
+    moes_thermo.is_synchronized = True
+    publisher.publish(moes_thermo.state_current.to_dict())
+
+    # when
+    clock.now += 599
+    moes_thermo.scheduler.run_due()
+    assert mock_mqtt_client.publish.call_count == 1
+    clock.now += 1.1
+    moes_thermo.scheduler.run_due()
+
+    # then
+    assert mock_mqtt_client.publish.call_count == 2
+    assert publisher.last_published_time == clock.now
+
+
+def test_state_change_postpones_the_refresh(publisher, moes_thermo, mock_mqtt_client, clock):
+    # given
+    moes_thermo.is_synchronized = True
+    publisher.publish({'is_on': True})
+
+    # when
+    clock.now += 500
+    publisher.publish({'is_on': False})
+    clock.now += 200
+    moes_thermo.scheduler.run_due()
+
+    # then
+    assert mock_mqtt_client.publish.call_count == 2
+    assert moes_thermo.scheduler.deadline_of(publisher.timer_key) == clock.now - 200 + 600
+
+
+def test_unsynchronized_state_not_refreshed(publisher, moes_thermo, mock_mqtt_client, clock):
+    # given
+    moes_thermo.is_synchronized = False
+
+    # when
+    clock.now += 601
+    moes_thermo.scheduler.run_due()
+
+    # then
+    mock_mqtt_client.publish.assert_not_called()
+    assert moes_thermo.scheduler.deadline_of(publisher.timer_key) == clock.now + 600
+
+
+def test_field_topics_publish_only_changed_fields(publisher, mock_mqtt_client):
+    # given
+    publisher.field_topics = True
+    publisher.publish({'is_on': True, 'target_temperature': 21.0})
+    mock_mqtt_client.publish.reset_mock()
+
+    # when
+    published = publisher.publish({'is_on': True, 'target_temperature': 21.5})
+
+    # then
+    assert published
+    mock_mqtt_client.publish.assert_called_once_with(f'{TOPIC}/target_temperature', b'21.5', qos=0, retain=True)
+
+
+def test_field_topics_snapshot_published_on_first_publish_and_refresh(publisher, moes_thermo, mock_mqtt_client, clock):
+    # given
+    publisher.field_topics = True
+    moes_thermo.is_synchronized = True
+
+    # when
+    publisher.publish(moes_thermo.state_current.to_dict())
+    clock.now += 601
+    moes_thermo.scheduler.run_due()
+
+    # then
+    snapshot_calls = [call for call in mock_mqtt_client.publish.call_args_list if call.args[0] == TOPIC]
+    assert len(snapshot_calls) == 2
+
+# ***************************************************************************************
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+import pytest
+
+import time
+
+from bridge.state_store import StateStore
+
+STATE = {'is_on': True, 'target_temperature': 21.5, 'home_temperature': 19.5,
+         'manual_operating_mode': False, 'eco_mode': False, 'lock_enabled': False}
+
+
+##########################################################################################################
+
+# ***************************************************************************************
+@pytest.fixture
+def store_path(tmp_path) -> str:
+    return str(tmp_path / 'state' / 'bridge_state.jsonl')
+
+
+@pytest.fixture
+def state_store(store_path) -> StateStore:
+    return StateStore(store_path, compact_lines=5)
+
+# ***************************************************************************************
+def test_saved_states_are_loaded_back(state_store, store_path):
+    # given
+    state_store.save('LIVING', STATE, {'target_temperature': 1000.0}, synchronized=True)
+    state_store.save('LIVING', {**STATE, 'eco_mode': True}, synchronized=True)
+    state_store.save('KITCHEN', STATE)
+
+    # when
+    written = state_store.flush()
+    records = StateStore(store_path).load()
+
+    # then
+    assert written == 2
+    assert records['LIVING']['state']['eco_mode'] is True
+    assert records['LIVING']['synchronized'] is True
+    assert records['KITCHEN']['state'] == STATE
+    assert records['KITCHEN']['updated'] == {}
+
+
+def test_unchanged_state_is_not_written_again(state_store):
+    # given
+    state_store.save('LIVING', STATE)
+    state_store.flush()
+
+    # when
+    is_saved = state_store.save('LIVING', dict(STATE))
+
+    # then
+    assert is_saved is False
+    assert state_store.flush() == 0
+    assert state_store.lines == 1
+
+
+def test_invalid_lines_are_skipped(state_store, store_path):
+    # given
+    state_store.save('LIVING', STATE)
+    state_store.flush()
+    with open(store_path, 'ab') as store_file:
+        store_file.write(b'{"device": "KITCHEN", "state": {"is_on"')
+
+    # when
+    records = StateStore(store_path).load()
+
+    # then
+    assert list(records) == ['LIVING']
+
+
+def test_store_is_compacted(state_store, store_path):
+    # when
+    for i in range(7):
+        state_store.save('LIVING', {**STATE, 'target_temperature': 20.0 + i})
+        state_store.flush()
+
+    # then
+    with open(store_path, 'rb') as store_file:
+        lines = store_file.readlines()
+    assert len(lines) <= 5
+    assert StateStore(store_path).load()['LIVING']['state']['target_temperature'] == 26.0
+
+
+def test_states_written_by_the_background_thread(state_store, store_path):
+    # given
+    state_store.start()
+
+    # when
+    state_store.save('LIVING', STATE)
+    deadline = time.time() + 5
+    while state_store.writes == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    state_store.stop()
+
+    # then
+    assert StateStore(store_path).load()['LIVING']['state'] == STATE
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+import pytest
+
+from moes.status_interval import AdaptiveStatusInterval
+
+
+##########################################################################################################
+
+# ***************************************************************************************
+@pytest.fixture
+def status_interval() -> AdaptiveStatusInterval:
+    return AdaptiveStatusInterval('LIVING', initial_seconds=60, min_seconds=15, max_seconds=300,
+                                  growth_factor=2, active_seconds=120, time_func=lambda: 1000.0)
+
+# ***************************************************************************************
+def test_interval_stretches_up_to_the_max_while_stable(status_interval):
+    # when
+    delays = [status_interval.on_status_request(now=1000.0 + i * 300) for i in range(4)]
+
+    # then
+    assert delays == [120, 240, 300, 300]
+    assert status_interval.status_requests == 4
+
+
+def test_command_shortens_the_interval_while_active(status_interval):
+    # given
+    status_interval.on_status_request(now=1000.0)
+
+    # when
+    delay = status_interval.on_interaction(now=1000.0)
+
+    # then
+    assert delay == 15
+    assert status_interval.on_status_request(now=1015.0) == 15
+    assert status_interval.on_status_request(now=1119.0) == 15
+    # the device is idle again
+    assert status_interval.on_status_request(now=1135.0) == 30
+
+
+def test_state_changes_are_counted_per_hour(status_interval):
+    # when
+    for i in range(3):
+        status_interval.on_state_change(now=1000.0 + i * 60)
+
+    # then
+    assert status_interval.seconds == 15
+    assert status_interval.changes_per_hour(now=1200.0) == 3
+    assert status_interval.changes_per_hour(now=1000.0 + 3600 + 90) == 1
+
+
+def test_measured_value_changes_only_count_in_the_rate(status_interval):
+    # when
+    delays = [status_interval.on_state_change(now=1000.0 + i * 60, is_interaction=False) for i in range(3)]
+
+    # then
+    assert delays == [60, 60, 60]
+    assert status_interval.active_until is None
+    assert status_interval.changes_per_hour(now=1200.0) == 3
+
+
+def test_initial_interval_within_the_bounds():
+    # then
+    assert AdaptiveStatusInterval('LIVING', initial_seconds=600, min_seconds=15, max_seconds=300).seconds == 300
+    with pytest.raises(ValueError):
+        AdaptiveStatusInterval('LIVING', min_seconds=60, max_seconds=30)
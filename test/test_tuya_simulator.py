@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+import pytest
+
+import time
+
+from bridge.inventory import DeviceInventory
+from moes.MoesThermostat import MoesBhtThermostat, ThermostatState
+from moes.async_engine import AsyncTuyaEngine
+from simulator.tuya_simulator import TuyaDeviceSimulator, SimulatorProfile, VirtualThermostat
+
+
+##########################################################################################################
+
+# ***************************************************************************************
+@pytest.fixture
+def simulator() -> TuyaDeviceSimulator:
+    simulator = TuyaDeviceSimulator.create(3, base_ip='127.0.0.1', port=0, same_ip=True,
+                                           profile=SimulatorProfile(drop_after_commands=3, drop_seconds=60)).start()
+    yield simulator
+    simulator.stop()
+
+
+def thermostat_of(device: VirtualThermostat) -> MoesBhtThermostat:
+    thermostat = MoesBhtThermostat(name=device.name, tuya_id=device.tuya_id, local_ip=device.host,
+                                   tuya_local_key=device.local_key, port=device.port)
+    thermostat.commands.debounce_seconds = 0
+    return thermostat
+
+
+def wait_until(condition, timeout: float = 5) -> bool:
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+# ***************************************************************************************
+def test_status_and_writes_over_the_tuya_protocol(simulator):
+    # given
+    device = simulator.devices[0]
+    thermostat = thermostat_of(device)
+
+    # when
+    thermostat.connect()
+    thermostat.set_state(ThermostatState.from_json({'target_temperature': 22.5, 'eco_mode': True}))
+
+    # then
+    assert thermostat.is_synchronized
+    assert thermostat.state_current.home_temperature == 20.0
+    assert device.dps['2'] == 45 and device.dps['5'] is True
+    assert device.stats.status_requests == 1 and device.stats.commands == 1
+    thermostat.device.close()
+
+
+def test_changes_pushed_by_the_device(simulator):
+    # given
+    device = simulator.devices[0]
+    thermostat = thermostat_of(device)
+    thermostat.connect()
+
+    # when
+    simulator.call_soon_threadsafe(device.set_dps, {'3': 44})
+    assert wait_until(lambda: device.stats.pushes == 1)
+    thermostat.handle_data(thermostat.device.receive())
+
+    # then
+    assert thermostat.state_current.home_temperature == 22.0
+    thermostat.device.close()
+
+
+def test_eco_mode_change_is_not_pushed(simulator):
+    # given
+    device = simulator.devices[0]
+    thermostat = thermostat_of(device)
+    thermostat.connect()
+    # the write waits for a push that never comes
+    thermostat.device.set_socketTimeout(0.2)
+
+    # when
+    thermostat.set_state(ThermostatState.from_json({'eco_mode': True}))
+
+    # then
+    assert device.dps['5'] is True
+    assert device.stats.pushes == 0
+    thermostat.device.close()
+
+
+def test_device_drops_the_connection_after_commands(simulator):
+    # given
+    device = simulator.devices[0]
+    thermostat = thermostat_of(device)
+    thermostat.connect()
+
+    # when
+    for target_temperature in (20.5, 21.0, 21.5):
+        thermostat.set_state(ThermostatState.from_json({'target_temperature': target_temperature}))
+
+    # then
+    assert device.stats.drops == 1
+    assert not device.is_available
+    thermostat.device.close()
+    assert 'Error' in thermostat.device.status()
+    assert device.stats.refused_connections >= 1
+
+
+def test_async_engine_synchronizes_the_fleet(simulator):
+    # given
+    thermostats = [thermostat_of(device) for device in simulator.devices]
+    engine = AsyncTuyaEngine(thermostats)
+
+    # when
+    engine.start()
+    try:
+        assert wait_until(lambda: all(thermostat.is_synchronized for thermostat in thermostats))
+        thermostats[1].submit_state(ThermostatState(lock_enabled=True))
+        assert wait_until(lambda: simulator.devices[1].dps['6'] is True)
+    finally:
+        engine.stop()
+
+    # then
+    assert all(device.stats.connections == 1 for device in simulator.devices)
+
+
+def test_inventory_of_the_simulated_devices(simulator):
+    # when
+    inventory = DeviceInventory.from_json(simulator.inventory())
+
+    # then
+    assert [device.name for device in inventory.devices] == ['SIM-0000', 'SIM-0001', 'SIM-0002']
+    assert [device.port for device in inventory.devices] == [device.port for device in simulator.devices]
+    assert all(device.local_ip == '127.0.0.1' for device in inventory.devices)